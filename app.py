@@ -1,89 +1,105 @@
 import json
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
-import openai
+from flask import Flask, Blueprint, Response, current_app, has_app_context, render_template, request, jsonify, session, redirect, url_for, stream_with_context
 import os
+import queue
+import threading
+import time
 from dotenv import load_dotenv
+from flask.sessions import SecureCookieSessionInterface
 from flask_sqlalchemy import SQLAlchemy
-from openai import OpenAI
+from llm_client import get_llm_client
+from model_router import build_model_router
+from suggestion_pool import build_suggestion_pool, pool_enabled
+from twist_cache import build_twist_cache, cache_enabled, normalize_wish
+from twist_fallback import build_twist_library, failure_reason, fallback_enabled, seed_worthy, twist_deadline
+from leaderboard_store import build_leaderboard_store
+from leaderboard_feed import LEADERBOARD_SIZE, RESYNC, build_leaderboard_feed, keepalive_seconds, push_enabled, stream_seconds
+from scoring import WishScorer
+from history_writer import build_history_writer, write_behind_enabled
+from history_archive import gzip_ndjson, history_record
+from stats_rollup import RollupBatch, rates, stats_enabled, stats_shards, write_rollups
+from single_flight import build_single_flight, flight_key, single_flight_enabled
+from token_budget import TokenLedger, compact_prompt, llm_call, suggestion_max_tokens, wish_max_tokens
+from idempotency import BUSY, REPLAY, build_idempotency_keys, valid_key as valid_idempotency_key
+from static_assets import load_asset_manifest
+from rate_limit_store import tiered_enabled, trusted_proxy_hops
+from schema_migrations import build_migration_runner
+from validation import clean_markup, validate_username, validate_wish
+from observability import build_metrics, configure_logging, logger
 import random
-import re
-import bleach
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from flask_wtf.csrf import CSRFProtect
+from werkzeug.middleware.proxy_fix import ProxyFix
 import secrets
 import redis
-from datetime import datetime
+from datetime import datetime, timedelta
+from sqlalchemy import case, func, inspect, select, update
 
 load_dotenv()
+configure_logging()
+metrics = build_metrics()
 
+# Extensions are created unbound and attached by create_app(), so importing
+# this module never touches the database, Redis or the LLM
+db = SQLAlchemy()
+csrf = CSRFProtect()
+limiter = Limiter(
+    key_func=get_remote_address,
+    default_limits=["200 per day", "50 per hour"]
+)
+bp = Blueprint("main", __name__)
 
-app = Flask(__name__)
+# Per-process components that need Redis or an app, built on first use
+_components = {}
+_components_lock = threading.RLock()
 
-# Security Configuration
-app.secret_key = os.getenv("FLASK_SECRET_KEY", secrets.token_hex(32))
-app.config['WTF_CSRF_ENABLED'] = True
-app.config['WTF_CSRF_TIME_LIMIT'] = 3600  # 1 hour
-app.config['PERMANENT_SESSION_LIFETIME'] = 3600  # 1 hour session timeout
-app.config['SESSION_COOKIE_SECURE'] = True  # Force to False for local development
-app.config['SESSION_COOKIE_HTTPONLY'] = True
-app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
+def lazy_component(name, build):
+    """Return a per-process component, building it on first use"""
+    if name not in _components:
+        with _components_lock:
+            if name not in _components:
+                _components[name] = build()
+    return _components[name]
 
-# Initialize security extensions
-csrf = CSRFProtect(app)
-
-# Configure rate limiter storage
-if os.getenv('FLASK_ENV') == 'production':
+def connect_redis():
+    """Connect to Redis for shared game state, or return None to use per-process fallbacks"""
+    if os.getenv('FLASK_ENV') != 'production':
+        return None
     try:
-        from flask_limiter.util import get_remote_address
-        from flask_limiter import Limiter
-        import redis
+        client = redis.Redis.from_url(os.getenv('REDIS_URL', 'redis://localhost:6379'))
+        client.ping()
+        return client
+    except Exception as e:
+        logger.warning("Redis not available for shared game state: %s", e)
+        return None
 
+def get_redis_client():
+    return lazy_component("redis", connect_redis)
+
+def init_limiter(app):
+    """Attach the rate limiter, with Redis-backed storage in production"""
+    if os.getenv('FLASK_ENV') == 'production':
         redis_url = os.getenv('REDIS_URL', 'redis://localhost:6379')
-        print("DEBUG: Attempting to use Redis at", redis_url)
-        # Try a direct connection test
+        if tiered_enabled():
+            # Checks are answered per worker and synced to Redis in batches;
+            # the storage keeps limiting on its own if Redis goes away
+            app.config['RATELIMIT_STORAGE_URI'] = 'tiered+' + redis_url
+        else:
+            app.config['RATELIMIT_STORAGE_URI'] = redis_url
+            # Keep limiting per process if Redis goes away, instead of failing requests
+            app.config['RATELIMIT_IN_MEMORY_FALLBACK_ENABLED'] = True
         try:
-            r = redis.Redis.from_url(redis_url)
-            r.ping()
-            print("DEBUG: Successfully connected to Redis!")
-        except Exception as conn_err:
-            print("ERROR: Could not connect to Redis:", conn_err)
-
-        limiter = Limiter(
-            app=app,
-            key_func=get_remote_address,
-            storage_uri=redis_url,
-            default_limits=["200 per day", "50 per hour"]
-        )
-        print("✅ Rate limiter configured with Redis storage")
-    except ImportError as e:
-        print("⚠️ Redis not available (ImportError):", e)
-        limiter = Limiter(
-            app=app,
-            key_func=get_remote_address,
-            default_limits=["200 per day", "50 per hour"]
-        )
-    except Exception as e:
-        print("⚠️ Redis not available (Other Exception):", e)
-        limiter = Limiter(
-            app=app,
-            key_func=get_remote_address,
-            default_limits=["200 per day", "50 per hour"]
-        )
-else:
-    # Use memory storage for development (with warning suppression)
-    import warnings
-    with warnings.catch_warnings():
-        warnings.simplefilter("ignore")
-        limiter = Limiter(
-            app=app,
-            key_func=get_remote_address,
-            default_limits=["200 per day", "50 per hour"]
-        )
-    print("ℹ️ Rate limiter using memory storage (development mode)")
+            limiter.init_app(app)
+            logger.info("Rate limiter configured with %s storage", "tiered Redis" if tiered_enabled() else "Redis")
+            return
+        except Exception as e:
+            logger.warning("Redis not available for rate limiting: %s", e)
+    app.config['RATELIMIT_STORAGE_URI'] = 'memory://'
+    limiter.init_app(app)
+    logger.info("Rate limiter using memory storage")
 
 # Security headers middleware
-@app.after_request
 def add_security_headers(response):
     response.headers['X-Content-Type-Options'] = 'nosniff'
     response.headers['X-Frame-Options'] = 'DENY'
@@ -93,79 +109,108 @@ def add_security_headers(response):
         response.headers['Strict-Transport-Security'] = 'max-age=31536000; includeSubDomains'
     return response
 
-openai_api_key = os.getenv("OPENAI_API_KEY")
-if not openai_api_key:
-    print("Warning: OPENAI_API_KEY not set. The wish functionality will not work.")
-
-# Database setup
-database_url = os.getenv('DATABASE_URL')
-if database_url and database_url.startswith('postgres://'):
-    database_url = database_url.replace('postgres://', 'postgresql://', 1)
-app.config['SQLALCHEMY_DATABASE_URI'] = database_url or 'postgresql://localhost:5432/monkeypaw'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db = SQLAlchemy(app)
-
-# Input validation functions
-def validate_username(username):
-    """Validate and sanitize username input"""
-    if not username or len(username.strip()) == 0:
-        return None, "Username cannot be empty"
-    
-    username = username.strip()
-    
-    # Length validation
-    if len(username) < 2 or len(username) > 50:
-        return None, "Username must be between 2 and 50 characters"
-    
-    # Character validation - only allow alphanumeric, hyphens, and underscores
-    if not re.match(r'^[a-zA-Z0-9_-]+$', username):
-        return None, "Username can only contain letters, numbers, hyphens, and underscores"
-    
-    # Sanitize to prevent XSS
-    username = bleach.clean(username, tags=[], strip=True)
-    
-    return username, None
+class SessionInterface(SecureCookieSessionInterface):
+    """Cookie sessions that leave fingerprinted asset responses alone.
 
-def validate_wish(wish):
-    """Validate and sanitize wish input"""
-    if not wish or len(wish.strip()) == 0:
-        return None, "Wish cannot be empty"
-    
-    wish = wish.strip()
-    
-    # Length validation
-    if len(wish) < 5 or len(wish) > 500:
-        return None, "Wish must be between 5 and 500 characters"
-    
-    # Check for potentially malicious content
-    dangerous_patterns = [
-        r'<script', r'javascript:', r'data:', r'vbscript:', r'on\w+\s*=',
-        r'<iframe', r'<object', r'<embed', r'<form', r'<input'
-    ]
-    
-    for pattern in dangerous_patterns:
-        if re.search(pattern, wish, re.IGNORECASE):
-            return None, "Wish contains potentially unsafe content"
-    
-    # Sanitize to prevent XSS while preserving basic formatting
-    allowed_tags = ['b', 'i', 'em', 'strong']
-    wish = bleach.clean(wish, tags=allowed_tags, strip=True)
-    
-    return wish, None
+    A permanent session is re-sent on every response, and a Set-Cookie or
+    Vary: Cookie header would stop browsers and CDNs sharing the cached file.
+    """
 
-# Only create tables in development
-if os.getenv('FLASK_ENV') != 'production':
-    with app.app_context():
-        db.create_all()
-else:
-    # In production, try to create tables if they don't exist
+    def save_session(self, app, session, response):
+        if request.endpoint == "main.asset":
+            return
+        super().save_session(app, session, response)
+
+def create_app():
+    """Build the Flask app.
+
+    Only configuration happens here. Redis, the LLM client and background
+    workers are set up on first use in each worker, and the schema check is
+    left to ensure_schema(), so the app is cheap to build and safe to
+    preload in the gunicorn master (see gunicorn.conf.py).
+    """
+    app = Flask(__name__)
+    # Behind Render's proxy the client is the address the proxy appended to
+    # X-Forwarded-For; anything before it was sent by the client
+    proxy_hops = trusted_proxy_hops()
+    if proxy_hops:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxy_hops)
+
+    # Security Configuration
+    app.secret_key = os.getenv("FLASK_SECRET_KEY", secrets.token_hex(32))
+    app.session_interface = SessionInterface()
+    app.config['WTF_CSRF_ENABLED'] = True
+    app.config['WTF_CSRF_TIME_LIMIT'] = 3600  # 1 hour
+    app.config['PERMANENT_SESSION_LIFETIME'] = 3600  # 1 hour session timeout
+    app.config['SESSION_COOKIE_SECURE'] = True  # Force to False for local development
+    app.config['SESSION_COOKIE_HTTPONLY'] = True
+    app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
+    app.config['RATELIMIT_ENABLED'] = os.getenv('RATELIMIT_ENABLED', '1') != '0'  # Only disable for local load tests
+
+    # Database setup
+    database_url = os.getenv('DATABASE_URL')
+    if database_url and database_url.startswith('postgres://'):
+        database_url = database_url.replace('postgres://', 'postgresql://', 1)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url or 'postgresql://localhost:5432/monkeypaw'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # Connections are only held around queries, so a small pool serves many gevent requests
+    engine_options = {}
+    for option, env_name in (('pool_size', 'DB_POOL_SIZE'), ('max_overflow', 'DB_MAX_OVERFLOW')):
+        if os.getenv(env_name):
+            engine_options[option] = int(os.getenv(env_name))
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options
+
+    # Initialize extensions
+    db.init_app(app)
+    csrf.init_app(app)
+    init_limiter(app)
+    metrics.instrument_limiter(limiter)
+
+    app.before_request(metrics.start_request)
+    app.after_request(metrics.finish_request)
+    app.after_request(add_security_headers)
+    app.register_blueprint(bp)
+
+    # Templates link static files through the build manifest (see static_assets.py)
+    assets = load_asset_manifest()
+    app.extensions['assets'] = assets
+    app.jinja_env.globals.update(asset_url=assets.url, webp_url=assets.webp_url, asset_urls=assets.urls)
+
+    if not os.getenv("OPENAI_API_KEY") and os.getenv("LLM_BACKEND", "openai") != "fake":
+        logger.warning("OPENAI_API_KEY not set. The wish functionality will not work.")
+    return app
+
+def create_tables():
+    """db.create_all(), recording every migration as applied when it builds a new database"""
+    fresh = not inspect(db.engine).has_table(User.__tablename__)
+    db.create_all()
+    runner = build_migration_runner(db.engine)
+    if fresh:
+        # The models already have every migrated column and index
+        runner.stamp()
+    return runner
+
+def ensure_schema(app):
+    """Create any missing tables and refuse to start while migrations are pending;
+    run once per deploy or master process, not per worker"""
     with app.app_context():
+        pending = []
         try:
-            db.create_all()
-            print("✅ Database tables created/verified successfully!")
+            runner = create_tables()
+            logger.info("Database tables created/verified successfully")
+            pending = runner.pending()
         except Exception as e:
-            print(f"⚠️ Database initialization warning: {e}")
             # Continue running even if tables already exist
+            logger.warning("Database initialization warning: %s", e)
+        finally:
+            # Don't hand connections opened here to forked workers
+            db.engine.dispose()
+    if pending:
+        # create_all() adds missing tables but not columns or indexes on existing ones,
+        # and queries on those would fail on every request
+        versions = ", ".join(m.version for m in pending)
+        logger.error("%d database migration(s) pending: %s", len(pending), versions)
+        raise RuntimeError(f"Database migrations pending ({versions}); run python migrate.py first")
 
 class User(db.Model):
     __tablename__ = 'users'
@@ -178,6 +223,7 @@ class User(db.Model):
     avoided_twists = db.Column(db.Integer, default=0)
     spellbook_uses = db.Column(db.Integer, default=0)
     session_number = db.Column(db.Integer, default=1)  # Track game sessions
+    last_game_wishes = db.Column(db.Integer, default=0)  # Wishes made in the last finished game
 
     def to_dict(self):
         return {
@@ -205,6 +251,71 @@ class WishHistory(db.Model):
     negative_indicator_count = db.Column(db.Integer, nullable=True)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     session_number = db.Column(db.Integer, nullable=False, default=1)  # Game session
+    # Usage of the model call this wish paid for; NULL when the twist was cached or shared
+    prompt_tokens = db.Column(db.Integer, nullable=True)
+    completion_tokens = db.Column(db.Integer, nullable=True)
+    llm_latency_ms = db.Column(db.Integer, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_wish_history_user_session_outcome', 'username', 'session_number', 'outcome'),
+        db.Index('ix_wish_history_timestamp', 'timestamp'),
+    )
+
+# Stats rollups (see stats_rollup.py). They are only ever added to, so
+# /stats never has to scan wish_history.
+class StatsCounters:
+    wishes = db.Column(db.Integer, nullable=False, default=0)
+    wins = db.Column(db.Integer, nullable=False, default=0)
+    losses = db.Column(db.Integer, nullable=False, default=0)
+    quality_bonus_sum = db.Column(db.Float, nullable=False, default=0.0)
+    positive_hits = db.Column(db.Integer, nullable=False, default=0)
+    negative_hits = db.Column(db.Integer, nullable=False, default=0)
+
+    def totals(self):
+        totals = {
+            'wishes': self.wishes,
+            'wins': self.wins,
+            'losses': self.losses,
+            'positive_indicator_hits': self.positive_hits,
+            'negative_indicator_hits': self.negative_hits,
+        }
+        totals.update(rates({'wishes': self.wishes, 'wins': self.wins, 'quality_bonus_sum': self.quality_bonus_sum}))
+        return totals
+
+class UserStats(StatsCounters, db.Model):
+    __tablename__ = 'user_stats'
+    username = db.Column(db.String(80), db.ForeignKey('users.username'), primary_key=True)
+    first_wish_at = db.Column(db.DateTime)
+    last_wish_at = db.Column(db.DateTime)
+
+class SessionStats(StatsCounters, db.Model):
+    __tablename__ = 'session_stats'
+    username = db.Column(db.String(80), db.ForeignKey('users.username'), primary_key=True)
+    session_number = db.Column(db.Integer, primary_key=True)
+    started_at = db.Column(db.DateTime)
+    ended_at = db.Column(db.DateTime)
+
+class DailyStats(StatsCounters, db.Model):
+    __tablename__ = 'daily_stats'
+    day = db.Column(db.Date, primary_key=True)
+    shard = db.Column(db.Integer, primary_key=True)
+
+class IndicatorStats(db.Model):
+    __tablename__ = 'indicator_stats'
+    username = db.Column(db.String(80), db.ForeignKey('users.username'), primary_key=True)
+    word = db.Column(db.String(40), primary_key=True)
+    kind = db.Column(db.String(10), nullable=False)  # 'positive' or 'negative'
+    hits = db.Column(db.Integer, nullable=False, default=0)
+
+class DailyIndicatorStats(db.Model):
+    __tablename__ = 'daily_indicator_stats'
+    day = db.Column(db.Date, primary_key=True)
+    shard = db.Column(db.Integer, primary_key=True)
+    word = db.Column(db.String(40), primary_key=True)
+    kind = db.Column(db.String(10), nullable=False)
+    hits = db.Column(db.Integer, nullable=False, default=0)
+
+ROLLUP_MODELS = (UserStats, SessionStats, DailyStats, IndicatorStats, DailyIndicatorStats)
 
 # Monkey's Paw Persona Prompt
 PAW_PROMPT = """
@@ -224,23 +335,26 @@ Respond with:
 - Final line: \"User outcome: WIN\" or \"User outcome: LOSE\"
 """
 
-@app.route("/")
+# What is actually sent: the same bytes on every call (see token_budget.py)
+PAW_SYSTEM_PROMPT = compact_prompt(PAW_PROMPT)
+
+@bp.route("/")
 def index():
     if "username" in session:
-        return redirect(url_for("game"))
+        return redirect(url_for("main.game"))
     return render_template("username.html")
 
-@app.route("/game")
+@bp.route("/game")
 def game():
     if "username" not in session:
-        return redirect(url_for("index"))
+        return redirect(url_for("main.index"))
     return render_template("index.html")
 
-@app.route("/username")
+@bp.route("/username")
 def username():
     return render_template("username.html")
 
-@app.route("/set_username", methods=["POST"])
+@bp.route("/set_username", methods=["POST"])
 @limiter.limit("10 per minute")
 def set_username():
     if request.is_json:
@@ -256,6 +370,7 @@ def set_username():
             user = User(username=validated_username)
             db.session.add(user)
             db.session.commit()
+            add_leaderboard_player(validated_username)
         session["username"] = validated_username
         session.permanent = True
         return jsonify({"success": True, "username": validated_username})
@@ -264,29 +379,800 @@ def set_username():
         validated_username, error = validate_username(username)
         if error:
             # Optionally flash error here
-            return redirect(url_for("index"))
+            return redirect(url_for("main.index"))
         user = User.query.filter_by(username=validated_username).first()
         if not user:
             user = User(username=validated_username)
             db.session.add(user)
             db.session.commit()
+            add_leaderboard_player(validated_username)
         session["username"] = validated_username
         session.permanent = True
-        return redirect(url_for("game"))
+        return redirect(url_for("main.game"))
+
+def get_leaderboard_store():
+    return lazy_component("leaderboard", lambda: build_leaderboard_store(get_redis_client()))
+
+def rebuild_leaderboard(announce=True):
+    """Rebuild the leaderboard store from the users table"""
+    rows = db.session.query(
+        User.username, User.high_score, User.avoided_twists, User.streak
+    ).yield_per(1000)
+    get_leaderboard_store().rebuild(rows)
+    if announce and push_enabled():
+        get_leaderboard_feed().announce()
+
+def leaderboard_top():
+    """The top of the leaderboard, or None if the store is empty and cannot be rebuilt here"""
+    store = get_leaderboard_store()
+    if store.needs_rebuild():
+        # The feed's Redis listener runs outside any app context
+        if not has_app_context():
+            return None
+        rebuild_leaderboard(announce=False)
+    return store.top(LEADERBOARD_SIZE)
+
+def get_leaderboard_feed():
+    return lazy_component("leaderboard_feed", lambda: build_leaderboard_feed(leaderboard_top, get_redis_client()))
+
+def announce_leaderboard_change(username):
+    """Tell stream subscribers about a change, if it can have touched the top of the board"""
+    if not push_enabled():
+        return
+    ranking = get_leaderboard_store().rank(username)
+    if ranking is not None and ranking[0] < LEADERBOARD_SIZE:
+        get_leaderboard_feed().announce()
+
+def update_leaderboard(user):
+    """Push a player's leaderboard row after a game over"""
+    try:
+        get_leaderboard_store().update(user.username, user.high_score, user.avoided_twists, user.streak)
+        announce_leaderboard_change(user.username)
+    except Exception as e:
+        # The users table stays authoritative; the next rebuild picks this up
+        logger.warning("Leaderboard update error: %s", e)
+
+def refresh_leaderboard_row(user):
+    """Keep a player's streak and avoided twists on the leaderboard current after a wish"""
+    try:
+        get_leaderboard_store().refresh(user.username, user.avoided_twists, user.streak)
+    except Exception as e:
+        logger.warning("Leaderboard update error: %s", e)
+
+def add_leaderboard_player(username):
+    """Make sure a newly registered player appears on the leaderboard"""
+    try:
+        get_leaderboard_store().add_player(username)
+        announce_leaderboard_change(username)
+    except Exception as e:
+        logger.warning("Leaderboard update error: %s", e)
 
-@app.route("/leaderboard", methods=["GET"])
+@bp.route("/leaderboard", methods=["GET"])
 @limiter.limit("30 per minute")
 def leaderboard():
     try:
-        users = User.query.order_by(User.high_score.desc()).limit(10).all()
-        # Return username, high_score, avoided_twists (from last game), and current streak
-        sorted_lb = [(u.username, u.high_score, u.avoided_twists, u.streak) for u in users]
-        return jsonify(sorted_lb)
+        leaderboard_store = get_leaderboard_store()
+        if leaderboard_store.needs_rebuild():
+            rebuild_leaderboard()
+        etag = leaderboard_store.get_version()
+        if etag in request.if_none_match:
+            response = current_app.response_class(status=304)
+        else:
+            # Return username, high_score, avoided_twists (from last game), and streak
+            response = jsonify([list(row) for row in leaderboard_store.top(LEADERBOARD_SIZE)])
+        response.set_etag(etag)
+        # Let browsers keep the board but revalidate it every time
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
     except Exception as e:
-        print("Leaderboard error:", e)
+        logger.exception("Leaderboard error")
         return jsonify({"error": "Could not load leaderboard"}), 500
 
-@app.route("/wish", methods=["POST"])
+@bp.route("/leaderboard/stream", methods=["GET"])
+@limiter.limit("10 per minute")
+def leaderboard_stream():
+    """Server-Sent Events: the whole board once, then only the rows that change"""
+    if not push_enabled():
+        return jsonify({"error": "Leaderboard push is disabled"}), 404
+    try:
+        feed = get_leaderboard_feed()
+        subscriber = feed.subscribe()
+        rows, digest = feed.snapshot()
+    except Exception:
+        logger.exception("Leaderboard stream error")
+        return jsonify({"error": "Could not load leaderboard"}), 500
+    # The stream holds no database connection while it waits
+    release_db_connection()
+
+    def generate():
+        try:
+            yield "retry: 5000\n" + sse_event("board", {"version": digest, "rows": rows})
+            keepalive = keepalive_seconds()
+            deadline = time.monotonic() + stream_seconds()
+            while time.monotonic() < deadline:
+                try:
+                    message = subscriber.get(timeout=min(keepalive, max(deadline - time.monotonic(), 0.01)))
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                if message is RESYNC:
+                    # Fell too far behind; the client reconnects for the whole board
+                    return
+                yield sse_event("diff", message)
+        finally:
+            feed.unsubscribe(subscriber)
+
+    response = Response(generate(), mimetype="text/event-stream")
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@bp.route("/leaderboard/rank", methods=["GET"])
+@limiter.limit("30 per minute")
+def leaderboard_rank():
+    try:
+        if "username" not in session:
+            return jsonify({"error": "No username set. Please enter your username to start."}), 401
+        leaderboard_store = get_leaderboard_store()
+        if leaderboard_store.needs_rebuild():
+            rebuild_leaderboard()
+        username = session["username"]
+        ranking = leaderboard_store.rank(username)
+        if ranking is None:
+            return jsonify({"error": "User not found."}), 404
+        rank, high_score = ranking
+        return jsonify({"username": username, "rank": rank + 1, "high_score": high_score})
+    except Exception as e:
+        logger.exception("Leaderboard rank error")
+        return jsonify({"error": "Could not load rank"}), 500
+
+@bp.route("/stats", methods=["GET"])
+@limiter.limit("30 per minute")
+def player_stats():
+    """Lifetime stats for the session user, read from the rollup tables only"""
+    try:
+        if "username" not in session:
+            return jsonify({"error": "No username set. Please enter your username to start."}), 401
+        username = session["username"]
+        totals = db.session.get(UserStats, username)
+        if totals is None:
+            if db.session.query(User.id).filter_by(username=username).first() is None:
+                return jsonify({"error": "User not found."}), 404
+            return jsonify({"username": username, "wishes": 0, "best_session": None,
+                            "top_indicators": {"positive": [], "negative": []}})
+        best = SessionStats.query.filter_by(username=username)\
+            .order_by(SessionStats.wins.desc(), SessionStats.session_number).first()
+        words = IndicatorStats.query.filter_by(username=username)\
+            .order_by(IndicatorStats.hits.desc(), IndicatorStats.word).all()
+        payload = {"username": username, **totals.totals()}
+        payload["first_wish_at"] = totals.first_wish_at.isoformat() if totals.first_wish_at else None
+        payload["last_wish_at"] = totals.last_wish_at.isoformat() if totals.last_wish_at else None
+        payload["best_session"] = {"session_number": best.session_number, **best.totals()} if best else None
+        payload["top_indicators"] = {
+            kind: [{"word": w.word, "hits": w.hits} for w in words if w.kind == kind][:5]
+            for kind in ("positive", "negative")
+        }
+        return jsonify(payload)
+    except Exception:
+        logger.exception("Stats error")
+        return jsonify({"error": "Could not load stats"}), 500
+
+# Per-worker cache of /stats/global responses: {days: (expires_at, payload)}
+_global_stats_cache = {}
+
+def load_global_stats(days):
+    """Totals, a per-day series and the top indicator words for the last `days` days"""
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    # The per-day rows are sharded; sum the shards back together
+    series = db.session.query(
+        DailyStats.day,
+        func.sum(DailyStats.wishes), func.sum(DailyStats.wins), func.sum(DailyStats.losses),
+        func.sum(DailyStats.quality_bonus_sum),
+        func.sum(DailyStats.positive_hits), func.sum(DailyStats.negative_hits),
+    ).filter(DailyStats.day >= since).group_by(DailyStats.day).order_by(DailyStats.day).all()
+    words = db.session.query(
+        DailyIndicatorStats.word, DailyIndicatorStats.kind, func.sum(DailyIndicatorStats.hits).label("hits")
+    ).filter(DailyIndicatorStats.day >= since).group_by(DailyIndicatorStats.word, DailyIndicatorStats.kind)\
+        .order_by(func.sum(DailyIndicatorStats.hits).desc(), DailyIndicatorStats.word).all()
+
+    columns = ("wishes", "wins", "losses", "quality_bonus_sum", "positive_hits", "negative_hits")
+    totals = dict.fromkeys(columns, 0)
+    days_out = []
+    for day, *values in series:
+        day_totals = dict(zip(columns, (value or 0 for value in values)))
+        for column in columns:
+            totals[column] += day_totals[column]
+        days_out.append({"day": day.isoformat(), "wishes": day_totals["wishes"], "wins": day_totals["wins"],
+                         "losses": day_totals["losses"], **rates(day_totals)})
+    return {
+        "days": days,
+        "since": since.isoformat(),
+        "wishes": totals["wishes"],
+        "wins": totals["wins"],
+        "losses": totals["losses"],
+        "positive_indicator_hits": totals["positive_hits"],
+        "negative_indicator_hits": totals["negative_hits"],
+        **rates(totals),
+        "daily": days_out,
+        "top_indicators": {
+            kind: [{"word": word, "hits": hits} for word, word_kind, hits in words if word_kind == kind][:5]
+            for kind in ("positive", "negative")
+        },
+    }
+
+@bp.route("/stats/global", methods=["GET"])
+@limiter.limit("30 per minute")
+def global_stats():
+    """Stats across all players for the last ?days= days (default 30), cached per worker"""
+    try:
+        days = min(max(int(request.args.get("days", 30)), 1), 366)
+    except ValueError:
+        return jsonify({"error": "days must be a number"}), 400
+    try:
+        cached = _global_stats_cache.get(days)
+        now = time.monotonic()
+        if cached is None or cached[0] <= now:
+            cached = (now + float(os.getenv("STATS_CACHE_SECONDS", "30")), load_global_stats(days))
+            _global_stats_cache[days] = cached
+        return jsonify(cached[1])
+    except Exception:
+        logger.exception("Global stats error")
+        return jsonify({"error": "Could not load stats"}), 500
+
+wish_scorer = WishScorer.from_env()
+
+def insert_history_rows(app, rows):
+    """Insert a batch of wish_history rows with one multi-row INSERT, plus their stats"""
+    with app.app_context():
+        with db.engine.begin() as connection:
+            connection.execute(WishHistory.__table__.insert(), rows)
+            write_history_rollups(connection, rows)
+
+def write_history_rollups(connection, rows):
+    """Add history rows to the stats rollups inside the caller's transaction"""
+    if not stats_enabled():
+        return
+    batch = RollupBatch(wish_scorer, stats_shards())
+    for row in rows:
+        batch.add(row)
+    write_rollups(connection, batch, {model.__tablename__: model.__table__ for model in ROLLUP_MODELS})
+
+def backfill_stats(batch_size=5000):
+    """Rebuild the stats rollups from wish_history; return the number of rows read.
+
+    History is read in id-keyed chunks, each applied and committed on its own.
+    """
+    for model in ROLLUP_MODELS:
+        db.session.execute(model.__table__.delete())
+    table = WishHistory.__table__
+    last_id = 0
+    total = 0
+    while True:
+        rows = db.session.execute(
+            select(table).where(table.c.id > last_id).order_by(table.c.id).limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        write_history_rollups(db.session.connection(), [row._mapping for row in rows])
+        db.session.commit()
+        last_id = rows[-1].id
+        total += len(rows)
+    db.session.commit()
+    return total
+
+def build_app_history_writer():
+    # The flusher runs outside requests, so it holds on to the app for its context
+    app = current_app._get_current_object()
+    return build_history_writer(lambda rows: insert_history_rows(app, rows))
+
+def get_history_writer():
+    return lazy_component("history_writer", build_app_history_writer)
+
+def iter_history(since=None, until=None, chunk_size=5000):
+    """Yield wish_history records in id order, fetched in chunks through a server-side cursor"""
+    table = WishHistory.__table__
+    query = select(table).order_by(table.c.id).execution_options(yield_per=chunk_size)
+    if since is not None:
+        query = query.where(table.c.timestamp >= since)
+    if until is not None:
+        query = query.where(table.c.timestamp < until)
+    for row in db.session.execute(query):
+        yield history_record(row)
+
+def export_history(archive, since=None, until=None, chunk_size=5000):
+    """Write history rows to an archive one chunk at a time; return the number of rows"""
+    exported = 0
+    batch = []
+    for record in iter_history(since, until, chunk_size):
+        batch.append(record)
+        if len(batch) >= chunk_size:
+            archive.write(batch)
+            exported += len(batch)
+            batch = []
+    if batch:
+        archive.write(batch)
+        exported += len(batch)
+    return exported
+
+def prunable_history(cutoff):
+    """History rows older than the cutoff, except each player's current and last finished game.
+
+    Those two games stay because avoided_twists and the per-game counts are
+    derived from them.
+    """
+    table = WishHistory.__table__
+    return select(table).join(User.__table__, User.username == table.c.username).where(
+        table.c.timestamp < cutoff,
+        table.c.session_number < User.session_number - 1,
+    )
+
+def count_prunable_history(older_than_days):
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    return db.session.execute(
+        select(func.count()).select_from(prunable_history(cutoff).subquery())
+    ).scalar()
+
+def archive_old_history(archive, older_than_days, batch_size=1000, max_batches=None, pause=0.0):
+    """Archive and delete old history rows in small batches; return the number of rows moved.
+
+    Each batch is written to the archive before it is deleted, and deleted
+    in its own short transaction so the table is never locked for long.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    table = WishHistory.__table__
+    last_id = 0
+    moved = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        rows = db.session.execute(
+            prunable_history(cutoff).where(table.c.id > last_id).order_by(table.c.id).limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        records = [history_record(row) for row in rows]
+        archive.write(records)
+        ids = [record["id"] for record in records]
+        db.session.execute(table.delete().where(table.c.id.in_(ids)))
+        db.session.commit()
+        last_id = ids[-1]
+        moved += len(ids)
+        batches += 1
+        logger.info("Archived history batch", extra={"fields": {"rows": len(ids), "last_id": last_id}})
+        if pause:
+            time.sleep(pause)
+    return moved
+
+def apply_outcome(content, result):
+    """Rewrite the paw's outcome line so it matches the rolled result"""
+    if result == "win":
+        # Update the content to reflect the win
+        content = content.replace("User outcome: LOSE", "User outcome: WIN")
+        if "User outcome: lose" in content:
+            content = content.replace("User outcome: lose", "User outcome: WIN")
+    else:
+        # Update the content to reflect the loss
+        content = content.replace("User outcome: WIN", "User outcome: LOSE")
+        if "User outcome: win" in content:
+            content = content.replace("User outcome: win", "User outcome: LOSE")
+    return content
+
+def release_db_connection():
+    """End the read transaction so its pooled connection isn't held while the LLM is called.
+
+    Under gevent workers hundreds of requests wait on the model at once and
+    must not each pin one of the few database connections. Loaded objects
+    are expired and reload on next access.
+    """
+    db.session.commit()
+
+def build_wish_messages(validated_wish):
+    """Build the chat messages sent to the paw for a wish.
+
+    The system prompt already says how to answer, so the user message is
+    only the wish and the static prefix is everything before it.
+    """
+    return [
+        {"role": "system", "content": PAW_SYSTEM_PROMPT},
+        {"role": "user", "content": f"I wish: {validated_wish}"}
+    ]
+
+# A game ends after this many losses in a row
+MAX_FAILED_WISHES = 5
+
+def apply_wish_result(username, result):
+    """Apply one wish's result to the player's game state in a single UPDATE ... RETURNING.
+
+    Every column is computed from the row's current values inside the
+    statement, so concurrent wishes for the same player (two tabs, a
+    double-click) serialize on the row lock instead of overwriting each
+    other, and the game-over rollover happens in the same statement.
+    Returns None if the player does not exist.
+    """
+    # avoided_twists counts this game's wins. After a game over it keeps the
+    # finished game's total for the leaderboard, so it is reset on the first
+    # wish of the next game (wishes_made was reset to 0 at game over).
+    first_wish = User.wishes_made == 0
+    if result == "win":
+        values = {
+            User.wishes_made: User.wishes_made + 1,
+            User.streak: User.streak + 1,
+            User.failed_wishes: 0,
+            User.avoided_twists: case((first_wish, 0), else_=func.coalesce(User.avoided_twists, 0)) + 1,
+        }
+    else:
+        game_over = User.failed_wishes + 1 >= MAX_FAILED_WISHES
+        values = {
+            User.wishes_made: case((game_over, 0), else_=User.wishes_made + 1),
+            User.last_game_wishes: case((game_over, User.wishes_made + 1), else_=User.last_game_wishes),
+            User.streak: 0,
+            User.failed_wishes: case((game_over, 0), else_=User.failed_wishes + 1),
+            User.avoided_twists: case((first_wish, 0), else_=User.avoided_twists),
+            User.spellbook_uses: case((game_over, 0), else_=User.spellbook_uses),
+            User.session_number: case((game_over, User.session_number + 1), else_=User.session_number),
+        }
+    statement = (
+        update(User)
+        .where(User.username == username)
+        .values(values)
+        .returning(
+            User.username, User.streak, User.wishes_made, User.failed_wishes, User.high_score,
+            User.avoided_twists, User.spellbook_uses, User.session_number, User.last_game_wishes,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    return db.session.execute(statement).one_or_none()
+
+def record_wish(username, validated_wish, content, result, score, call=None, fallback=False):
+    """Update the player's game state, store the wish and return the response payload.
+
+    ``call`` is the LLMCall the twist came from, or None for a cached or shared twist.
+    ``fallback`` marks a twist made locally because the model missed its deadline.
+    """
+    # Counted once the twist is in, so no transaction stays open during the model call
+    state = apply_wish_result(username, result)
+    if state is None:
+        db.session.rollback()
+        raise LookupError(f"user {username!r} no longer exists")
+    # A losing wish only leaves failed_wishes at 0 when it ended the game
+    game_over = result != "win" and state.failed_wishes == 0
+    # The history row belongs to the game the wish was made in
+    session_number = state.session_number - 1 if game_over else state.session_number
+
+    # Store wish history in the database
+    ip_address = request.remote_addr  # The client, once ProxyFix has read X-Forwarded-For
+    user_agent = request.headers.get('User-Agent')
+    history_row = dict(
+        username=username,
+        wish_text=validated_wish,
+        twist_result=content,
+        outcome=result,
+        ip_address=ip_address,
+        user_agent=user_agent,
+        wish_quality_bonus=score.wish_quality_bonus,
+        positive_indicator_count=score.positive_count,
+        negative_indicator_count=score.negative_count,
+        session_number=session_number,
+        prompt_tokens=call.prompt_tokens if call else None,
+        completion_tokens=call.completion_tokens if call else None,
+        llm_latency_ms=call.latency_ms if call else None,
+        timestamp=datetime.utcnow()
+    )
+    write_behind = write_behind_enabled()
+    if not write_behind:
+        db.session.add(WishHistory(**history_row))
+        write_history_rollups(db.session.connection(), [history_row])
+    with metrics.span("db_commit"):
+        db.session.commit()
+    if write_behind:
+        # User state is committed; the history row is only a record and can lag behind
+        get_history_writer().submit(history_row)
+    if game_over:
+        update_leaderboard(state)
+    else:
+        refresh_leaderboard_row(state)
+    return {
+        "twist": content,
+        "result": result,
+        "streak": state.streak,
+        "failed_wishes": MAX_FAILED_WISHES if game_over else state.failed_wishes,
+        "game_over": game_over,
+        "wishes_made": state.last_game_wishes if game_over else state.wishes_made,
+        "avoided_twists": state.avoided_twists,
+        "spellbook_uses": state.spellbook_uses,
+        "username": username,
+        "fallback": fallback
+    }
+
+twist_cache = build_twist_cache()
+
+def load_warm_twists(app):
+    """The most recent wish history as (wish_text, twist_result) pairs, oldest first"""
+    limit = int(os.getenv("TWIST_CACHE_WARM_ROWS", "2000"))
+    with app.app_context():
+        rows = db.session.query(WishHistory.wish_text, WishHistory.twist_result)\
+            .order_by(WishHistory.id.desc()).limit(limit).all()
+    return list(reversed(rows))
+
+def warm_twist_cache():
+    """Start warming the twist cache in the background; until it is warm, lookups miss"""
+    # The warm-up thread runs outside the request, so it holds on to the app for its context
+    app = current_app._get_current_object()
+    twist_cache.warm_in_background(lambda: load_warm_twists(app))
+
+def cached_twist(validated_wish, bypass=False):
+    """Return a cached twist for this wish or a near-duplicate, or None to call the model"""
+    if not cache_enabled():
+        return None
+    if bypass:
+        twist_cache.record_bypass()
+        return None
+    if not twist_cache.warmed:
+        warm_twist_cache()
+    return twist_cache.get(validated_wish)
+
+def remember_twist(validated_wish, content):
+    """Store a freshly generated, sanitized twist as a variant for this wish"""
+    if cache_enabled():
+        twist_cache.put(validated_wish, content)
+
+def get_twist_flight():
+    return lazy_component("twist_flight", lambda: build_single_flight(get_redis_client()))
+
+def twist_flight_key(validated_wish):
+    """Identical prompts share a key, so concurrent duplicates share one model call"""
+    return flight_key("wish", "gpt-4o", normalize_wish(validated_wish))
+
+def coalesce_twists(bypass_cache):
+    # A client asking to skip the cache wants a twist of its own
+    return single_flight_enabled() and not bypass_cache
+
+token_ledger = TokenLedger()
+
+def account_llm_call(purpose, usage, started, finish_reason=None, model="gpt-4o"):
+    """Count a finished model call's tokens and latency; return its LLMCall"""
+    metrics.record_usage(purpose, model, usage)
+    call = llm_call(usage, started, finish_reason)
+    token_ledger.record(purpose, call)
+    if call.truncated:
+        logger.warning("LLM output hit max_tokens", extra={"fields": {
+            "purpose": purpose, "completion_tokens": call.completion_tokens
+        }})
+    return call
+
+def remaining_time(deadline):
+    """Seconds left before a monotonic deadline (None for the client's own timeout)"""
+    if deadline is None:
+        return None
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise TimeoutError("twist deadline passed")
+    return remaining
+
+def account_discarded_call(purpose, response, model, latency):
+    """Count the tokens of a response the router paid for but didn't return (a losing hedge)"""
+    account_llm_call(purpose, response.usage, time.perf_counter() - latency, response.choices[0].finish_reason, model)
+
+def get_model_router(purpose):
+    return lazy_component(f"router_{purpose}", lambda: build_model_router(
+        purpose, on_discarded=lambda response, model, latency: account_discarded_call(purpose, response, model, latency)
+    ))
+
+def has_outcome_line(response):
+    """True if a twist response ends the way the paw was told to"""
+    return "user outcome:" in (response.choices[0].message.content or "").lower()
+
+def generate_twist(validated_wish, deadline=None):
+    """Ask the model for a fresh twist; return it sanitized with its LLMCall"""
+    started = time.perf_counter()
+    with metrics.span("llm_call"):
+        response, model = get_model_router("wish").chat(
+            build_wish_messages(validated_wish),
+            validate=has_outcome_line,
+            timeout=remaining_time(deadline),
+            max_tokens=wish_max_tokens()
+        )
+    call = account_llm_call("wish", response.usage, started, response.choices[0].finish_reason, model)
+    content = response.choices[0].message.content
+    
+    # Sanitize the response content
+    content = clean_markup(content)
+    remember_twist(validated_wish, content)
+    return content, call
+
+def fetch_twist(validated_wish, bypass_cache=False, deadline=None):
+    """Return a twist from the cache, from an identical call already in flight, or from the model.
+
+    Returns (twist, call) where call is the LLMCall this wish paid for, or
+    None when the twist was cached or came from another request's call.
+    The model call gives up at ``deadline`` (a time.monotonic() value).
+    """
+    content = cached_twist(validated_wish, bypass_cache)
+    if content is not None:
+        return content, None
+    if not coalesce_twists(bypass_cache):
+        return generate_twist(validated_wish, deadline)
+    calls = []
+
+    def lead():
+        content, call = generate_twist(validated_wish, deadline)
+        calls.append(call)
+        return content
+
+    content = get_twist_flight().do(twist_flight_key(validated_wish), lead)
+    return content, calls[0] if calls else None
+
+twist_library = build_twist_library()
+
+def load_seed_twists(app):
+    """Recent complete model twists from wish_history, as (wish_text, twist_result) pairs"""
+    limit = int(os.getenv("TWIST_FALLBACK_SEED_ROWS", "5000"))
+    max_tokens = wish_max_tokens()
+    with app.app_context():
+        rows = db.session.query(WishHistory.wish_text, WishHistory.twist_result, WishHistory.completion_tokens)\
+            .filter(WishHistory.completion_tokens.isnot(None))\
+            .order_by(WishHistory.id.desc()).limit(limit).all()
+    return [(wish, twist) for wish, twist, tokens in rows if seed_worthy(twist, tokens, max_tokens)]
+
+def seed_twist_library():
+    """Start seeding the fallback library in the background; until it is seeded, fallbacks use templates"""
+    # The seed thread runs outside the request, so it holds on to the app for its context
+    app = current_app._get_current_object()
+    twist_library.seed_in_background(lambda: load_seed_twists(app))
+
+def fallback_twist(validated_wish, error):
+    """Twist a wish locally because the model missed its deadline or failed; return it sanitized"""
+    reason = failure_reason(error)
+    logger.warning("Twist fallback", extra={"fields": {"reason": reason, "error": str(error)}})
+    if not twist_library.seeded:
+        seed_twist_library()
+    positive_hits, negative_hits = wish_scorer.indicator_hits(validated_wish)
+    content = twist_library.twist(validated_wish, positive_hits | negative_hits, reason)
+    return clean_markup(content)
+
+def twist_deadline_from_now():
+    """Monotonic time the model must answer by, or None with the fallback disabled"""
+    return time.monotonic() + twist_deadline() if fallback_enabled() else None
+
+def get_idempotency_keys():
+    return lazy_component("idempotency", lambda: build_idempotency_keys(get_redis_client()))
+
+def sse_event(event, data):
+    """Format a single Server-Sent Event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+class OutcomeLineFilter:
+    """Pass streamed twist text through while holding back the 'User outcome:' line.
+
+    The outcome line is rewritten after the local roll, so it is only ever sent
+    in the final event. Text is released as soon as the current line can no
+    longer turn into an outcome line.
+    """
+    MARKER = "user outcome:"
+
+    def __init__(self):
+        self.pending = ""
+        self.line_released = False
+
+    def feed(self, delta):
+        out = []
+        for char in delta:
+            if self.line_released:
+                out.append(char)
+                if char == "\n":
+                    self.line_released = False
+                continue
+            self.pending += char
+            if char == "\n":
+                if not self._is_outcome(self.pending):
+                    out.append(self.pending)
+                self.pending = ""
+            elif not self._could_be_outcome(self.pending):
+                out.append(self.pending)
+                self.pending = ""
+                self.line_released = True
+        return "".join(out)
+
+    def flush(self):
+        rest, self.pending = self.pending, ""
+        if rest and not self._is_outcome(rest):
+            return rest
+        return ""
+
+    def _is_outcome(self, line):
+        return line.strip().lower().startswith(self.MARKER)
+
+    def _could_be_outcome(self, line):
+        head = line.lstrip().lower()
+        return self.MARKER.startswith(head) or head.startswith(self.MARKER)
+
+def log_wish(validated_wish, score, roll, result, streamed=False, fallback=False):
+    """Log how a wish was scored and rolled"""
+    logger.info("wish", extra={"fields": {
+        "wish": validated_wish,
+        "positive": score.positive_count,
+        "negative": score.negative_count,
+        "bonus": round(score.wish_quality_bonus, 2),
+        "win_chance": round(score.win_chance, 2),
+        "roll": round(roll, 2),
+        "result": result,
+        "streamed": streamed,
+        "fallback": fallback
+    }})
+
+def wants_stream(data):
+    """Return True if the client asked for a streamed /wish response"""
+    if data.get("stream"):
+        return True
+    return request.accept_mimetypes.best == "text/event-stream"
+
+def rate_limiter_stats():
+    storage = limiter._storage
+    if storage is None or not hasattr(storage, "stats"):
+        return {"storage": type(storage).__name__ if storage is not None else "disabled"}
+    return storage.stats()
+
+@bp.route("/health", methods=["GET"])
+@limiter.exempt
+def health():
+    """Liveness check that also reports counters for the LLM client and background workers"""
+    return jsonify({
+        "status": "ok",
+        "llm": get_llm_client().stats(),
+        "suggestion_pool": get_suggestion_pool().stats(),
+        "twist_cache": twist_cache.stats(),
+        "history_writer": get_history_writer().stats(),
+        "single_flight": get_twist_flight().stats(),
+        "idempotency": get_idempotency_keys().stats(),
+        "tokens": token_ledger.stats(),
+        "rate_limiter": rate_limiter_stats(),
+        "leaderboard_feed": get_leaderboard_feed().stats(),
+        "twist_fallback": twist_library.stats(),
+        "router_wish": get_model_router("wish").stats(),
+        "router_suggestions": get_model_router("suggestions").stats()
+    })
+
+@bp.route("/assets/<path:filename>", methods=["GET"])
+@limiter.exempt
+def asset(filename):
+    """Fingerprinted static files, precompressed and cached for a year"""
+    return current_app.extensions['assets'].response(filename, request.accept_encodings)
+
+@bp.route("/metrics", methods=["GET"])
+@limiter.exempt
+def metrics_endpoint():
+    """Prometheus scrape endpoint"""
+    if not metrics.enabled:
+        return jsonify({"error": "Metrics are disabled"}), 404
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
+def admin_authorized():
+    """Admin endpoints take ADMIN_TOKEN as a bearer token"""
+    supplied = request.headers.get("Authorization", "").encode("utf-8")
+    expected = f"Bearer {os.getenv('ADMIN_TOKEN')}".encode("utf-8")
+    return secrets.compare_digest(supplied, expected)
+
+@bp.route("/admin/history/export", methods=["GET"])
+@limiter.limit("10 per hour")
+def admin_history_export():
+    """Stream wish_history as gzip-compressed NDJSON, optionally limited to ?since=&until= (UTC)"""
+    if not os.getenv("ADMIN_TOKEN"):
+        return jsonify({"error": "Not found"}), 404
+    if not admin_authorized():
+        return jsonify({"error": "Unauthorized"}), 401
+    try:
+        since = datetime.fromisoformat(request.args["since"]) if request.args.get("since") else None
+        until = datetime.fromisoformat(request.args["until"]) if request.args.get("until") else None
+    except ValueError:
+        return jsonify({"error": "since and until must be ISO dates"}), 400
+    filename = "wish_history-{}-{}.ndjson.gz".format(
+        since.date().isoformat() if since else "start", until.date().isoformat() if until else "now"
+    )
+    response = Response(stream_with_context(gzip_ndjson(iter_history(since, until))), mimetype="application/gzip")
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+@bp.route("/wish", methods=["POST"])
 @limiter.limit("20 per minute")
 def wish():
     try:
@@ -298,169 +1184,276 @@ def wish():
             return jsonify({"error": "Invalid request data"}), 400
             
         user_wish = data.get("wish", "")
-        validated_wish, error = validate_wish(user_wish)
+        with metrics.span("validate_wish"):
+            validated_wish, error = validate_wish(user_wish)
         
         if error:
             return jsonify({"error": error}), 400
             
         username = session["username"]
-        user = User.query.filter_by(username=username).first()
-        if not user:
+        # The game state itself is read and written by one statement in record_wish
+        if db.session.query(User.id).filter_by(username=username).first() is None:
             return jsonify({"error": "User not found."}), 404
+        release_db_connection()
+
+        # A retried or double-submitted wish gets the first response back instead of counting twice
+        idempotency_key = request.headers.get("Idempotency-Key")
+        if idempotency_key:
+            if not valid_idempotency_key(idempotency_key):
+                return jsonify({"error": "Invalid Idempotency-Key header"}), 400
+            state, payload = get_idempotency_keys().begin(username, idempotency_key)
+            if state == REPLAY:
+                response = jsonify(payload)
+                response.headers['Idempotent-Replayed'] = 'true'
+                return response
+            if state == BUSY:
+                return jsonify({"error": "This wish is still being processed"}), 409
 
-        user.wishes_made += 1
+        # Clients can skip the twist cache for a single wish with {"no_cache": true}
+        bypass_cache = bool(data.get("no_cache"))
 
-        system_prompt = PAW_PROMPT
-        user_input = f"I wish: {validated_wish}\n\nTwist the wish as the Monkey's Paw would. Then, on the final line, write 'User outcome: WIN' or 'User outcome: LOSE' as described."
+        if wants_stream(data):
+            return stream_wish(username, validated_wish, bypass_cache, idempotency_key)
 
         try:
-            client = OpenAI(api_key=openai_api_key)
-            response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_input}
-                ]
-            )
-            content = response.choices[0].message.content
-            
-            # Sanitize the response content
-            content = bleach.clean(content, tags=[], strip=True)
-            
-            # Parse the outcome from the final line
-            outcome = "lose"
-            if "user outcome: win" in content.lower():
-                outcome = "win"
-            elif "user outcome: lose" in content.lower():
-                outcome = "lose"
-            
-            # Apply probability-based system to give players a chance
-            # Base win probability (30% chance to win regardless of AI interpretation)
-            base_win_chance = 0.30
-            
-            # Bonus for well-crafted wishes (wishes that are specific, positive, and modest)
-            wish_quality_bonus = 0.0
-            wish_lower = validated_wish.lower()
-            
-            # Positive indicators that increase win chance
-            positive_indicators = [
-                'wisdom', 'strength', 'courage', 'patience', 'gratitude', 'help', 'learn', 'grow',
-                'small', 'little', 'moment', 'today', 'today', 'week', 'day', 'hour', 'minute',
-                'genuine', 'sincere', 'humble', 'modest', 'simple', 'peaceful', 'kind', 'good'
-            ]
-            
-            # Negative indicators that decrease win chance
-            negative_indicators = [
-                'infinite', 'eternal', 'forever', 'never', 'all', 'every', 'everything', 'unlimited',
-                'power', 'control', 'wealth', 'money', 'rich', 'famous', 'immortal', 'perfect',
-                'world', 'universe', 'destroy', 'kill', 'death', 'evil', 'curse', 'hate'
-            ]
+            deadline = twist_deadline_from_now()
+            fallback = False
+            try:
+                content, call = fetch_twist(validated_wish, bypass_cache, deadline)
+            except Exception as e:
+                if deadline is None:
+                    raise
+                content, call, fallback = fallback_twist(validated_wish, e), None, True
             
-            # Calculate wish quality bonus
-            positive_count = sum(1 for word in positive_indicators if word in wish_lower)
-            negative_count = sum(1 for word in negative_indicators if word in wish_lower)
-            
-            wish_quality_bonus = (positive_count * 0.05) - (negative_count * 0.10)
-            wish_quality_bonus = max(-0.20, min(0.30, wish_quality_bonus))  # Clamp between -20% and +30%
-            
-            # Calculate final win probability
-            final_win_chance = base_win_chance + wish_quality_bonus
-            final_win_chance = max(0.10, min(0.70, final_win_chance))  # Clamp between 10% and 70%
+            with metrics.span("scoring"):
+                score = wish_scorer.score(validated_wish)
             
             # Determine final outcome based on probability
-            if random.random() < final_win_chance:
-                result = "win"
-                # Update the content to reflect the win
-                content = content.replace("User outcome: LOSE", "User outcome: WIN")
-                if "User outcome: lose" in content:
-                    content = content.replace("User outcome: lose", "User outcome: WIN")
-            else:
-                result = "lose"
-                # Update the content to reflect the loss
-                content = content.replace("User outcome: WIN", "User outcome: LOSE")
-                if "User outcome: win" in content:
-                    content = content.replace("User outcome: win", "User outcome: LOSE")
-            
-            print(f"Wish: {validated_wish}")
-            print(f"Positive indicators: {positive_count}, Negative indicators: {negative_count}")
-            print(f"Wish quality bonus: {wish_quality_bonus:.2f}")
-            print(f"Final win chance: {final_win_chance:.2f}")
-            print(f"Random roll: {random.random():.2f}")
-            print(f"Final result: {result}")
-            
-            # Store wish history in the database
-            ip_address = request.headers.get('X-Forwarded-For', request.remote_addr)
-            user_agent = request.headers.get('User-Agent')
-            wish_history = WishHistory(
-                username=username,
-                wish_text=validated_wish,
-                twist_result=content,
-                outcome=result,
-                ip_address=ip_address,
-                user_agent=user_agent,
-                wish_quality_bonus=wish_quality_bonus,
-                positive_indicator_count=positive_count,
-                negative_indicator_count=negative_count,
-                session_number=user.session_number
-            )
-            db.session.add(wish_history)
+            roll = random.random()
+            result = "win" if roll < score.win_chance else "lose"
+            content = apply_outcome(content, result)
+            log_wish(validated_wish, score, roll, result, fallback=fallback)
             
-            # Update streak and failed_wishes based on result
-            if result == "win":
-                user.streak += 1
-                user.failed_wishes = 0
-            else:
-                user.streak = 0
-                user.failed_wishes += 1
-            streak = user.streak
-            failed_wishes = user.failed_wishes
-            wishes_made = user.wishes_made
-            game_over = False
-            if failed_wishes >= 5:
-                game_over = True
-                if streak > user.high_score:
-                    user.high_score = streak
-                # At game over, count avoided_twists from WishHistory for this session
-                avoided_twists = WishHistory.query.filter_by(
-                    username=username,
-                    outcome='win',
-                    session_number=user.session_number
-                ).count()
-                user.avoided_twists = avoided_twists
-                # Increment session_number for next game
-                user.session_number += 1
-                user.streak = 0
-                user.failed_wishes = 0
-                user.wishes_made = 0
-                user.spellbook_uses = 0
-            else:
-                # For in-game display, count so far in this session
-                avoided_twists = WishHistory.query.filter_by(
-                    username=username,
-                    outcome='win',
-                    session_number=user.session_number
-                ).count()
-                user.avoided_twists = avoided_twists
-            db.session.commit()
-            return jsonify({
-                "twist": content,
-                "result": result,
-                "streak": streak,
-                "failed_wishes": failed_wishes,
-                "game_over": game_over,
-                "wishes_made": wishes_made,
-                "avoided_twists": avoided_twists,
-                "spellbook_uses": user.spellbook_uses,
-                "username": user.username
-            })
-        except Exception as e:
-            print("OpenAI API error:", e)
+            payload = record_wish(username, validated_wish, content, result, score, call, fallback)
+        except Exception:
+            logger.exception("OpenAI API error")
+            if idempotency_key:
+                get_idempotency_keys().release(username, idempotency_key)
             return jsonify({"error": "Service temporarily unavailable"}), 500
-    except Exception as e:
-        print("Wish endpoint error:", e)
+        if idempotency_key:
+            get_idempotency_keys().complete(username, idempotency_key, payload)
+        return jsonify(payload)
+    except Exception:
+        logger.exception("Wish endpoint error")
         return jsonify({"error": "An error occurred while processing your wish"}), 500
 
-@app.route("/generate_suggestions", methods=["POST"])
+def stream_wish(username, validated_wish, bypass_cache=False, idempotency_key=None):
+    """Stream the twist as Server-Sent Events, ending with a 'result' event"""
+    # The roll only depends on the wish text, so it can be settled up front
+    with metrics.span("scoring"):
+        score = wish_scorer.score(validated_wish)
+    roll = random.random()
+    result = "win" if roll < score.win_chance else "lose"
+
+    calls = []
+    # The model has until then to start answering
+    deadline = twist_deadline_from_now()
+
+    def llm_deltas():
+        started = time.perf_counter()
+        finish_reason = None
+        # A stream cannot be hedged; it goes to the best model and reports how it went
+        router = get_model_router("wish")
+        route = router.pick()
+        try:
+            with metrics.span("llm_call"):
+                stream = route.get_client().chat(
+                    messages=build_wish_messages(validated_wish),
+                    model=route.model,
+                    timeout=remaining_time(deadline),
+                    max_tokens=wish_max_tokens(),
+                    stream=True,
+                    stream_options={"include_usage": True}
+                )
+            for chunk in stream:
+                if getattr(chunk, "usage", None) is not None:
+                    # The final chunk carries usage for the whole stream
+                    calls.append(account_llm_call("wish", chunk.usage, started, finish_reason, route.model))
+                if not chunk.choices:
+                    continue
+                finish_reason = chunk.choices[0].finish_reason or finish_reason
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    yield delta
+        except Exception:
+            router.record(route, ok=False)
+            raise
+        router.record(route)
+
+    def generate():
+        flight = None
+        completed = False
+        try:
+            outcome_filter = OutcomeLineFilter()
+            parts = []
+            cached = None
+            fallback = False
+            try:
+                cached = cached_twist(validated_wish, bypass_cache)
+                if cached is None and coalesce_twists(bypass_cache):
+                    # If the same wish is already being twisted, its result is replayed in one piece
+                    flight, cached = get_twist_flight().lead_or_wait(twist_flight_key(validated_wish))
+                for delta in ([cached] if cached is not None else llm_deltas()):
+                    parts.append(delta)
+                    visible = outcome_filter.feed(delta)
+                    if visible:
+                        yield sse_event("twist", {"delta": visible})
+            except Exception as e:
+                # Once part of the model's twist is on screen it cannot be replaced
+                if deadline is None or parts:
+                    raise
+                if flight is not None:
+                    get_twist_flight().finish(flight, error=e)
+                    flight = None
+                fallback = True
+                parts = [fallback_twist(validated_wish, e)]
+                visible = outcome_filter.feed(parts[0])
+                if visible:
+                    yield sse_event("twist", {"delta": visible})
+            visible = outcome_filter.flush()
+            if visible:
+                yield sse_event("twist", {"delta": visible})
+
+            # Sanitize the full response content before it is stored or rendered as HTML
+            content = clean_markup("".join(parts))
+            if cached is None and not fallback:
+                remember_twist(validated_wish, content)
+            if flight is not None:
+                get_twist_flight().finish(flight, value=content)
+                flight = None
+            content = apply_outcome(content, result)
+
+            try:
+                log_wish(validated_wish, score, roll, result, streamed=True, fallback=fallback)
+                payload = record_wish(username, validated_wish, content, result, score,
+                                      calls[0] if calls else None, fallback)
+            except Exception:
+                logger.exception("Wish endpoint error")
+                db.session.rollback()
+                yield sse_event("error", {"error": "An error occurred while processing your wish"})
+                return
+            completed = True
+            if idempotency_key:
+                get_idempotency_keys().complete(username, idempotency_key, payload)
+            yield sse_event("result", payload)
+        except Exception as e:
+            logger.exception("OpenAI API error")
+            if flight is not None:
+                get_twist_flight().finish(flight, error=e)
+                flight = None
+            db.session.rollback()
+            yield sse_event("error", {"error": "Service temporarily unavailable"})
+        finally:
+            # Also runs when the client disconnects mid-stream; a waiting duplicate takes over
+            if flight is not None:
+                get_twist_flight().abandon(flight)
+            if idempotency_key and not completed:
+                get_idempotency_keys().release(username, idempotency_key)
+
+    response = Response(stream_with_context(generate()), mimetype="text/event-stream")
+    response.headers['Cache-Control'] = 'no-cache'
+    # Stop reverse proxies from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+# Prompt designed to generate wishes that are harder for the monkey's paw to twist.
+# The number of wishes goes in the user message so this prefix never changes.
+SUGGESTION_PROMPT = """
+You are an ancient spellbook that helps people craft wishes to avoid the Monkey's Paw's curse.
+
+Generate wish suggestions that are strategically designed to be difficult for the Monkey's Paw to twist negatively.
+
+Rules for good wishes:
+1. Be specific and detailed to avoid ambiguity
+2. Include positive conditions and safeguards
+3. Focus on personal growth, wisdom, or helping others
+4. Avoid material wealth, power, or immortality
+5. Use precise language that leaves little room for interpretation
+6. Include time limits or specific contexts when possible
+7. Emphasize the journey/process rather than just the outcome
+
+Format each suggestion as a complete wish starting with "I wish..."
+Make each wish unique and creative.
+
+Return only the wishes, one per line, no numbering or extra text.
+"""
+
+SUGGESTION_SYSTEM_PROMPT = compact_prompt(SUGGESTION_PROMPT)
+
+FALLBACK_SUGGESTIONS = [
+    "I wish for the wisdom to make the best decisions in the next 24 hours",
+    "I wish for the strength to help someone in need today",
+    "I wish for a moment of genuine gratitude for what I already have"
+]
+
+def build_suggestion_messages(count):
+    """Build the chat messages sent to the spellbook for ``count`` suggestions"""
+    return [
+        {"role": "system", "content": SUGGESTION_SYSTEM_PROMPT},
+        {"role": "user", "content": f"Generate {count} wish suggestions."}
+    ]
+
+def generate_live_suggestions(count=3):
+    """Ask the model for suggestions and return the valid, sanitized ones"""
+    started = time.perf_counter()
+    with metrics.span("llm_call"):
+        # Suggestions don't need the paw's model; a cheaper, faster one is fine
+        response, model = get_model_router("suggestions").chat(
+            build_suggestion_messages(count),
+            validate=lambda response: "I wish" in (response.choices[0].message.content or ""),
+            max_tokens=suggestion_max_tokens(count),
+            temperature=0.8
+        )
+    call = account_llm_call("suggestions", response.usage, started, response.choices[0].finish_reason, model)
+    
+    lines = response.choices[0].message.content.strip().split('\n')
+    if call.truncated:
+        # The last suggestion was cut off mid-sentence
+        lines = lines[:-1]
+    suggestions = []
+    for line in lines:
+        line = line.strip()
+        if not line.startswith('I wish'):
+            continue
+        # Suggestions are fed back in as wishes, so hold them to the same rules
+        validated, error = validate_wish(line)
+        if error:
+            continue
+        validated = clean_markup(validated)
+        if validated not in suggestions:
+            suggestions.append(validated)
+    return suggestions[:count]
+
+def get_suggestion_pool():
+    return lazy_component(
+        "suggestion_pool",
+        lambda: build_suggestion_pool(generate_live_suggestions, redis_client=get_redis_client())
+    )
+
+metrics.register_stats("llm", lambda: get_llm_client().stats())
+metrics.register_stats("suggestion_pool", lambda: get_suggestion_pool().stats())
+metrics.register_stats("twist_cache", twist_cache.stats)
+metrics.register_stats("history_writer", lambda: get_history_writer().stats())
+metrics.register_stats("single_flight", lambda: get_twist_flight().stats())
+metrics.register_stats("idempotency", lambda: get_idempotency_keys().stats())
+metrics.register_stats("tokens", token_ledger.stats)
+metrics.register_stats("rate_limiter", rate_limiter_stats)
+metrics.register_stats("leaderboard_feed", lambda: get_leaderboard_feed().stats())
+metrics.register_stats("twist_fallback", twist_library.stats)
+metrics.register_stats("router_wish", lambda: get_model_router("wish").stats())
+metrics.register_stats("router_suggestions", lambda: get_model_router("suggestions").stats())
+
+@bp.route("/generate_suggestions", methods=["POST"])
 @limiter.limit("5 per minute")
 def generate_suggestions():
     try:
@@ -480,56 +1473,25 @@ def generate_suggestions():
         if user.failed_wishes >= 5:
             return jsonify({"error": "Game over! You cannot use the spellbook after losing."}), 403
 
-        if not openai_api_key:
-            return jsonify({"error": "Service temporarily unavailable"}), 500
-            
-        client = OpenAI(api_key=openai_api_key)
-        
-        # Prompt designed to generate wishes that are harder for the monkey's paw to twist
-        suggestion_prompt = """
-        You are an ancient spellbook that helps people craft wishes to avoid the Monkey's Paw's curse.
-        
-        Generate 3 wish suggestions that are strategically designed to be difficult for the Monkey's Paw to twist negatively.
-        
-        Rules for good wishes:
-        1. Be specific and detailed to avoid ambiguity
-        2. Include positive conditions and safeguards
-        3. Focus on personal growth, wisdom, or helping others
-        4. Avoid material wealth, power, or immortality
-        5. Use precise language that leaves little room for interpretation
-        6. Include time limits or specific contexts when possible
-        7. Emphasize the journey/process rather than just the outcome
-        
-        Format each suggestion as a complete wish starting with "I wish..."
-        Make each wish unique and creative.
-        
-        Return only the 3 wishes, one per line, no numbering or extra text.
-        """
-        
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": suggestion_prompt}
-            ],
-            max_tokens=200,
-            temperature=0.8
-        )
-        
-        suggestions = response.choices[0].message.content.strip().split('\n')
-        # Clean up suggestions and ensure we have exactly 3
-        suggestions = [s.strip() for s in suggestions if s.strip() and s.strip().startswith('I wish')][:3]
-        
-        # Sanitize suggestions
-        suggestions = [bleach.clean(s, tags=[], strip=True) for s in suggestions]
+        release_db_connection()
+
+        # Serve pre-generated suggestions; only go to the model when the pool runs dry
+        suggestions = get_suggestion_pool().pop(3) if pool_enabled() else []
+        if len(suggestions) < 3:
+            if not get_llm_client().configured:
+                return jsonify({"error": "Service temporarily unavailable"}), 500
+            for suggestion in generate_live_suggestions(3):
+                if len(suggestions) >= 3:
+                    break
+                if suggestion not in suggestions:
+                    suggestions.append(suggestion)
         
         # If we don't have 3 suggestions, add some fallbacks
-        while len(suggestions) < 3:
-            fallbacks = [
-                "I wish for the wisdom to make the best decisions in the next 24 hours",
-                "I wish for the strength to help someone in need today",
-                "I wish for a moment of genuine gratitude for what I already have"
-            ]
-            suggestions.append(fallbacks[len(suggestions) - len(suggestions)])
+        for fallback in FALLBACK_SUGGESTIONS:
+            if len(suggestions) >= 3:
+                break
+            if fallback not in suggestions:
+                suggestions.append(fallback)
         
         # Increment spellbook uses
         user.spellbook_uses += 1
@@ -542,10 +1504,13 @@ def generate_suggestions():
         })
         
     except Exception as e:
-        print("Suggestion generation error:", e)
+        logger.exception("Suggestion generation error")
         return jsonify({"error": "Could not generate suggestions at this time"}), 500
     
+    
 
 
 if __name__ == "__main__":
+    app = create_app()
+    ensure_schema(app)
     app.run(debug=True)
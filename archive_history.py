@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Export and retention for wish_history.
+
+    python archive_history.py export [--since 2026-01-01] [--until 2026-02-01]
+        Stream history (optionally a date range, UTC) to day-partitioned
+        archive files without deleting anything.
+
+    python archive_history.py prune [--older-than 90] [--dry-run]
+        Archive rows older than the retention period and delete them in
+        small batches. Each player's current and last finished game are kept.
+
+Files go to HISTORY_ARCHIVE_DIR (or --output) as NDJSON.gz, or as Parquet
+with --format parquet (needs pyarrow). Keep the archive directory on
+durable storage: pruned rows only exist there afterwards.
+"""
+
+import argparse
+from datetime import datetime
+from app import (
+    archive_old_history,
+    count_prunable_history,
+    create_app,
+    export_history,
+)
+from history_archive import FORMATS, archive_batch_size, build_history_archive, retention_days
+
+app = create_app()
+
+def export(args):
+    archive = build_history_archive(args.output, args.format)
+    with app.app_context():
+        try:
+            rows = export_history(archive, args.since, args.until, chunk_size=args.batch_size)
+            print(f"✅ Exported {rows} rows to {archive.files} files in {archive.root}")
+        except Exception as e:
+            print(f"❌ Error exporting wish history: {e}")
+            raise
+
+def prune(args):
+    with app.app_context():
+        try:
+            if args.dry_run:
+                rows = count_prunable_history(args.older_than)
+                print(f"✅ {rows} rows older than {args.older_than} days would be archived and deleted.")
+                return
+            archive = build_history_archive(args.output, args.format)
+            rows = archive_old_history(
+                archive,
+                args.older_than,
+                batch_size=args.batch_size,
+                max_batches=args.max_batches,
+                pause=args.pause,
+            )
+            print(f"✅ Archived and deleted {rows} rows older than {args.older_than} days "
+                  f"({archive.files} files in {archive.root}).")
+        except Exception as e:
+            print(f"❌ Error pruning wish history: {e}")
+            raise
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output", help="archive directory (default HISTORY_ARCHIVE_DIR or ./archive)")
+    parser.add_argument("--format", choices=FORMATS, help="file format (default HISTORY_ARCHIVE_FORMAT or ndjson)")
+    parser.add_argument("--batch-size", type=int, default=archive_batch_size(), help="rows per file and per delete")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", help="write history to archive files")
+    export_parser.add_argument("--since", type=datetime.fromisoformat, help="first timestamp to include (UTC)")
+    export_parser.add_argument("--until", type=datetime.fromisoformat, help="timestamp to stop before (UTC)")
+    export_parser.set_defaults(run=export)
+
+    prune_parser = commands.add_parser("prune", help="archive and delete old history")
+    prune_parser.add_argument("--older-than", type=int, default=retention_days(), help="retention in days")
+    prune_parser.add_argument("--max-batches", type=int, help="stop after this many batches")
+    prune_parser.add_argument("--pause", type=float, default=0.0, help="seconds to sleep between batches")
+    prune_parser.add_argument("--dry-run", action="store_true", help="only count the rows that would go")
+    prune_parser.set_defaults(run=prune)
+
+    args = parser.parse_args()
+    args.run(args)
@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+"""
+Stats rollup backfill for Monkey's Paw application.
+Rebuilds the /stats rollup tables (user_stats, session_stats, daily_stats,
+indicator_stats, daily_indicator_stats) from wish_history. Run it once after
+the tables are created (python init_db.py), and again whenever the rollups
+need to be rebuilt from scratch.
+
+Wishes stored while the backfill runs can be counted twice or not at all;
+run it before the app is started or with STATS_ENABLED=0 on the app.
+Rows removed by archive_history.py prune are no longer in wish_history, so
+run it before pruning if those rows should be counted.
+"""
+
+import argparse
+from app import backfill_stats, create_app
+
+app = create_app()
+
+def main(batch_size):
+    with app.app_context():
+        try:
+            rows = backfill_stats(batch_size=batch_size)
+            print(f"✅ Stats rollups rebuilt from {rows} wish_history rows.")
+        except Exception as e:
+            print(f"❌ Error backfilling stats: {e}")
+            raise
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=5000, help="history rows per chunk")
+    args = parser.parse_args()
+    main(args.batch_size)
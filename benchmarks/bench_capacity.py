@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Capacity benchmark: concurrent wishes per GB of RAM, sync vs gevent workers.
+
+Boots gunicorn once per worker class with the fake LLM answering after a
+fixed delay, logs in one virtual player per client connection, and keeps
+every player wishing for the duration of each concurrency level. The
+number of wishes the server has in flight at once is throughput times the
+LLM delay (Little's law), and memory is the summed PSS of the gunicorn
+master and workers, so shared pages from the preloaded app are counted once.
+
+Usage:
+    python benchmarks/bench_capacity.py --modes sync,gevent --workers 2 \\
+        --concurrency 16,128,512 --llm-latency 2 --duration 15
+"""
+
+import argparse
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from load_test import ROOT, Client, WISHES, free_port, percentile, wait_for_server
+
+
+def server_env(args, database_url, mode):
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": database_url,
+        "LLM_BACKEND": "fake",
+        "FAKE_LLM_LATENCY": str(args.llm_latency),
+        "FAKE_LLM_JITTER": "0",
+        "RATELIMIT_ENABLED": "0",
+        "FLASK_SECRET_KEY": "capacity-bench-secret",
+        "TWIST_CACHE_ENABLED": "0",
+        "LOG_LEVEL": "WARNING",
+        "DB_SCHEMA_CHECK": "0",
+        "GUNICORN_WORKER_CLASS": mode,
+        "GUNICORN_WORKER_CONNECTIONS": str(args.worker_connections),
+    })
+    env.pop("FLASK_ENV", None)
+    return env
+
+
+def tree_pss_mb(master_pid):
+    """Summed proportional set size of the gunicorn master and its workers (Linux only)"""
+    pids = [master_pid]
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    if int(f.read().rsplit(")", 1)[1].split()[1]) == master_pid:
+                        pids.append(int(entry))
+            except OSError:
+                continue
+    total_kb = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/smaps_rollup") as f:
+                for line in f:
+                    if line.startswith("Pss:"):
+                        total_kb += int(line.split()[1])
+                        break
+        except OSError:
+            continue
+    return total_kb / 1024
+
+
+def login_players(base_url, count):
+    def login(index):
+        client = Client(base_url, timeout=120)
+        client.login(f"cap{index}")
+        return client
+
+    with ThreadPoolExecutor(max_workers=32) as pool:
+        return list(pool.map(login, range(count)))
+
+
+def run_level(clients, duration, master_pid):
+    """Keep every client wishing until the deadline; sample memory while it runs"""
+    latencies, statuses = [], {}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+    peak_mb = [0.0]
+    done = threading.Event()
+
+    def player(index, client):
+        n = index
+        while time.monotonic() < deadline:
+            n += 1
+            started = time.perf_counter()
+            try:
+                status, _ = client.request("POST", "/wish", {"wish": WISHES[n % len(WISHES)], "no_cache": True})
+            except OSError:
+                status = "exception"
+            elapsed = time.perf_counter() - started
+            with lock:
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+                if status == 200:
+                    latencies.append(elapsed)
+
+    def sample_memory():
+        while not done.wait(0.5):
+            peak_mb[0] = max(peak_mb[0], tree_pss_mb(master_pid))
+
+    sampler = threading.Thread(target=sample_memory, daemon=True)
+    sampler.start()
+    started = time.monotonic()
+    threads = [threading.Thread(target=player, args=(i, c)) for i, c in enumerate(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+    done.set()
+    sampler.join()
+    latencies.sort()
+    return latencies, statuses, elapsed, peak_mb[0]
+
+
+def bench_mode(args, mode, levels):
+    tmpdir = tempfile.mkdtemp(prefix="monkeypaw-capacity-")
+    database_url = args.database_url or f"sqlite:///{os.path.join(tmpdir, 'capacity.db')}"
+    env = server_env(args, database_url, mode)
+    subprocess.run([sys.executable, "init_db.py"], cwd=ROOT, env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    port = free_port()
+    command = [
+        "gunicorn",
+        "--bind", f"127.0.0.1:{port}",
+        "--workers", str(args.workers),
+        "--backlog", "4096",
+        "--timeout", "300",
+        "--log-level", "warning",
+    ]
+    process = subprocess.Popen(command, cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    runs = []
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        wait_for_server(base_url)
+        idle_mb = tree_pss_mb(process.pid)
+        clients = login_players(base_url, max(levels))
+        for level in levels:
+            latencies, statuses, elapsed, peak_mb = run_level(clients[:level], args.duration, process.pid)
+            throughput = len(latencies) / elapsed
+            in_flight = throughput * args.llm_latency
+            memory_mb = max(peak_mb, idle_mb)
+            run = {
+                "mode": mode,
+                "workers": args.workers,
+                "concurrency": level,
+                "wishes": len(latencies),
+                "statuses": statuses,
+                "throughput_rps": round(throughput, 2),
+                "p50_ms": round(percentile(latencies, 0.50) * 1000, 1) if latencies else None,
+                "p95_ms": round(percentile(latencies, 0.95) * 1000, 1) if latencies else None,
+                "wishes_in_flight": round(in_flight, 1),
+                "memory_mb": round(memory_mb, 1),
+                "in_flight_per_gb": round(in_flight / (memory_mb / 1024), 1) if memory_mb else None,
+            }
+            runs.append(run)
+            print(f"  {mode:<7} c={level:<5} {run['throughput_rps']:8.2f} wish/s  "
+                  f"p50 {run['p50_ms']} ms  p95 {run['p95_ms']} ms  "
+                  f"in flight {run['wishes_in_flight']:7.1f}  {run['memory_mb']:7.1f} MB  "
+                  f"{run['in_flight_per_gb']} per GB  statuses {statuses}")
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    return runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--modes", default="sync,gevent", help="comma-separated gunicorn worker classes")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--worker-connections", type=int, default=1000)
+    parser.add_argument("--concurrency", default="16,128,512", help="comma-separated in-flight client counts")
+    parser.add_argument("--llm-latency", type=float, default=2.0, help="fake LLM delay in seconds")
+    parser.add_argument("--duration", type=float, default=15, help="seconds per concurrency level")
+    parser.add_argument("--database-url", help="defaults to a temporary SQLite file per mode")
+    parser.add_argument("--output", default="bench_capacity.json")
+    args = parser.parse_args()
+
+    if not shutil.which("gunicorn"):
+        raise SystemExit("gunicorn is not installed")
+    levels = [int(level) for level in args.concurrency.split(",") if level]
+    results = {"llm_latency": args.llm_latency, "workers": args.workers, "runs": []}
+    print(f"{args.workers} worker(s), fake LLM delay {args.llm_latency}s")
+    for mode in [m for m in args.modes.split(",") if m]:
+        results["runs"].extend(bench_mode(args, mode, levels))
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
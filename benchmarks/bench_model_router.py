@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Offline check of the model router against fake endpoints with scripted latency distributions.
+
+Each scenario gives every fake model its own latency distribution (and,
+for one, answers without a "User outcome:" line), sends the same twist
+calls through a router without hedging and through one with it, and
+prints p50/p95/p99 latency, the share of calls hedged and which models
+answered. Latencies are the scripted seconds times --scale, so a run takes
+seconds; printed latencies are scaled back up.
+
+With --check the script also asserts what each scenario is about and exits
+non-zero if one fails:
+    tail      one model with occasional long stalls: hedging cuts p99
+    degraded  the first model is slow, the second fast: calls move to the second
+    invalid   the first model sometimes leaves out the outcome line: such
+              answers are hedged and the model loses its place, so far
+              fewer of them reach the player
+    budget    every call is slow: no more hedges than the budget allows
+
+Usage:
+    python benchmarks/bench_model_router.py [--calls 400] [--threads 8] [--scale 0.01] [--check]
+"""
+
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import build_wish_messages, has_outcome_line
+from fake_openai import FakeOpenAI
+from llm_client import CircuitBreaker, LLMClient
+from model_router import ModelRouter, Route
+
+
+def lognormal(median, sigma):
+    return lambda rng: rng.lognormvariate(0, sigma) * median
+
+
+def with_stalls(base, rate, stall):
+    """``base`` latency, except that ``rate`` of calls stall for ``stall`` seconds"""
+    return lambda rng: stall if rng.random() < rate else base(rng)
+
+
+def dropping_outcome(rate, seed):
+    """A responder whose twists lose their outcome line ``rate`` of the time"""
+    default = FakeOpenAI(seed=seed)
+    rng = random.Random(seed)
+
+    def respond(model, messages):
+        content = default.respond(model, messages)
+        if rng.random() < rate:
+            return content.split("\n\nUser outcome:")[0]
+        return content
+
+    return respond
+
+
+# name -> [(model, latency distribution in unscaled seconds, responder)]
+SCENARIOS = {
+    "tail": [("gpt-4o", with_stalls(lognormal(1.5, 0.25), 0.06, 12.0), None)],
+    "degraded": [
+        ("gpt-4o", lognormal(4.0, 0.3), None),
+        ("gpt-4o-mini", lognormal(1.2, 0.3), None),
+    ],
+    "invalid": [
+        ("gpt-4o", lognormal(1.5, 0.25), dropping_outcome(0.2, 3)),
+        ("gpt-4o-mini", lognormal(1.5, 0.25), None),
+    ],
+    "budget": [("gpt-4o", lognormal(3.0, 0.6), None)],
+}
+
+
+def build_router(scenario, scale, hedge, seed, hedge_budget):
+    routes = []
+    for offset, (model, latency, responder) in enumerate(SCENARIOS[scenario]):
+        def factory(latency=latency, responder=responder, offset=offset):
+            return FakeOpenAI(seed=seed + offset, responder=responder,
+                              latency_sampler=lambda rng: latency(rng) * scale)
+        client = LLMClient(client_factory=factory, timeout=30 * scale, max_retries=0,
+                           breaker_factory=lambda: CircuitBreaker(failure_threshold=1000))
+        routes.append(Route(model, client))
+    return ModelRouter(routes, hedge=hedge, hedge_budget=hedge_budget, min_samples=20,
+                       explore=0.05, rng=random.Random(seed))
+
+
+def run(router, calls, threads):
+    """Send twist calls from several threads; return per-call (sequence, seconds, model, response)"""
+    results = []
+    lock = threading.Lock()
+    per_thread = calls // threads
+
+    def worker(index):
+        for n in range(per_thread):
+            messages = build_wish_messages(f"wish number {index}-{n} for a small kind moment today")
+            started = time.perf_counter()
+            response, model = router.chat(messages, validate=has_outcome_line, max_tokens=400)
+            with lock:
+                results.append((n, time.perf_counter() - started, model, response))
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return results
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(results, router, scale):
+    # Each thread's first quarter of calls is made before the estimates exist;
+    # judge the router on the calls started after that
+    warmup = max(n for n, _, _, _ in results) // 4
+    steady = [(seconds, model, response) for n, seconds, model, response in results if n >= warmup]
+    latencies = [seconds / scale for seconds, _, _ in steady]
+    models = {}
+    for _, model, _ in steady:
+        models[model] = models.get(model, 0) + 1
+    stats = router.stats()
+    return {
+        "p50": percentile(latencies, 0.5),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+        "hedged": stats["hedged"] / stats["calls"],
+        "hedge_wins": stats["hedge_wins"],
+        "models": {model: count / len(steady) for model, count in sorted(models.items())},
+        "missing_outcome": sum(1 for _, _, response in steady if not has_outcome_line(response)),
+    }
+
+
+def checks(scenario, plain, hedged, budget):
+    """(description, passed) for what the scenario is meant to show"""
+    if scenario == "tail":
+        return [("hedging cuts p99 by half", hedged["p99"] <= plain["p99"] / 2)]
+    if scenario == "degraded":
+        return [("most calls go to the faster model", hedged["models"].get("gpt-4o-mini", 0) >= 0.8)]
+    if scenario == "invalid":
+        return [("hedging and routing cut answers without an outcome line by 4x",
+                 hedged["missing_outcome"] == 0 or hedged["missing_outcome"] < plain["missing_outcome"] / 4)]
+    if scenario == "budget":
+        return [(f"at most {budget:.0%} of calls hedged, plus the burst", hedged["hedged"] <= budget + 0.05)]
+    return []
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--calls", type=int, default=400, help="calls per scenario and router")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--scale", type=float, default=0.01, help="real seconds per scripted second")
+    parser.add_argument("--hedge-budget", type=float, default=0.15)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated subset of " + ", ".join(SCENARIOS))
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--check", action="store_true", help="fail unless each scenario shows its effect")
+    args = parser.parse_args()
+
+    failed = 0
+    print(f"{'scenario':<9} {'router':<7} {'p50 s':>6} {'p95 s':>6} {'p99 s':>6} {'hedged':>7} {'hedge wins':>10} "
+          f"{'no outcome':>10}  models")
+    for scenario in args.scenarios.split(","):
+        summaries = {}
+        for label, hedge in (("plain", False), ("hedged", True)):
+            router = build_router(scenario, args.scale, hedge, args.seed, args.hedge_budget)
+            summaries[label] = summary = summarize(run(router, args.calls, args.threads), router, args.scale)
+            models = ", ".join(f"{model} {share:.0%}" for model, share in summary["models"].items())
+            print(f"{scenario:<9} {label:<7} {summary['p50']:>6.2f} {summary['p95']:>6.2f} {summary['p99']:>6.2f} "
+                  f"{summary['hedged']:>7.1%} {summary['hedge_wins']:>10} {summary['missing_outcome']:>10}  {models}")
+        if args.check:
+            for description, passed in checks(scenario, summaries["plain"], summaries["hedged"], args.hedge_budget):
+                print(f"{'✅' if passed else '❌'} {scenario}: {description}")
+                failed += not passed
+    if failed:
+        raise SystemExit(f"❌ {failed} check(s) failed")
+
+
+if __name__ == "__main__":
+    main()
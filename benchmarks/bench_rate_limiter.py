@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: per-request rate limiter overhead for each storage backend.
+
+Builds a minimal Flask app with the game's limits (a route limit plus the
+"200 per day" / "50 per hour" defaults) and times requests to a trivial
+view with no limiter, with in-memory storage, with flask-limiter's Redis
+storage (the previous production setup) and with the tiered storage in
+rate_limit_store.py. The overhead is the time per request above the
+unlimited baseline. Redis round trips per request come from the server's
+command counter.
+
+Requests come from --clients addresses, spread over --threads threads, so
+the limits are shared the way they are between a worker's requests.
+Limits are set high enough that nothing is refused.
+
+Usage:
+    python benchmarks/bench_rate_limiter.py [--requests 5000] [--threads 4] [--redis-url redis://localhost:6379]
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import redis
+from flask import Flask
+from flask_limiter import Limiter
+from flask_limiter.util import get_remote_address
+
+import rate_limit_store  # noqa: F401  (registers the tiered+redis:// scheme)
+
+STORAGES = ("none", "memory", "redis", "tiered")
+
+
+def build_app(storage, redis_url):
+    app = Flask(__name__)
+    app.config["RATELIMIT_ENABLED"] = storage != "none"
+    app.config["RATELIMIT_STORAGE_URI"] = {
+        "none": "memory://",
+        "memory": "memory://",
+        "redis": redis_url,
+        "tiered": "tiered+" + redis_url,
+    }[storage]
+    limiter = Limiter(key_func=get_remote_address, default_limits=["200000 per day", "50000 per hour"])
+    limiter.init_app(app)
+
+    @app.route("/limited")
+    @limiter.limit("20000 per minute")
+    def limited():
+        return "ok"
+
+    @app.route("/defaults")
+    def defaults():
+        return "ok"
+
+    return app, limiter
+
+
+def run(app, requests, threads, clients):
+    """Send requests from several threads; return seconds per request"""
+    per_thread = requests // threads
+    start = threading.Barrier(threads + 1)
+
+    def worker(index):
+        client = app.test_client()
+        start.wait()
+        for n in range(per_thread):
+            address = f"10.0.{index}.{n % clients}"
+            client.get("/limited" if n % 2 else "/defaults", environ_base={"REMOTE_ADDR": address})
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    start.wait()
+    started = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    return (time.perf_counter() - started) / (per_thread * threads)
+
+
+def redis_commands(client):
+    return client.info("stats")["total_commands_processed"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--clients", type=int, default=50, help="distinct client addresses per thread")
+    parser.add_argument("--redis-url", default=os.getenv("REDIS_URL", "redis://localhost:6379"))
+    parser.add_argument("--storages", default=",".join(STORAGES), help="comma-separated subset of " + ", ".join(STORAGES))
+    args = parser.parse_args()
+
+    server = redis.Redis.from_url(args.redis_url)
+    try:
+        server.ping()
+    except redis.RedisError as e:
+        raise SystemExit(f"❌ Redis is needed at {args.redis_url}: {e}")
+
+    baseline = None
+    print(f"{'storage':<8} {'us/request':>10} {'overhead us':>11} {'redis cmds/request':>18}")
+    for storage in args.storages.split(","):
+        app, limiter = build_app(storage, args.redis_url)
+        server.flushdb()
+        before = redis_commands(server)
+        per_request = run(app, args.requests, args.threads, args.clients)
+        if storage == "tiered":
+            limiter.storage.sync()
+        # The INFO call that reads the counter is counted too
+        commands = (redis_commands(server) - before - 1) / args.requests
+        if baseline is None:
+            baseline = per_request
+        print(f"{storage:<8} {per_request * 1e6:>10.1f} {(per_request - baseline) * 1e6:>11.1f} {commands:>18.2f}")
+        if storage == "tiered":
+            print(f"         {limiter.storage.stats()}")
+            limiter.storage.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: wish-quality scoring engine vs the original inline scorer.
+
+Usage:
+    python benchmarks/bench_scoring.py [--wishes 2000] [--repeat 5]
+"""
+
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scoring import WishScorer
+
+
+def legacy_score(validated_wish):
+    """The scorer as it used to be inlined in wish(): lists rebuilt per call, substring scans"""
+    base_win_chance = 0.30
+    wish_lower = validated_wish.lower()
+    positive_indicators = [
+        'wisdom', 'strength', 'courage', 'patience', 'gratitude', 'help', 'learn', 'grow',
+        'small', 'little', 'moment', 'today', 'today', 'week', 'day', 'hour', 'minute',
+        'genuine', 'sincere', 'humble', 'modest', 'simple', 'peaceful', 'kind', 'good'
+    ]
+    negative_indicators = [
+        'infinite', 'eternal', 'forever', 'never', 'all', 'every', 'everything', 'unlimited',
+        'power', 'control', 'wealth', 'money', 'rich', 'famous', 'immortal', 'perfect',
+        'world', 'universe', 'destroy', 'kill', 'death', 'evil', 'curse', 'hate'
+    ]
+    positive_count = sum(1 for word in positive_indicators if word in wish_lower)
+    negative_count = sum(1 for word in negative_indicators if word in wish_lower)
+    wish_quality_bonus = (positive_count * 0.05) - (negative_count * 0.10)
+    wish_quality_bonus = max(-0.20, min(0.30, wish_quality_bonus))
+    final_win_chance = max(0.10, min(0.70, base_win_chance + wish_quality_bonus))
+    return positive_count, negative_count, wish_quality_bonus, final_win_chance
+
+
+VOCABULARY = (
+    "I wish for the to a of and my be have all small today money world help infinite "
+    "patience family friend house car pizza happy rich peaceful every moment kind dog "
+    "never forget learn grow strength courage forever power control perfect little week"
+).split()
+
+
+def make_wishes(count, words, seed=7):
+    rng = random.Random(seed)
+    return ["I wish " + " ".join(rng.choice(VOCABULARY) for _ in range(words)) for _ in range(count)]
+
+
+def best_per_wish(fn, wishes, repeat):
+    return min(timeit.repeat(fn, number=1, repeat=repeat)) / len(wishes) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--wishes", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    scorer = WishScorer()
+    print(f"{args.wishes} wishes per size, best of {args.repeat} (us/wish)")
+    print(f"  {'words':>5} {'chars':>6} {'legacy':>8} {'score':>8} {'score_many':>10} {'speedup':>8}")
+    for words in (5, 10, 20, 40, 80):
+        wishes = make_wishes(args.wishes, words)
+        chars = sum(map(len, wishes)) / len(wishes)
+
+        def run_legacy():
+            for wish in wishes:
+                legacy_score(wish)
+
+        def run_engine():
+            for wish in wishes:
+                scorer.score(wish)
+
+        def run_batch():
+            scorer.score_many(wishes)
+
+        legacy = best_per_wish(run_legacy, wishes, args.repeat)
+        engine = best_per_wish(run_engine, wishes, args.repeat)
+        batch = best_per_wish(run_batch, wishes, args.repeat)
+        print(f"  {words:>5} {chars:>6.0f} {legacy:>8.2f} {engine:>8.2f} {batch:>10.2f} {legacy / engine:>7.2f}x")
+
+    wishes = make_wishes(args.wishes, 10)
+    differing = sum(1 for wish in wishes if legacy_score(wish)[:2] != scorer.score(wish)[:2])
+    print(f"  10-word wishes scored differently (substring vs whole-word matching): {differing}/{len(wishes)}")
+
+
+if __name__ == "__main__":
+    main()
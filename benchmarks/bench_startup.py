@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark: cold-start and worker boot cost of the app.
+
+Measures, in fresh interpreters, how long importing app.py and building the
+app takes, then boots gunicorn with and without preloading and times how
+long it takes until the first /health request is answered. Runs against a
+temporary SQLite database with the fake LLM, so nothing leaves the machine.
+
+To compare with a tree that still builds the app at import time, run the
+same script there with --target app:app.
+
+Usage:
+    python benchmarks/bench_startup.py [--runs 5] [--workers 1,4] [--target "app:create_app()"]
+"""
+
+import argparse
+import http.client
+import json
+import os
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from load_test import ROOT, free_port
+
+# Runs in a fresh interpreter; prints how long the import and the app build took
+CHILD = """
+import importlib, json, time
+started = time.perf_counter()
+module = importlib.import_module({module!r})
+imported = time.perf_counter()
+app = eval({expr!r}, vars(module))
+built = time.perf_counter()
+print(json.dumps({{"import_s": imported - started, "build_s": built - imported}}))
+"""
+
+
+def bench_env(database_url):
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": database_url,
+        "LLM_BACKEND": "fake",
+        "FLASK_SECRET_KEY": "startup-bench-secret",
+        "LOG_LEVEL": "WARNING",
+        # init_db.py has already run; the check would also load the app in the master
+        "DB_SCHEMA_CHECK": "0",
+    })
+    env.pop("FLASK_ENV", None)
+    return env
+
+
+def measure_import(target, env, runs):
+    """Time interpreter start + import + app build in fresh processes"""
+    module, expr = target.split(":", 1)
+    code = CHILD.format(module=module, expr=expr)
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, check=True,
+                                capture_output=True, text=True).stdout
+        wall = time.perf_counter() - started
+        sample = json.loads(output.strip().splitlines()[-1])
+        sample["process_s"] = wall
+        samples.append(sample)
+    return {key: summarize([sample[key] for sample in samples]) for key in ("import_s", "build_s", "process_s")}
+
+
+def first_response(port, timeout=60):
+    """Poll /health until it answers and return the time it took"""
+    started = time.perf_counter()
+    deadline = started + timeout
+    while time.perf_counter() < deadline:
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+        try:
+            connection.request("GET", "/health")
+            if connection.getresponse().status == 200:
+                return time.perf_counter() - started
+        except OSError:
+            pass
+        finally:
+            connection.close()
+        time.sleep(0.005)
+    raise RuntimeError(f"gunicorn did not answer within {timeout}s")
+
+
+def worker_cpu_seconds(master_pid):
+    """CPU time used so far by each worker forked from the gunicorn master (Linux only)"""
+    ticks = os.sysconf("SC_CLK_TCK")
+    usage = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        # Fields after the command name: state, ppid, ... utime (12th), stime (13th)
+        if int(fields[1]) == master_pid:
+            usage.append((int(fields[11]) + int(fields[12])) / ticks)
+    return usage
+
+
+def measure_gunicorn(target, env, workers, preload, runs):
+    """Time from launching gunicorn to the first answered request, and CPU spent booting each worker"""
+    samples = []
+    worker_cpu = []
+    for _ in range(runs):
+        port = free_port()
+        command = [
+            "gunicorn", target,
+            "--bind", f"127.0.0.1:{port}",
+            "--workers", str(workers),
+            "--log-level", "warning",
+        ]
+        run_env = dict(env, GUNICORN_PRELOAD="1" if preload else "0")
+        started = time.perf_counter()
+        process = subprocess.Popen(command, cwd=ROOT, env=run_env,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            first_response(port)
+            samples.append(time.perf_counter() - started)
+            if os.path.exists("/proc/self/stat"):
+                # Let the remaining workers finish booting before reading their CPU time
+                time.sleep(1.0)
+                worker_cpu.extend(worker_cpu_seconds(process.pid))
+        finally:
+            process.send_signal(signal.SIGTERM)
+            try:
+                process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+    return summarize(samples), summarize(worker_cpu) if worker_cpu else None
+
+
+def summarize(values):
+    return {
+        "median": round(statistics.median(values), 4),
+        "min": round(min(values), 4),
+        "max": round(max(values), 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--target", default="app:create_app()", help="module:expression that builds the app")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--workers", default="1,4", help="comma-separated gunicorn worker counts")
+    parser.add_argument("--skip-gunicorn", action="store_true")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="monkeypaw-startup-")
+    try:
+        env = bench_env(f"sqlite:///{os.path.join(tmpdir, 'startup.db')}")
+        subprocess.run([sys.executable, "init_db.py"], cwd=ROOT, env=env, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        results = {"target": args.target, "import": measure_import(args.target, env, args.runs), "gunicorn": []}
+        imported = results["import"]
+        print(f"Cold start ({args.target}), median of {args.runs}:")
+        print(f"  import app.py   {imported['import_s']['median'] * 1000:8.1f} ms")
+        print(f"  build the app   {imported['build_s']['median'] * 1000:8.1f} ms")
+        print(f"  whole process   {imported['process_s']['median'] * 1000:8.1f} ms")
+
+        if not args.skip_gunicorn:
+            if not shutil.which("gunicorn"):
+                raise SystemExit("gunicorn is not installed; use --skip-gunicorn")
+            print("\nGunicorn launch to first answered request:")
+            for workers in [int(w) for w in args.workers.split(",") if w]:
+                for preload in (True, False):
+                    timing, cpu = measure_gunicorn(args.target, env, workers, preload, args.runs)
+                    results["gunicorn"].append({
+                        "workers": workers,
+                        "preload": preload,
+                        "first_response_s": timing,
+                        "worker_boot_cpu_s": cpu,
+                    })
+                    label = f"{workers} worker(s), {'preload' if preload else 'no preload'}"
+                    line = f"  {label:<28} {timing['median'] * 1000:8.1f} ms"
+                    if cpu:
+                        line += f"   boot CPU per worker {cpu['median'] * 1000:7.1f} ms"
+                    print(line)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Benchmark wish and username validation against the original per-pattern version.
+
+Prints validations per second for plain wishes, wishes with markup,
+wishes that are rejected and usernames, for the original functions (ten
+uncompiled re.search calls, then bleach.clean every time) and for
+validation.py.
+
+With --check it first runs a differential fuzz: random inputs built from
+markup fragments, the rejection patterns in mixed case, control
+characters and arbitrary Unicode go through both versions, which must
+return identical results (sanitized text or error message). clean_markup()
+is also compared with bleach.clean(tags=[]), as used on twists. Any
+difference is printed and the script exits non-zero.
+
+Usage:
+    python benchmarks/bench_validation.py [--wishes 2000] [--repeat 5] [--check] [--cases 200000]
+"""
+
+import argparse
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bleach
+
+from validation import clean_markup, validate_username, validate_wish
+
+
+def legacy_validate_username(username):
+    """validate_username() as it was in app.py"""
+    if not username or len(username.strip()) == 0:
+        return None, "Username cannot be empty"
+    username = username.strip()
+    if len(username) < 2 or len(username) > 50:
+        return None, "Username must be between 2 and 50 characters"
+    if not re.match(r'^[a-zA-Z0-9_-]+$', username):
+        return None, "Username can only contain letters, numbers, hyphens, and underscores"
+    username = bleach.clean(username, tags=[], strip=True)
+    return username, None
+
+
+def legacy_validate_wish(wish):
+    """validate_wish() as it was in app.py"""
+    if not wish or len(wish.strip()) == 0:
+        return None, "Wish cannot be empty"
+    wish = wish.strip()
+    if len(wish) < 5 or len(wish) > 500:
+        return None, "Wish must be between 5 and 500 characters"
+    dangerous_patterns = [
+        r'<script', r'javascript:', r'data:', r'vbscript:', r'on\w+\s*=',
+        r'<iframe', r'<object', r'<embed', r'<form', r'<input'
+    ]
+    for pattern in dangerous_patterns:
+        if re.search(pattern, wish, re.IGNORECASE):
+            return None, "Wish contains potentially unsafe content"
+    allowed_tags = ['b', 'i', 'em', 'strong']
+    wish = bleach.clean(wish, tags=allowed_tags, strip=True)
+    return wish, None
+
+
+# Pieces fuzzed inputs are assembled from
+FRAGMENTS = (
+    "<b>", "</b>", "<i>", "</i>", "<em>", "</strong>", "<strong class='x'>", "<p>", "</div>", "<br/>",
+    "<", ">", "&", "&amp;", "&lt;", "&#60;", "&#x3c;", "&nbsp", "&bogus;", "<!--", "-->", "<![CDATA[",
+    "<script", "<ScRiPt>", "<iframe", "<OBJECT", "<embed", "<form", "<input", "< script",
+    "javascript:", "JavaScript :", "data:", "DATA:", "vbscript:", "onload=", "onClick =", "on =", "one=",
+    "ONé\t=", "=", '"', "'", "/", ";", ":", "\t", "\n", "\r", "\r\n", "\x00", "\x0b", "\x0c", "\x1b", "\x7f",
+    "\u00a0", "\u2028", "\u017f", "\u212a", "\ufeff", "\ufffd", "\ufffe", "\U0001f412", "\u0130", "\u3000",
+    "-", "_", "I wish for ", "a small house", "infinite pizza", "peace", "money", "user_01", "Paw-Fan",
+)
+
+PLAIN_CHARACTERS = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789 _-.,!?'"
+
+
+def fuzz_input(rng):
+    pieces = []
+    for _ in range(rng.randint(0, 24)):
+        roll = rng.random()
+        if roll < 0.45:
+            pieces.append(rng.choice(FRAGMENTS))
+        elif roll < 0.85:
+            pieces.append("".join(rng.choice(PLAIN_CHARACTERS) for _ in range(rng.randint(1, 12))))
+        else:
+            code = rng.choice((rng.randint(0, 0x7f), rng.randint(0x80, 0xffff), rng.randint(0x10000, 0x10ffff)))
+            if not 0xd800 <= code <= 0xdfff:
+                pieces.append(chr(code))
+    text = "".join(pieces)
+    if rng.random() < 0.05:
+        text = text * rng.randint(5, 40)  # over the length limits
+    return text
+
+
+def fuzz(cases, seed):
+    """Compare both versions on ``cases`` random inputs; return the differences"""
+    rng = random.Random(seed)
+    differences = []
+    for _ in range(cases):
+        text = fuzz_input(rng)
+        for name, legacy, current in (
+            ("validate_wish", legacy_validate_wish, validate_wish),
+            ("validate_username", legacy_validate_username, validate_username),
+            ("clean_markup", lambda t: bleach.clean(t, tags=[], strip=True), clean_markup),
+        ):
+            expected, actual = legacy(text), current(text)
+            if expected != actual:
+                differences.append((name, text, expected, actual))
+    return differences
+
+
+WORDS = (
+    "I wish for a small house by the sea and the patience to enjoy every quiet moment of today "
+    "with my family friends dog and a good cup of coffee"
+).split()
+
+
+def make_inputs(kind, count, rng):
+    if kind == "usernames":
+        return ["".join(rng.choice(PLAIN_CHARACTERS[:64] + "_-") for _ in range(rng.randint(3, 20)))
+                for _ in range(count)]
+    wishes = [" ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 30))) for _ in range(count)]
+    if kind == "markup wishes":
+        return [f"{wish[:20]}<b>{wish[20:40]}</b> & {wish[40:]}" for wish in wishes]
+    if kind == "rejected wishes":
+        return [f"{wish} <iframe src=x>" for wish in wishes]
+    return wishes
+
+
+def per_second(fn, inputs, repeat):
+    def run():
+        for text in inputs:
+            fn(text)
+    return len(inputs) / min(timeit.repeat(run, number=1, repeat=repeat))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--wishes", type=int, default=2000, help="inputs per kind")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--check", action="store_true", help="fuzz both versions and fail on any difference")
+    parser.add_argument("--cases", type=int, default=200000, help="fuzzed inputs for --check")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    if args.check:
+        differences = fuzz(args.cases, args.seed)
+        for name, text, expected, actual in differences[:10]:
+            print(f"❌ {name}({text!r}): was {expected!r}, now {actual!r}")
+        if differences:
+            raise SystemExit(f"❌ {len(differences)} difference(s) in {args.cases} fuzzed inputs")
+        print(f"✅ {args.cases} fuzzed inputs: identical results")
+
+    rng = random.Random(args.seed)
+    print(f"{args.wishes} inputs per kind, best of {args.repeat} (validations/s)")
+    print(f"  {'kind':<16} {'legacy':>10} {'validation':>11} {'speedup':>8}")
+    for kind, legacy, current in (
+        ("plain wishes", legacy_validate_wish, validate_wish),
+        ("markup wishes", legacy_validate_wish, validate_wish),
+        ("rejected wishes", legacy_validate_wish, validate_wish),
+        ("usernames", legacy_validate_username, validate_username),
+    ):
+        inputs = make_inputs(kind, args.wishes, rng)
+        before = per_second(legacy, inputs, args.repeat)
+        after = per_second(current, inputs, args.repeat)
+        print(f"  {kind:<16} {before:>10.0f} {after:>11.0f} {after / before:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+"""
+Offline load test for the Flask app.
+
+Boots ``gunicorn "app:create_app()"`` (or Werkzeug in-process) against SQLite or a
+local Postgres, with the fake LLM from fake_openai.py standing in for
+OpenAI. Virtual players register, wish, open the spellbook and read the
+leaderboard in a configurable mix, and the run reports throughput plus
+p50/p95/p99 latency per endpoint. Results are written as JSON; pass
+--baseline to compare against an earlier run and exit non-zero on a
+regression.
+
+Usage:
+    python benchmarks/load_test.py --concurrency 1,8,32 --duration 20 \\
+        --llm-latency 0.8 --llm-jitter 0.3 --output bench_output.json
+    python benchmarks/load_test.py --baseline bench_baseline.json
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import re
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Relative weights of each action per virtual-player step
+MIXES = {
+    "play": {"wish": 75, "leaderboard": 15, "generate_suggestions": 5, "set_username": 5},
+    "browse": {"leaderboard": 80, "wish": 20},
+    "wish_only": {"wish": 100},
+    "spellbook": {"generate_suggestions": 50, "wish": 50},
+}
+
+WISHES = [
+    "for infinite money",
+    "to be rich",
+    "for the wisdom to make good decisions today",
+    "for a small moment of peace this week",
+    "that my dog lives forever",
+    "to control the weather in my town for one hour",
+    "for the courage to help a stranger today",
+    "for unlimited pizza",
+    "to be famous all over the world",
+    "for a genuine friend who is kind and humble",
+    "to learn to play the piano in a week without practicing",
+    "that everything I touch turns to gold",
+]
+
+CSRF_RE = re.compile(r'name="csrf-token" content="([^"]+)"')
+
+
+class Client:
+    """Minimal HTTP client for one virtual player.
+
+    Cookies are tracked by hand because the session cookie is marked Secure,
+    which http.cookiejar would refuse to send back over plain HTTP.
+    """
+
+    def __init__(self, base_url, timeout=60):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port
+        self.timeout = timeout
+        self.cookies = {}
+        self.csrf_token = None
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        if self.cookies:
+            headers["Cookie"] = "; ".join(f"{k}={v}" for k, v in self.cookies.items())
+        if body is not None:
+            body = json.dumps(body)
+            headers["Content-Type"] = "application/json"
+        if self.csrf_token:
+            headers["X-CSRFToken"] = self.csrf_token
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            data = response.read()
+            for header, value in response.getheaders():
+                if header.lower() == "set-cookie":
+                    name, _, rest = value.partition("=")
+                    self.cookies[name.strip()] = rest.split(";", 1)[0]
+            return response.status, data
+        finally:
+            conn.close()
+
+    def login(self, username):
+        status, page = self.request("GET", "/username")
+        match = CSRF_RE.search(page.decode("utf-8", "replace"))
+        self.csrf_token = match.group(1) if match else None
+        return self.request("POST", "/set_username", {"username": username})
+
+
+class Recorder:
+    """Thread-safe latency and status recorder, one bucket per endpoint"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.statuses = {}
+        self.errors = {}
+
+    def record(self, endpoint, seconds, status):
+        with self.lock:
+            self.samples.setdefault(endpoint, []).append(seconds)
+            bucket = self.statuses.setdefault(endpoint, {})
+            bucket[str(status)] = bucket.get(str(status), 0) + 1
+            if status == "exception" or (isinstance(status, int) and status >= 500):
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def virtual_player(base_url, mix, deadline, recorder, player_id, seed):
+    rng = random.Random(seed)
+    client = Client(base_url)
+    actions, weights = zip(*mix.items())
+    generation = 0
+
+    def timed(endpoint, fn):
+        started = time.perf_counter()
+        try:
+            status, _ = fn()
+        except Exception:
+            status = "exception"
+        recorder.record(endpoint, time.perf_counter() - started, status)
+
+    def new_player():
+        nonlocal generation
+        generation += 1
+        timed("set_username", lambda: client.login(f"bench{player_id}_{generation}"))
+
+    new_player()
+    while time.monotonic() < deadline:
+        action = rng.choices(actions, weights)[0]
+        if action == "wish":
+            wish = rng.choice(WISHES)
+            timed("wish", lambda: client.request("POST", "/wish", {"wish": wish}))
+        elif action == "leaderboard":
+            timed("leaderboard", lambda: client.request("GET", "/leaderboard"))
+        elif action == "generate_suggestions":
+            timed("generate_suggestions", lambda: client.request("POST", "/generate_suggestions"))
+        elif action == "set_username":
+            new_player()
+
+
+def run_level(base_url, mix, concurrency, duration, seed):
+    recorder = Recorder()
+    deadline = time.monotonic() + duration
+    started = time.perf_counter()
+    threads = [
+        threading.Thread(
+            target=virtual_player,
+            args=(base_url, mix, deadline, recorder, f"{concurrency}x{i}", seed * 1000 + i),
+            daemon=True,
+        )
+        for i in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    endpoints = {}
+    total = 0
+    for endpoint, samples in sorted(recorder.samples.items()):
+        samples.sort()
+        total += len(samples)
+        endpoints[endpoint] = {
+            "count": len(samples),
+            "rps": round(len(samples) / elapsed, 2),
+            "p50_ms": round(percentile(samples, 0.50) * 1000, 2),
+            "p95_ms": round(percentile(samples, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(samples, 0.99) * 1000, 2),
+            "errors": recorder.errors.get(endpoint, 0),
+            "statuses": recorder.statuses.get(endpoint, {}),
+        }
+    return {
+        "concurrency": concurrency,
+        "duration_s": round(elapsed, 2),
+        "throughput_rps": round(total / elapsed, 2),
+        "endpoints": endpoints,
+    }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_server(base_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    client = Client(base_url, timeout=2)
+    while time.monotonic() < deadline:
+        try:
+            status, _ = client.request("GET", "/health")
+            if status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Server at {base_url} did not come up within {timeout}s")
+
+
+def server_env(args, database_url):
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": database_url,
+        "LLM_BACKEND": "fake",
+        "FAKE_LLM_LATENCY": str(args.llm_latency),
+        "FAKE_LLM_JITTER": str(args.llm_jitter),
+        "FAKE_LLM_SEED": str(args.seed),
+        "RATELIMIT_ENABLED": "0",
+        "FLASK_SECRET_KEY": "load-test-secret",
+        # init_db.py runs before the server starts
+        "DB_SCHEMA_CHECK": "0",
+        # gunicorn.conf.py patches the standard library before preloading for gevent
+        "GUNICORN_WORKER_CLASS": args.worker_class,
+        "PYTHONUNBUFFERED": "1",
+    })
+    env.pop("FLASK_ENV", None)
+    return env
+
+
+def start_server(args, env, port):
+    """Start the app in a subprocess and return the Popen handle"""
+    if args.server == "gunicorn":
+        if not shutil.which("gunicorn"):
+            raise SystemExit("gunicorn is not installed; use --server werkzeug")
+        command = [
+            "gunicorn", "app:create_app()",
+            "--bind", f"127.0.0.1:{port}",
+            "--workers", str(args.workers),
+            "--worker-class", args.worker_class,
+            "--threads", str(args.threads),
+            "--timeout", "120",
+            "--log-level", "warning",
+        ]
+    else:
+        command = [
+            sys.executable, "-c",
+            "import app; app.create_app().run(host='127.0.0.1', port=%d, threaded=True)" % port,
+        ]
+    log = open(args.server_log, "w") if args.server_log else subprocess.DEVNULL
+    return subprocess.Popen(command, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of regression messages against a baseline results file"""
+    problems = []
+    baseline_runs = {run["concurrency"]: run for run in baseline.get("runs", [])}
+    for run in results["runs"]:
+        base = baseline_runs.get(run["concurrency"])
+        if base is None:
+            continue
+        label = f"c={run['concurrency']}"
+        if run["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            problems.append(f"{label} throughput {run['throughput_rps']} rps < baseline {base['throughput_rps']} rps")
+        for endpoint, stats in run["endpoints"].items():
+            base_stats = base["endpoints"].get(endpoint)
+            if not base_stats:
+                continue
+            for key in ("p95_ms", "p99_ms"):
+                # Ignore sub-millisecond noise on very fast endpoints
+                if stats[key] > base_stats[key] * (1 + tolerance) and stats[key] - base_stats[key] > 2:
+                    problems.append(f"{label} {endpoint} {key} {stats[key]} > baseline {base_stats[key]}")
+            if stats["errors"] > base_stats["errors"]:
+                problems.append(f"{label} {endpoint} errors {stats['errors']} > baseline {base_stats['errors']}")
+    return problems
+
+
+def print_run(run):
+    print(f"\nconcurrency {run['concurrency']}: {run['throughput_rps']} req/s over {run['duration_s']}s")
+    print(f"  {'endpoint':<22} {'count':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for endpoint, stats in run["endpoints"].items():
+        print(f"  {endpoint:<22} {stats['count']:>7} {stats['rps']:>8} {stats['p50_ms']:>8} "
+              f"{stats['p95_ms']:>8} {stats['p99_ms']:>8} {stats['errors']:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--concurrency", default="1,8,32", help="comma-separated virtual player counts")
+    parser.add_argument("--duration", type=float, default=20, help="seconds per concurrency level")
+    parser.add_argument("--mix", choices=sorted(MIXES), default="play")
+    parser.add_argument("--llm-latency", type=float, default=0.8, help="fake LLM mean latency in seconds")
+    parser.add_argument("--llm-jitter", type=float, default=0.3, help="fake LLM +/- jitter in seconds")
+    parser.add_argument("--database-url", help="defaults to a temporary SQLite file")
+    parser.add_argument("--server", choices=["gunicorn", "werkzeug"], default="gunicorn")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--worker-class", default="sync")
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--url", help="drive an already running server instead of starting one")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="bench_output.json")
+    parser.add_argument("--baseline", help="results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative regression")
+    parser.add_argument("--server-log", help="write server output to this file")
+    args = parser.parse_args()
+
+    levels = [int(level) for level in args.concurrency.split(",") if level]
+    mix = MIXES[args.mix]
+    tmpdir = None
+    process = None
+    base_url = args.url
+
+    try:
+        if not base_url:
+            database_url = args.database_url
+            if not database_url:
+                tmpdir = tempfile.mkdtemp(prefix="monkeypaw-bench-")
+                database_url = f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+            env = server_env(args, database_url)
+            subprocess.run([sys.executable, "init_db.py"], cwd=ROOT, env=env, check=True,
+                           stdout=subprocess.DEVNULL)
+            port = free_port()
+            process = start_server(args, env, port)
+            base_url = f"http://127.0.0.1:{port}"
+            wait_for_server(base_url)
+
+        results = {
+            "meta": {
+                "mix": args.mix,
+                "server": "external" if args.url else args.server,
+                "workers": args.workers,
+                "worker_class": args.worker_class,
+                "threads": args.threads,
+                "llm_latency": args.llm_latency,
+                "llm_jitter": args.llm_jitter,
+                "database": "external" if args.url else ("sqlite" if not args.database_url else "custom"),
+                "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            },
+            "runs": [],
+        }
+        for level in levels:
+            run = run_level(base_url, mix, level, args.duration, args.seed)
+            results["runs"].append(run)
+            print_run(run)
+    finally:
+        if process is not None:
+            process.send_signal(signal.SIGTERM)
+            try:
+                process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if tmpdir:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        problems = compare(results, baseline, args.tolerance)
+        if problems:
+            print(f"\n❌ PERFORMANCE REGRESSION against {args.baseline} (tolerance {args.tolerance:.0%}):")
+            for problem in problems:
+                print(f"  - {problem}")
+            sys.exit(1)
+        print(f"✅ No regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
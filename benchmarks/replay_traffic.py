@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+"""
+Replay recorded wish traffic from wish_history against a local instance.
+
+Rows are streamed in timestamp order from a database (--source-url, e.g. a
+restored copy of production) or from archive files written by
+archive_history.py (--file, a part file or an archive directory). Each
+recorded player logs in once and re-issues their wishes in order, at the
+recorded times: gaps between wishes are divided by --speed, and gaps
+longer than --max-gap (overnight lulls) are shortened to it. A player's
+next wish waits for their previous answer, like the page does.
+
+The server is booted like in load_test.py, against a temporary SQLite
+database (or --database-url), with the fake LLM answering each recorded
+wish with its recorded twist_result after its recorded llm_latency_ms.
+Wishes without a recorded latency (cache hits, older rows) use
+--llm-latency and --llm-jitter. Model latency is not compressed by
+--speed; it is part of what is being measured.
+
+The report has throughput and p50/p95/p99 latency per endpoint, how late
+wishes were dispatched against their schedule (if that grows, the harness,
+not the server, is the bottleneck), how long wishes queued behind the same
+player's previous one, and the recorded outcome distribution next
+to the replayed one: win rate, game overs per wish and wish length. The
+replayed outcomes are rolled by the current scorer, so a difference beyond
+noise (|z| > 3) means the game plays differently, not just faster. With
+--check the script exits non-zero on server errors or such a difference.
+
+Usage:
+    python benchmarks/replay_traffic.py --source-url postgresql://localhost:5432/monkeypaw_copy \\
+        --since 2026-10-01 --until 2026-10-02 --speed 60 --max-gap 30
+    python benchmarks/replay_traffic.py --file archive/ --limit 20000 --speed 0 --workers 2
+
+To replay against a server you start yourself, write the recorded twists
+with --twists-out, start it with LLM_BACKEND=fake and FAKE_LLM_REPLAY set
+to that file, then run again with --url.
+"""
+
+import argparse
+import json
+import math
+import os
+import queue
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, Text, create_engine, select
+
+from load_test import ROOT, Client, Recorder, free_port, percentile, server_env, start_server, wait_for_server
+
+sys.path.insert(0, ROOT)
+
+from history_archive import read_archive
+
+# A game ends after this many losses in a row (app.MAX_FAILED_WISHES)
+MAX_FAILED_WISHES = 5
+
+# Seconds a player's worker waits for their next wish before exiting
+PLAYER_IDLE_SECONDS = 5
+
+history = Table(
+    "wish_history", MetaData(),
+    Column("id", Integer),
+    Column("username", String),
+    Column("wish_text", Text),
+    Column("twist_result", Text),
+    Column("outcome", String),
+    Column("timestamp", DateTime),
+    Column("session_number", Integer),
+    Column("llm_latency_ms", Integer),
+)
+
+
+def source_rows(args):
+    """Yield the recorded wishes to replay, in timestamp order"""
+    if args.source_url:
+        yield from database_rows(args)
+        return
+    count = 0
+    for record in read_archive(args.file):
+        timestamp = record.get("timestamp")
+        if timestamp is None or (args.since and timestamp < args.since) or (args.until and timestamp >= args.until):
+            continue
+        yield record
+        count += 1
+        if args.limit and count >= args.limit:
+            return
+
+
+def database_rows(args):
+    engine = create_engine(args.source_url)
+    query = select(history).where(history.c.timestamp.isnot(None)).order_by(history.c.timestamp, history.c.id)
+    if args.since:
+        query = query.where(history.c.timestamp >= args.since)
+    if args.until:
+        query = query.where(history.c.timestamp < args.until)
+    if args.limit:
+        query = query.limit(args.limit)
+    try:
+        with engine.connect().execution_options(stream_results=True, yield_per=1000) as connection:
+            for row in connection.execute(query):
+                yield dict(row._mapping)
+    finally:
+        engine.dispose()
+
+
+def write_replay_file(rows, path):
+    """Write the recorded twists for the fake LLM (see fake_openai.load_replay); return the row count"""
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for row in rows:
+            if row.get("twist_result"):
+                f.write(json.dumps({
+                    "wish": row["wish_text"],
+                    "twist": row["twist_result"],
+                    "latency_ms": row.get("llm_latency_ms"),
+                }, ensure_ascii=False) + "\n")
+            count += 1
+    return count
+
+
+class OutcomeTally:
+    """Wins, game overs and wish lengths of one side of the comparison"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wishes = 0
+        self.wins = 0
+        self.game_overs = 0
+        self.lengths = []
+        self.losing_runs = {}  # username -> (session_number, losses in a row)
+
+    def add(self, wish, won, game_over):
+        with self.lock:
+            self.wishes += 1
+            self.wins += won
+            self.game_overs += game_over
+            self.lengths.append(len(wish))
+
+    def add_recorded(self, row):
+        """Count a recorded row; its game over is worked out from the losses before it in its game"""
+        won = row["outcome"] == "win"
+        session, losses = self.losing_runs.get(row["username"], (row["session_number"], 0))
+        if session != row["session_number"]:
+            losses = 0
+        losses = 0 if won else losses + 1
+        game_over = losses >= MAX_FAILED_WISHES
+        self.losing_runs[row["username"]] = (row["session_number"], 0 if game_over else losses)
+        self.add(row["wish_text"], won, game_over)
+
+    def summary(self):
+        lengths = sorted(self.lengths)
+        return {
+            "wishes": self.wishes,
+            "win_rate": round(self.wins / self.wishes, 4) if self.wishes else 0.0,
+            "game_overs_per_wish": round(self.game_overs / self.wishes, 4) if self.wishes else 0.0,
+            "wishes_per_game": round(self.wishes / self.game_overs, 2) if self.game_overs else None,
+            "wish_length_p50": percentile(lengths, 0.50),
+            "wish_length_p95": percentile(lengths, 0.95),
+        }
+
+
+def z_score(successes_a, total_a, successes_b, total_b):
+    """Two-proportion z statistic; 0 when either side is empty"""
+    if not total_a or not total_b:
+        return 0.0
+    pooled = (successes_a + successes_b) / (total_a + total_b)
+    spread = math.sqrt(pooled * (1 - pooled) * (1 / total_a + 1 / total_b))
+    return (successes_a / total_a - successes_b / total_b) / spread if spread else 0.0
+
+
+class Replayer:
+    """One worker thread per active player, sending that player's wishes in order"""
+
+    def __init__(self, base_url, recorder, tally):
+        self.base_url = base_url
+        self.recorder = recorder
+        self.tally = tally
+        self.lock = threading.Lock()
+        self.players = {}  # username -> queue of (row, scheduled time)
+        self.clients = {}  # username -> logged-in Client, kept across idle periods
+        self.threads = []
+        self.queued = []
+        self.peak_players = 0
+
+    def submit(self, row, scheduled):
+        username = row["username"]
+        with self.lock:
+            player = self.players.get(username)
+            if player is None:
+                player = self.players[username] = queue.Queue()
+                thread = threading.Thread(target=self._play, args=(username, player), daemon=True)
+                self.threads.append(thread)
+                thread.start()
+                self.peak_players = max(self.peak_players, len(self.players))
+            player.put((row, scheduled))
+
+    def join(self):
+        for thread in list(self.threads):
+            thread.join()
+
+    def _play(self, username, player):
+        client = self.clients.get(username)
+        while True:
+            try:
+                row, scheduled = player.get(timeout=PLAYER_IDLE_SECONDS)
+            except queue.Empty:
+                with self.lock:
+                    if player.empty():
+                        del self.players[username]
+                        return
+                continue
+            if client is None:
+                client = self.clients[username] = Client(self.base_url)
+                self._timed("set_username", lambda: client.login(username))
+            with self.lock:
+                self.queued.append(max(0.0, time.monotonic() - scheduled))
+            status, body = self._timed(
+                "wish", lambda: client.request("POST", "/wish", {"wish": row["wish_text"]}))
+            if status == 200:
+                payload = json.loads(body)
+                self.tally.add(row["wish_text"], payload["result"] == "win", payload["game_over"])
+
+    def _timed(self, endpoint, fn):
+        started = time.perf_counter()
+        try:
+            status, body = fn()
+        except Exception:
+            status, body = "exception", None
+        self.recorder.record(endpoint, time.perf_counter() - started, status)
+        return status, body
+
+
+def replay(args, base_url):
+    """Dispatch every row at its scheduled time; return the run's results"""
+    recorder = Recorder()
+    replayed = OutcomeTally()
+    recorded = OutcomeTally()
+    replayer = Replayer(base_url, recorder, replayed)
+    offset = 0.0
+    previous = None
+    first = last = None
+    lags = []
+    started = time.monotonic()
+    for row in source_rows(args):
+        timestamp = row["timestamp"]
+        first = first or timestamp
+        last = timestamp
+        if previous is not None and args.speed > 0:
+            gap = max(0.0, (timestamp - previous).total_seconds())
+            if args.max_gap is not None:
+                gap = min(gap, args.max_gap)
+            offset += gap / args.speed
+        previous = timestamp
+        scheduled = started + offset
+        delay = scheduled - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        lags.append(max(0.0, time.monotonic() - scheduled))
+        recorded.add_recorded(row)
+        replayer.submit(row, scheduled)
+    replayer.join()
+    elapsed = time.monotonic() - started
+
+    endpoints = {}
+    for endpoint, samples in sorted(recorder.samples.items()):
+        samples.sort()
+        endpoints[endpoint] = {
+            "count": len(samples),
+            "rps": round(len(samples) / elapsed, 2),
+            "p50_ms": round(percentile(samples, 0.50) * 1000, 2),
+            "p95_ms": round(percentile(samples, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(samples, 0.99) * 1000, 2),
+            "errors": recorder.errors.get(endpoint, 0),
+            "statuses": recorder.statuses.get(endpoint, {}),
+        }
+    lags.sort()
+    queued = sorted(replayer.queued)
+    return {
+        "recorded_span_s": round((last - first).total_seconds(), 1) if first else 0.0,
+        "scheduled_span_s": round(offset, 1),
+        "duration_s": round(elapsed, 2),
+        "wish_rps": round(len(lags) / elapsed, 2) if elapsed else 0.0,
+        "peak_players": replayer.peak_players,
+        "lag_p50_ms": round(percentile(lags, 0.50) * 1000, 1),
+        "lag_p99_ms": round(percentile(lags, 0.99) * 1000, 1),
+        "lag_max_ms": round(lags[-1] * 1000, 1) if lags else 0.0,
+        "queued_p50_ms": round(percentile(queued, 0.50) * 1000, 1),
+        "queued_p99_ms": round(percentile(queued, 0.99) * 1000, 1),
+        "endpoints": endpoints,
+        "recorded": recorded.summary(),
+        "replayed": replayed.summary(),
+        "win_rate_z": round(z_score(replayed.wins, replayed.wishes, recorded.wins, recorded.wishes), 2),
+        "game_over_z": round(z_score(replayed.game_overs, replayed.wishes, recorded.game_overs, recorded.wishes), 2),
+    }
+
+
+def print_results(results):
+    print(f"\nreplayed {results['recorded_span_s']}s of traffic in {results['duration_s']}s "
+          f"(scheduled {results['scheduled_span_s']}s): {results['wish_rps']} wishes/s, "
+          f"up to {results['peak_players']} players at once")
+    print(f"  dispatch lag behind schedule: p50 {results['lag_p50_ms']} ms, p99 {results['lag_p99_ms']} ms, "
+          f"max {results['lag_max_ms']} ms")
+    print(f"  queued behind the player's previous wish: p50 {results['queued_p50_ms']} ms, "
+          f"p99 {results['queued_p99_ms']} ms")
+    print(f"  {'endpoint':<22} {'count':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for endpoint, stats in results["endpoints"].items():
+        print(f"  {endpoint:<22} {stats['count']:>7} {stats['rps']:>8} {stats['p50_ms']:>8} "
+              f"{stats['p95_ms']:>8} {stats['p99_ms']:>8} {stats['errors']:>7}")
+    recorded, replayed = results["recorded"], results["replayed"]
+    print(f"\n  {'outcomes':<22} {'recorded':>10} {'replayed':>10} {'z':>6}")
+    for key, label, z in (
+        ("wishes", "wishes", None),
+        ("win_rate", "win rate", results["win_rate_z"]),
+        ("game_overs_per_wish", "game overs per wish", results["game_over_z"]),
+        ("wishes_per_game", "wishes per game", None),
+        ("wish_length_p50", "wish length p50", None),
+        ("wish_length_p95", "wish length p95", None),
+    ):
+        print(f"  {label:<22} {str(recorded[key]):>10} {str(replayed[key]):>10} {'' if z is None else z:>6}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--source-url", help="database to read wish_history from")
+    source.add_argument("--file", help="archive part file or directory from archive_history.py")
+    parser.add_argument("--since", type=datetime.fromisoformat, help="first timestamp to replay (UTC)")
+    parser.add_argument("--until", type=datetime.fromisoformat, help="timestamp to stop before (UTC)")
+    parser.add_argument("--limit", type=int, help="replay at most this many wishes")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="time compression: 60 replays an hour in a minute; 0 sends as fast as players allow")
+    parser.add_argument("--max-gap", type=float, help="longest recorded gap in seconds, before --speed")
+    parser.add_argument("--llm-latency", type=float, default=0.8, help="fake LLM latency for wishes without one recorded")
+    parser.add_argument("--llm-jitter", type=float, default=0.3, help="fake LLM +/- jitter for those wishes")
+    parser.add_argument("--database-url", help="database for the server; defaults to a temporary SQLite file")
+    parser.add_argument("--server", choices=["gunicorn", "werkzeug"], default="gunicorn")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--worker-class", default="gevent")
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--url", help="replay against an already running server (see --twists-out)")
+    parser.add_argument("--twists-out", help="only write the recorded twists for FAKE_LLM_REPLAY to this file")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="replay_output.json")
+    parser.add_argument("--server-log", help="write server output to this file")
+    parser.add_argument("--check", action="store_true", help="fail on server errors or outcomes beyond noise")
+    args = parser.parse_args()
+
+    if args.twists_out:
+        rows = write_replay_file(source_rows(args), args.twists_out)
+        print(f"✅ Wrote the twists of {rows} recorded wishes to {args.twists_out}")
+        return
+
+    tmpdir = tempfile.mkdtemp(prefix="monkeypaw-replay-")
+    process = None
+    base_url = args.url
+    try:
+        replay_path = os.path.join(tmpdir, "twists.ndjson")
+        rows = write_replay_file(source_rows(args), replay_path)
+        print(f"{rows} recorded wishes to replay")
+        if not base_url:
+            database_url = args.database_url or f"sqlite:///{os.path.join(tmpdir, 'replay.db')}"
+            env = server_env(args, database_url)
+            env["FAKE_LLM_REPLAY"] = replay_path
+            subprocess.run([sys.executable, "migrate.py"], cwd=ROOT, env=env, check=True,
+                           stdout=subprocess.DEVNULL)
+            port = free_port()
+            process = start_server(args, env, port)
+            base_url = f"http://127.0.0.1:{port}"
+            wait_for_server(base_url)
+
+        results = replay(args, base_url)
+        results["meta"] = {
+            "source": "database" if args.source_url else args.file,
+            "since": args.since.isoformat() if args.since else None,
+            "until": args.until.isoformat() if args.until else None,
+            "speed": args.speed,
+            "max_gap": args.max_gap,
+            "server": "external" if args.url else args.server,
+            "workers": args.workers,
+            "worker_class": args.worker_class,
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        print_results(results)
+    finally:
+        if process is not None:
+            process.send_signal(signal.SIGTERM)
+            try:
+                process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.check:
+        problems = [f"{endpoint}: {stats['errors']} server errors"
+                    for endpoint, stats in results["endpoints"].items() if stats["errors"]]
+        for key in ("win_rate_z", "game_over_z"):
+            if abs(results[key]) > 3:
+                problems.append(f"{key.replace('_z', '').replace('_', ' ')} differs beyond noise (z={results[key]})")
+        if problems:
+            print("\n❌ Replay differs from the recording:")
+            for problem in problems:
+                print(f"  - {problem}")
+            sys.exit(1)
+        print("✅ No server errors, outcomes within noise of the recording")
+
+
+if __name__ == "__main__":
+    main()
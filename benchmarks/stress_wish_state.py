@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Concurrency stress test for the per-wish game state transition.
+
+Boots gunicorn with several workers and the fake LLM, logs many clients in
+as the same player and has them all wish at once, as if the player had
+many tabs open. Afterwards the player's wish_history is replayed in
+insertion order through the game rules and the result must match the
+users row exactly: wishes_made, streak, failed_wishes, avoided_twists,
+session_number and the number of finished games. A lost update (two
+wishes read the same state and the second write wins) shows up as a
+mismatch, and as two successful responses reporting the same wish number.
+
+Usage:
+    python benchmarks/stress_wish_state.py --clients 16 --wishes 25 --workers 4
+    python benchmarks/stress_wish_state.py --database-url postgresql://localhost:5432/monkeypaw_stress
+"""
+
+import argparse
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+from collections import Counter
+
+from sqlalchemy import create_engine, text
+
+from load_test import ROOT, Client, WISHES, free_port, wait_for_server
+
+MAX_FAILED_WISHES = 5
+
+
+def server_env(args, database_url):
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": database_url,
+        "LLM_BACKEND": "fake",
+        "FAKE_LLM_LATENCY": str(args.llm_latency),
+        "FAKE_LLM_JITTER": str(args.llm_latency),
+        "RATELIMIT_ENABLED": "0",
+        "FLASK_SECRET_KEY": "stress-test-secret",
+        "DB_SCHEMA_CHECK": "0",
+        # History rows must be written with the state change for the replay to be exact
+        "HISTORY_WRITE_BEHIND": "0",
+        "LOG_LEVEL": "WARNING",
+        "GUNICORN_WORKER_CLASS": args.worker_class,
+    })
+    env.pop("FLASK_ENV", None)
+    return env
+
+
+def replay(outcomes):
+    """Run the game rules over a player's outcomes.
+
+    Returns the expected final state, the session each wish belongs to and
+    the wishes_made value each wish's response should have reported.
+    """
+    state = {"wishes_made": 0, "streak": 0, "failed_wishes": 0, "avoided_twists": 0,
+             "session_number": 1, "games": 0}
+    sessions, numbers = [], []
+    for outcome in outcomes:
+        sessions.append(state["session_number"])
+        if state["wishes_made"] == 0:
+            state["avoided_twists"] = 0
+        state["wishes_made"] += 1
+        numbers.append(state["wishes_made"])
+        if outcome == "win":
+            state["streak"] += 1
+            state["failed_wishes"] = 0
+            state["avoided_twists"] += 1
+        else:
+            state["streak"] = 0
+            state["failed_wishes"] += 1
+            if state["failed_wishes"] >= MAX_FAILED_WISHES:
+                state.update(wishes_made=0, failed_wishes=0)
+                state["session_number"] += 1
+                state["games"] += 1
+    return state, sessions, numbers
+
+
+def hammer(base_url, username, clients, wishes):
+    """Every client wishes concurrently as the same player; return the responses"""
+    players = []
+    for _ in range(clients):
+        client = Client(base_url, timeout=120)
+        client.login(username)
+        players.append(client)
+
+    results = []
+    lock = threading.Lock()
+    start = threading.Barrier(clients)
+
+    def play(index, client):
+        start.wait()
+        for n in range(wishes):
+            try:
+                status, body = client.request("POST", "/wish", {"wish": WISHES[(index + n) % len(WISHES)]})
+            except OSError:
+                status, body = "exception", b""
+            with lock:
+                results.append((status, body))
+
+    threads = [threading.Thread(target=play, args=(i, c)) for i, c in enumerate(players)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def check(database_url, username, results):
+    """Compare the stored state with a replay of the stored history; return a list of problems"""
+    problems = []
+    engine = create_engine(database_url)
+    with engine.connect() as connection:
+        user = connection.execute(text(
+            "SELECT wishes_made, streak, failed_wishes, avoided_twists, session_number "
+            "FROM users WHERE username = :username"
+        ), {"username": username}).mappings().one()
+        history = connection.execute(text(
+            "SELECT outcome, session_number FROM wish_history WHERE username = :username ORDER BY id"
+        ), {"username": username}).all()
+    engine.dispose()
+
+    expected, sessions, numbers = replay([row.outcome for row in history])
+    for column in ("wishes_made", "streak", "failed_wishes", "avoided_twists", "session_number"):
+        if user[column] != expected[column]:
+            problems.append(f"{column} is {user[column]}, history says {expected[column]}")
+    if [row.session_number for row in history] != sessions:
+        problems.append("wish_history session numbers do not follow the game-over sequence")
+
+    payloads = [json.loads(body) for status, body in results if status == 200]
+    if len(payloads) != len(history):
+        problems.append(f"{len(payloads)} wishes succeeded but {len(history)} history rows exist")
+    # Each wish in a game reports its own number; a lost update repeats one and skips another
+    if Counter(payload["wishes_made"] for payload in payloads) != Counter(numbers):
+        problems.append("responses reported the same wish number twice within a game")
+    game_overs = sum(1 for payload in payloads if payload["game_over"])
+    if game_overs != expected["games"]:
+        problems.append(f"{game_overs} responses reported game over, history has {expected['games']} finished games")
+    return problems, expected, len(history)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--clients", type=int, default=16, help="concurrent sessions for the one player")
+    parser.add_argument("--wishes", type=int, default=25, help="wishes per session")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--worker-class", default="sync")
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="fake LLM latency (and jitter) in seconds")
+    parser.add_argument("--database-url", help="defaults to a temporary SQLite file")
+    args = parser.parse_args()
+
+    if not shutil.which("gunicorn"):
+        raise SystemExit("gunicorn is not installed")
+    tmpdir = tempfile.mkdtemp(prefix="monkeypaw-stress-")
+    database_url = args.database_url or f"sqlite:///{os.path.join(tmpdir, 'stress.db')}"
+    env = server_env(args, database_url)
+    subprocess.run([sys.executable, "init_db.py"], cwd=ROOT, env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    port = free_port()
+    process = subprocess.Popen(
+        ["gunicorn", "--bind", f"127.0.0.1:{port}", "--workers", str(args.workers),
+         "--threads", str(args.threads), "--timeout", "120", "--log-level", "warning"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    username = f"stress{os.getpid()}"
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        wait_for_server(base_url)
+        results = hammer(base_url, username, args.clients, args.wishes)
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+    try:
+        problems, expected, rows = check(database_url, username, results)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    statuses = Counter(str(status) for status, _ in results)
+    print(f"{args.clients} sessions x {args.wishes} wishes for one player on {args.workers} worker(s): "
+          f"statuses {dict(statuses)}, {rows} history rows, {expected['games']} finished games")
+    if problems:
+        for problem in problems:
+            print(f"❌ {problem}")
+        sys.exit(1)
+    print("✅ Player state matches a replay of the wish history")
+
+
+if __name__ == "__main__":
+    main()
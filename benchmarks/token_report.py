@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Token and latency report for the paw and spellbook prompts, before and after compaction.
+
+Sends the same wishes (and spellbook requests) once with the prompts as they
+used to be built - indented triple-quoted system prompts, the instructions
+repeated in the user message, the suggestion count inside the system prompt,
+no output cap on twists - and once with the current ones, then prints prompt
+and completion tokens and latency per call for each. The static prefix
+column is the part of every call's prompt that is byte-identical between
+calls and so can come from the provider's prompt cache; it is estimated
+with tiktoken when installed and at 4 characters per token otherwise.
+
+By default the fake LLM is used (tokens are then words, and latency is
+whatever --llm-latency says); --backend openai sends real requests with
+OPENAI_API_KEY. --database-url also summarizes the per-wish usage stored
+in wish_history by day, to compare real traffic across a deploy.
+
+Usage:
+    python benchmarks/token_report.py [--wishes 24] [--backend fake|openai]
+    python benchmarks/token_report.py --database-url postgresql://localhost:5432/monkeypaw --days 14
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import PAW_PROMPT, build_suggestion_messages, build_wish_messages
+from fake_openai import FakeOpenAI
+from load_test import WISHES
+from token_budget import suggestion_max_tokens, wish_max_tokens
+
+# The spellbook prompt as it was sent before compaction, with the count inside it
+LEGACY_SUGGESTION_PROMPT = """
+You are an ancient spellbook that helps people craft wishes to avoid the Monkey's Paw's curse.
+
+Generate {count} wish suggestions that are strategically designed to be difficult for the Monkey's Paw to twist negatively.
+
+Rules for good wishes:
+1. Be specific and detailed to avoid ambiguity
+2. Include positive conditions and safeguards
+3. Focus on personal growth, wisdom, or helping others
+4. Avoid material wealth, power, or immortality
+5. Use precise language that leaves little room for interpretation
+6. Include time limits or specific contexts when possible
+7. Emphasize the journey/process rather than just the outcome
+
+Format each suggestion as a complete wish starting with "I wish..."
+Make each wish unique and creative.
+
+Return only the {count} wishes, one per line, no numbering or extra text.
+"""
+
+
+def legacy_wish_messages(wish):
+    user_input = (f"I wish: {wish}\n\nTwist the wish as the Monkey's Paw would. Then, on the final line, "
+                  "write 'User outcome: WIN' or 'User outcome: LOSE' as described.")
+    return [{"role": "system", "content": PAW_PROMPT}, {"role": "user", "content": user_input}]
+
+
+def legacy_suggestion_messages(count):
+    return [{"role": "system", "content": LEGACY_SUGGESTION_PROMPT.format(count=count)}]
+
+
+# purpose -> shape -> (message builder, keyword arguments for the call)
+SHAPES = {
+    "wish": {
+        "before": (legacy_wish_messages, lambda wish: {}),
+        "after": (build_wish_messages, lambda wish: {"max_tokens": wish_max_tokens()}),
+    },
+    "suggestions": {
+        "before": (legacy_suggestion_messages, lambda count: {"max_tokens": 70 * count}),
+        "after": (build_suggestion_messages, lambda count: {"max_tokens": suggestion_max_tokens(count)}),
+    },
+}
+
+
+def token_counter():
+    """Return (count_fn, label): tiktoken's gpt-4o encoding if installed, else chars / 4"""
+    try:
+        import tiktoken
+    except ImportError:
+        return (lambda text: round(len(text) / 4)), "estimated"
+    encoding = tiktoken.get_encoding("o200k_base")
+    return (lambda text: len(encoding.encode(text))), "tiktoken"
+
+
+def static_prefix(message_lists):
+    """Length in characters of the prompt text every call starts with"""
+    texts = ["\n".join(m["content"] for m in messages) for messages in message_lists]
+    first = texts[0]
+    length = len(first)
+    for text in texts[1:]:
+        length = min(length, next((i for i, (a, b) in enumerate(zip(first, text)) if a != b),
+                                  min(len(first), len(text))))
+    return first[:length]
+
+
+def build_client(args):
+    if args.backend == "openai":
+        from openai import OpenAI
+        return OpenAI(api_key=os.environ["OPENAI_API_KEY"])
+    return FakeOpenAI(latency=args.llm_latency, seed=7)
+
+
+def run_shape(client, build, options, inputs, model):
+    """Call the model once per input; return per-call (prompt, completion, cached, latency_ms, truncated)"""
+    calls = []
+    for value in inputs:
+        started = time.perf_counter()
+        response = client.chat.completions.create(model=model, messages=build(value), **options(value))
+        latency_ms = (time.perf_counter() - started) * 1000
+        usage = response.usage
+        details = getattr(usage, "prompt_tokens_details", None)
+        calls.append((usage.prompt_tokens, usage.completion_tokens, getattr(details, "cached_tokens", None) or 0,
+                      latency_ms, response.choices[0].finish_reason == "length"))
+    return calls
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0
+
+
+def report_prompts(args):
+    client = build_client(args)
+    count_tokens, counted_with = token_counter()
+    wishes = [WISHES[i % len(WISHES)] for i in range(args.wishes)]
+    # The pool and the endpoint ask for different numbers of suggestions
+    inputs = {"wish": wishes, "suggestions": [(3, 5)[i % 2] for i in range(max(2, args.wishes // 4))]}
+
+    print(f"{args.backend} backend, static prefix tokens {counted_with}")
+    print(f"{'call':<12} {'prompt':<7} {'prefix tok':>10} {'prompt tok':>10} {'compl tok':>9} "
+          f"{'cached':>7} {'p50 ms':>8} {'p95 ms':>8} {'cut off':>7}")
+    for purpose, shapes in SHAPES.items():
+        for label, (build, options) in shapes.items():
+            calls = run_shape(client, build, options, inputs[purpose], args.model)
+            prefix = static_prefix([build(value) for value in inputs[purpose][:2] + inputs[purpose][-1:]])
+            latencies = [call[3] for call in calls]
+            print(f"{purpose:<12} {label:<7} {count_tokens(prefix):>10} "
+                  f"{statistics.mean(call[0] for call in calls):>10.1f} "
+                  f"{statistics.mean(call[1] for call in calls):>9.1f} "
+                  f"{statistics.mean(call[2] for call in calls):>7.1f} "
+                  f"{percentile(latencies, 0.5):>8.1f} {percentile(latencies, 0.95):>8.1f} "
+                  f"{sum(call[4] for call in calls):>7}")
+
+
+def report_history(args):
+    from sqlalchemy import create_engine, text
+
+    engine = create_engine(args.database_url)
+    with engine.connect() as connection:
+        rows = connection.execute(text(
+            "SELECT timestamp, prompt_tokens, completion_tokens, llm_latency_ms FROM wish_history "
+            "WHERE timestamp >= :since ORDER BY timestamp"
+        ), {"since": datetime.utcnow() - timedelta(days=args.days)}).all()
+    engine.dispose()
+
+    days = {}
+    for row in rows:
+        days.setdefault(row.timestamp.date(), []).append(row)
+    print(f"\nwish_history, last {args.days} days (model calls exclude cached and shared twists)")
+    print(f"{'day':<10} {'wishes':>7} {'calls':>6} {'prompt tok':>10} {'compl tok':>9} {'p50 ms':>7} {'p95 ms':>7}")
+    for day, day_rows in sorted(days.items()):
+        calls = [row for row in day_rows if row.prompt_tokens is not None]
+        latencies = [row.llm_latency_ms for row in calls if row.llm_latency_ms is not None]
+        prompt = statistics.mean(row.prompt_tokens for row in calls) if calls else 0
+        completion = statistics.mean(row.completion_tokens or 0 for row in calls) if calls else 0
+        print(f"{day.isoformat():<10} {len(day_rows):>7} {len(calls):>6} {prompt:>10.1f} {completion:>9.1f} "
+              f"{percentile(latencies, 0.5):>7} {percentile(latencies, 0.95):>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--wishes", type=int, default=24, help="wishes sent per prompt shape")
+    parser.add_argument("--backend", choices=("fake", "openai"), default="fake")
+    parser.add_argument("--model", default="gpt-4o")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="fake LLM latency in seconds")
+    parser.add_argument("--database-url", help="also summarize the usage stored in this database's wish_history")
+    parser.add_argument("--days", type=int, default=14, help="days of wish_history to summarize")
+    args = parser.parse_args()
+
+    report_prompts(args)
+    if args.database_url:
+        report_history(args)
+
+
+if __name__ == "__main__":
+    main()
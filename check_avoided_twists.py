@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Consistency check for the avoided_twists counters.
+Recomputes each player's avoided_twists from wish_history and reports any
+user whose stored counter disagrees. Pass --fix to write the recomputed
+values back.
+
+The counter holds the wins of the game in progress, or of the last finished
+game until the player's first wish of the next one (wishes_made == 0).
+With HISTORY_WRITE_BEHIND enabled the counters are still exact, but rows
+queued in a worker are not in wish_history yet, so players wishing right
+now can show up as transient mismatches.
+"""
+
+import argparse
+from sqlalchemy import func
+from app import create_app, db, User, WishHistory
+
+app = create_app()
+
+def expected_session(user):
+    """The session whose wins avoided_twists should currently hold"""
+    if user.wishes_made or user.session_number <= 1:
+        return user.session_number
+    return user.session_number - 1
+
+def check_avoided_twists(fix=False):
+    with app.app_context():
+        try:
+            # One grouped pass over the (username, session_number, outcome) index
+            wins = dict(
+                ((username, session_number), count)
+                for username, session_number, count in db.session.query(
+                    WishHistory.username, WishHistory.session_number, func.count()
+                ).filter(WishHistory.outcome == 'win').group_by(
+                    WishHistory.username, WishHistory.session_number
+                )
+            )
+            
+            mismatches = 0
+            checked = 0
+            for user in User.query.yield_per(1000):
+                checked += 1
+                expected = wins.get((user.username, expected_session(user)), 0)
+                if (user.avoided_twists or 0) != expected:
+                    mismatches += 1
+                    print(f"⚠️ {user.username}: stored {user.avoided_twists}, history says {expected}")
+                    if fix:
+                        user.avoided_twists = expected
+            
+            if fix and mismatches:
+                db.session.commit()
+                print(f"✅ Fixed {mismatches} of {checked} users.")
+            elif mismatches:
+                print(f"❌ {mismatches} of {checked} users are inconsistent. Re-run with --fix to repair.")
+            else:
+                print(f"✅ All {checked} users are consistent.")
+            return mismatches
+        
+        except Exception as e:
+            print(f"❌ Error checking avoided_twists: {e}")
+            raise
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--fix", action="store_true", help="write recomputed counters back")
+    args = parser.parse_args()
+    check_avoided_twists(fix=args.fix)
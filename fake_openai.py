@@ -0,0 +1,210 @@
+"""
+Offline stand-in for the OpenAI client.
+
+Implements just enough of ``client.chat.completions.create`` for the app:
+plain and streamed chat completions with a ``usage`` block, counting words
+as tokens and cutting completions off at ``max_tokens``. Latency, jitter
+and failure rate are configurable so timeouts, retries and the circuit
+breaker can be exercised without network access; ``latency_sampler``
+scripts any other latency distribution. With a replay file, wishes that
+were recorded get their recorded twist back, after their recorded latency.
+
+Configuration (environment variables, used by ``FakeOpenAI.from_env``):
+    FAKE_LLM_LATENCY       mean response latency in seconds (default 0)
+    FAKE_LLM_JITTER        +/- uniform jitter in seconds (default 0)
+    FAKE_LLM_FAILURE_RATE  probability of a ConnectionError per call (default 0)
+    FAKE_LLM_SEED          seed for deterministic runs
+    FAKE_LLM_REPLAY        NDJSON file of recorded twists, one {"wish", "twist", "latency_ms"}
+                           object per line (written by benchmarks/replay_traffic.py)
+"""
+
+import json
+import os
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+from twist_cache import normalize_wish
+
+
+TWIST_TEMPLATES = [
+    "Your wish is granted: {wish}. But the paw always collects, and it takes something you did not know you loved.",
+    "Granted. {wish} - yet every morning you wake a little less certain it was worth it.",
+    "The paw curls. {wish}, exactly as spoken, and not one bit as meant.",
+]
+
+SUGGESTION_VIRTUES = ["wisdom", "strength", "courage", "patience", "calm", "clarity"]
+SUGGESTION_ACTIONS = [
+    "help someone in need",
+    "learn something new",
+    "face one small challenge",
+    "make the best decisions",
+    "listen to a friend",
+]
+SUGGESTION_TIMES = ["today", "this week", "in the next 24 hours", "for one hour"]
+
+# Recorded twists kept per normalized wish
+REPLAY_VARIANTS = 3
+
+
+def load_replay(path):
+    """Read a replay file into {normalized wish: [(twist, latency seconds or None), ...]}"""
+    replay = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            latency = record.get("latency_ms")
+            variants = replay.setdefault(normalize_wish(record["wish"]), [])
+            if len(variants) < REPLAY_VARIANTS:
+                variants.append((record["twist"], latency / 1000 if latency is not None else None))
+    return replay
+
+
+class FakeCompletions:
+    """Deterministic replacement for ``client.chat.completions``"""
+
+    def __init__(self, owner):
+        self.owner = owner
+
+    def create(self, model, messages, stream=False, timeout=None, **kwargs):
+        owner = self.owner
+        with owner.lock:
+            owner.calls += 1
+            recorded = owner.recorded(messages)
+            if recorded is not None and recorded[1] is not None:
+                latency = recorded[1]
+            elif owner.latency_sampler:
+                latency = max(0.0, owner.latency_sampler(owner.rng))
+            else:
+                latency = max(0.0, owner.latency + owner.rng.uniform(-owner.jitter, owner.jitter))
+            fail = owner.rng.random() < owner.failure_rate
+            content = recorded[0] if recorded is not None else owner.respond(model, messages)
+
+        finish_reason = "stop"
+        max_tokens = kwargs.get("max_tokens")
+        if max_tokens is not None and len(content.split(" ")) > max_tokens:
+            content = " ".join(content.split(" ")[:max_tokens])
+            finish_reason = "length"
+
+        if timeout is not None and latency > timeout:
+            owner.sleep(timeout)
+            raise TimeoutError(f"fake LLM did not answer within {timeout:.2f}s")
+        if fail:
+            owner.sleep(latency)
+            raise ConnectionError("fake LLM connection failure")
+
+        usage = SimpleNamespace(
+            prompt_tokens=sum(len(m["content"].split()) for m in messages),
+            completion_tokens=len(content.split()),
+            total_tokens=0,
+        )
+        usage.total_tokens = usage.prompt_tokens + usage.completion_tokens
+
+        if stream:
+            include_usage = (kwargs.get("stream_options") or {}).get("include_usage", False)
+            return self._stream(content, latency, model, finish_reason, usage if include_usage else None)
+        owner.sleep(latency)
+        message = SimpleNamespace(role="assistant", content=content)
+        return SimpleNamespace(
+            model=model,
+            choices=[SimpleNamespace(index=0, message=message, finish_reason=finish_reason)],
+            usage=usage,
+        )
+
+    def _stream(self, content, latency, model, finish_reason="stop", usage=None):
+        # Spend half the latency before the first token, the rest spread over the body
+        words = content.split(" ")
+        self.owner.sleep(latency / 2)
+        per_word = (latency / 2) / max(len(words), 1)
+        for i, word in enumerate(words):
+            text = word if i == 0 else " " + word
+            self.owner.sleep(per_word)
+            delta = SimpleNamespace(role="assistant", content=text)
+            yield SimpleNamespace(
+                model=model,
+                choices=[SimpleNamespace(index=0, delta=delta, finish_reason=None)],
+                usage=None,
+            )
+        # The last chunk with choices has an empty delta and the finish reason
+        yield SimpleNamespace(
+            model=model,
+            choices=[SimpleNamespace(index=0, delta=SimpleNamespace(content=None), finish_reason=finish_reason)],
+            usage=None,
+        )
+        if usage is not None:
+            # Like the real API, stream_options={"include_usage": True} adds a final
+            # chunk with no choices that carries usage for the whole completion
+            yield SimpleNamespace(model=model, choices=[], usage=usage)
+
+
+class FakeOpenAI:
+    """Drop-in for ``openai.OpenAI`` that never touches the network"""
+
+    def __init__(self, api_key=None, latency=0.0, jitter=0.0, failure_rate=0.0,
+                 seed=None, responder=None, latency_sampler=None, replay=None, sleep=time.sleep, **kwargs):
+        self.api_key = api_key
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.rng = random.Random(seed)
+        self.responder = responder
+        # latency_sampler(rng) -> seconds, used instead of latency and jitter
+        self.latency_sampler = latency_sampler
+        # see load_replay()
+        self.replay = replay or {}
+        self.sleep = sleep
+        self.calls = 0
+        self.replayed = 0
+        self.lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=FakeCompletions(self))
+
+    @classmethod
+    def from_env(cls):
+        seed = os.getenv("FAKE_LLM_SEED")
+        replay_path = os.getenv("FAKE_LLM_REPLAY")
+        return cls(
+            latency=float(os.getenv("FAKE_LLM_LATENCY", "0")),
+            jitter=float(os.getenv("FAKE_LLM_JITTER", "0")),
+            failure_rate=float(os.getenv("FAKE_LLM_FAILURE_RATE", "0")),
+            seed=int(seed) if seed else None,
+            replay=load_replay(replay_path) if replay_path else None,
+        )
+
+    def recorded(self, messages):
+        """A recorded (twist, latency) for the wish in these messages, or None"""
+        if not self.replay:
+            return None
+        wish = wish_text(messages)
+        variants = self.replay.get(normalize_wish(wish)) if wish is not None else None
+        if not variants:
+            return None
+        self.replayed += 1
+        return self.rng.choice(variants)
+
+    def respond(self, model, messages):
+        """Produce the completion text for a request"""
+        if self.responder:
+            return self.responder(model, messages)
+        wish = wish_text(messages)
+        if wish is None:
+            # A spellbook call
+            match = re.search(r"Generate (\d+)", " ".join(m["content"] for m in messages))
+            count = int(match.group(1)) if match else 3
+            return "\n".join(
+                f"I wish for the {self.rng.choice(SUGGESTION_VIRTUES)} to "
+                f"{self.rng.choice(SUGGESTION_ACTIONS)} {self.rng.choice(SUGGESTION_TIMES)}"
+                for _ in range(count)
+            )
+        twist = self.rng.choice(TWIST_TEMPLATES).format(wish=wish)
+        outcome = self.rng.choice(["WIN", "LOSE"])
+        return f"{twist}\n\nUser outcome: {outcome}"
+
+
+def wish_text(messages):
+    """The wish in a twist request, or None for any other request"""
+    user_messages = [m["content"] for m in messages if m["role"] == "user"]
+    if not user_messages or not user_messages[-1].startswith("I wish:"):
+        return None
+    return user_messages[-1].split("\n")[0].replace("I wish:", "").strip()
@@ -0,0 +1,62 @@
+"""
+Gunicorn settings for the Monkey's Paw application.
+
+The app is preloaded in the master, so workers fork with every module
+already imported and boot almost instantly. The database schema check and
+the openai SDK import also happen once in the master instead of once per
+worker. Redis connections, the LLM client and background threads are
+created lazily inside each worker.
+
+With GUNICORN_WORKER_CLASS=gevent each worker serves many requests at once:
+a request waiting on the LLM yields to the others instead of pinning the
+process, so in-flight wishes are bounded by worker_connections rather
+than by the number of workers. The standard library is patched here,
+before the app is preloaded, so every module sees cooperative sockets,
+locks and sleeps, and psycopg2 is made cooperative in each worker.
+
+Configuration (environment variables):
+    GUNICORN_PRELOAD              "0" loads the app in each worker instead (default on)
+    DB_SCHEMA_CHECK               "0" skips the startup schema check (default on)
+    GUNICORN_WORKER_CLASS         "sync" (default) or "gevent"
+    GUNICORN_WORKER_CONNECTIONS   concurrent requests per gevent worker (default 1000)
+"""
+
+import os
+
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "sync")
+if worker_class == "gevent":
+    from gevent import monkey
+
+    monkey.patch_all()
+
+wsgi_app = "app:create_app()"
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") != "0"
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "1000"))
+
+
+def when_ready(server):
+    """Runs once in the master before any worker is forked"""
+    from llm_client import preload_sdk
+
+    preload_sdk()
+    if os.getenv("DB_SCHEMA_CHECK", "1") != "0":
+        from app import ensure_schema
+
+        ensure_schema(server.app.wsgi())
+
+
+def post_fork(server, worker):
+    if server.cfg.worker_class_str == "gevent":
+        try:
+            from psycogreen.gevent import patch_psycopg
+        except ImportError:
+            server.log.warning("psycogreen or psycopg2 not importable; Postgres queries would block gevent workers")
+        else:
+            patch_psycopg()
+
+
+def child_exit(server, worker):
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
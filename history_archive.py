@@ -0,0 +1,205 @@
+"""
+Export and archival of wish_history rows.
+
+History is read in chunks and written to files partitioned by day
+(``<dir>/date=YYYY-MM-DD/part-<first id>.<ext>``), as gzip-compressed NDJSON
+or, with pyarrow installed, as Parquet. A part file is written under a
+temporary name and renamed once complete, so a file that exists is whole
+and rows are only deleted after their file is in place. Part names come
+from the first row id, so re-archiving the same batch after a crash
+overwrites the file instead of duplicating it.
+
+The same NDJSON encoding backs the streamed admin export.
+
+Configuration (environment variables):
+    HISTORY_ARCHIVE_DIR      directory archive files are written to (default "archive")
+    HISTORY_ARCHIVE_FORMAT   "ndjson" (default) or "parquet"
+    HISTORY_RETENTION_DAYS   rows older than this are archived and deleted by prune (default 90)
+    HISTORY_ARCHIVE_BATCH    rows per archive/delete batch (default 1000)
+"""
+
+import gzip
+import json
+import os
+import zlib
+from datetime import date, datetime
+
+
+COLUMNS = (
+    "id",
+    "username",
+    "wish_text",
+    "twist_result",
+    "outcome",
+    "ip_address",
+    "user_agent",
+    "wish_quality_bonus",
+    "positive_indicator_count",
+    "negative_indicator_count",
+    "timestamp",
+    "session_number",
+    "prompt_tokens",
+    "completion_tokens",
+    "llm_latency_ms",
+)
+
+FORMATS = ("ndjson", "parquet")
+
+
+def history_record(row):
+    """Plain dict of one wish_history row (a Row or mapping with COLUMNS)"""
+    mapping = row._mapping if hasattr(row, "_mapping") else row
+    return {column: mapping[column] for column in COLUMNS}
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def ndjson_line(record):
+    return (json.dumps(record, default=_json_default, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def gzip_ndjson(records, flush_every=1000):
+    """Yield a gzip stream of NDJSON lines without holding more than a chunk in memory"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # 31: gzip container
+    pending = 0
+    for record in records:
+        data = compressor.compress(ndjson_line(record))
+        pending += 1
+        if pending >= flush_every:
+            data += compressor.flush(zlib.Z_SYNC_FLUSH)
+            pending = 0
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def partition_date(record):
+    timestamp = record["timestamp"]
+    return timestamp.date().isoformat() if timestamp else "unknown"
+
+
+class HistoryArchive:
+    """Writes batches of history records to day-partitioned part files"""
+
+    def __init__(self, root, fmt="ndjson"):
+        if fmt not in FORMATS:
+            raise ValueError(f"unknown archive format {fmt!r}; expected one of {', '.join(FORMATS)}")
+        if fmt == "parquet":
+            _parquet()  # Fail before any rows are read, not after the first batch
+        self.root = root
+        self.fmt = fmt
+        self.files = 0
+        self.rows = 0
+
+    def write(self, records):
+        """Write one batch; return the paths of the part files it produced"""
+        partitions = {}
+        for record in records:
+            partitions.setdefault(partition_date(record), []).append(record)
+        paths = []
+        for day, rows in sorted(partitions.items()):
+            directory = os.path.join(self.root, f"date={day}")
+            os.makedirs(directory, exist_ok=True)
+            extension = "ndjson.gz" if self.fmt == "ndjson" else "parquet"
+            path = os.path.join(directory, f"part-{rows[0]['id']:012d}.{extension}")
+            tmp_path = path + ".tmp"
+            if self.fmt == "ndjson":
+                self._write_ndjson(tmp_path, rows)
+            else:
+                self._write_parquet(tmp_path, rows)
+            os.replace(tmp_path, path)
+            paths.append(path)
+            self.files += 1
+            self.rows += len(rows)
+        return paths
+
+    def _write_ndjson(self, path, rows):
+        with open(path, "wb") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="wb") as f:
+                for record in rows:
+                    f.write(ndjson_line(record))
+            raw.flush()
+            os.fsync(raw.fileno())
+
+    def _write_parquet(self, path, rows):
+        pa, pq = _parquet()
+        table = pa.Table.from_pylist(rows, schema=_parquet_schema(pa))
+        pq.write_table(table, path, compression="zstd")
+
+
+def _parquet():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise RuntimeError("Parquet archives need pyarrow (pip install pyarrow)") from e
+    return pyarrow, pyarrow.parquet
+
+
+def _parquet_schema(pa):
+    return pa.schema([
+        ("id", pa.int64()),
+        ("username", pa.string()),
+        ("wish_text", pa.string()),
+        ("twist_result", pa.string()),
+        ("outcome", pa.string()),
+        ("ip_address", pa.string()),
+        ("user_agent", pa.string()),
+        ("wish_quality_bonus", pa.float64()),
+        ("positive_indicator_count", pa.int32()),
+        ("negative_indicator_count", pa.int32()),
+        ("timestamp", pa.timestamp("us")),
+        ("session_number", pa.int32()),
+        ("prompt_tokens", pa.int32()),
+        ("completion_tokens", pa.int32()),
+        ("llm_latency_ms", pa.int32()),
+    ])
+
+
+def read_archive(path):
+    """Yield records from an archive file, or from every part file under a directory.
+
+    Part files are read in partition and part order, which is id order
+    within a day. Timestamps come back as datetimes.
+    """
+    if os.path.isdir(path):
+        parts = []
+        for directory, _, names in os.walk(path):
+            parts.extend(os.path.join(directory, name) for name in names
+                         if name.endswith((".ndjson.gz", ".parquet")))
+        paths = sorted(parts)
+    else:
+        paths = [path]
+    for part in paths:
+        if part.endswith(".parquet"):
+            _, pq = _parquet()
+            for batch in pq.ParquetFile(part).iter_batches():
+                yield from batch.to_pylist()
+            continue
+        opener = gzip.open if part.endswith(".gz") else open
+        with opener(part, "rt", encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                if record.get("timestamp"):
+                    record["timestamp"] = datetime.fromisoformat(record["timestamp"])
+                yield record
+
+
+def retention_days():
+    return int(os.getenv("HISTORY_RETENTION_DAYS", "90"))
+
+
+def archive_batch_size():
+    return int(os.getenv("HISTORY_ARCHIVE_BATCH", "1000"))
+
+
+def build_history_archive(root=None, fmt=None):
+    """Build a HistoryArchive, falling back to environment configuration"""
+    return HistoryArchive(
+        root or os.getenv("HISTORY_ARCHIVE_DIR", "archive"),
+        fmt or os.getenv("HISTORY_ARCHIVE_FORMAT", "ndjson"),
+    )
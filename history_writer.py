@@ -0,0 +1,166 @@
+"""
+Write-behind batching for wish_history inserts.
+
+When enabled, wish() commits the game-critical User state synchronously
+and hands the wide history row to a bounded in-process queue. A
+background flusher drains the queue with one multi-row INSERT every
+HISTORY_BATCH_SIZE rows or HISTORY_FLUSH_MS milliseconds, whichever comes
+first. A full queue blocks the request for up to HISTORY_ENQUEUE_TIMEOUT_MS
+and then writes the row synchronously, so load alone never drops rows.
+A batch whose INSERT keeps failing (the database is down) is dropped
+after three attempts; the rows are counted in "dropped" and logged as an
+error. The queue is flushed on interpreter shutdown, as far as the
+shutdown timeout allows.
+
+Configuration (environment variables):
+    HISTORY_WRITE_BEHIND        "1" enables write-behind (default off)
+    HISTORY_QUEUE_SIZE          queue capacity in rows (default 5000)
+    HISTORY_BATCH_SIZE          rows per INSERT (default 200)
+    HISTORY_FLUSH_MS            longest a row waits before a flush (default 250)
+    HISTORY_ENQUEUE_TIMEOUT_MS  backpressure wait when the queue is full (default 50)
+"""
+
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class HistoryWriter:
+    """Bounded queue of history rows drained in batches by a background thread.
+
+    ``write_batch(rows)`` must insert a list of row dicts in one statement;
+    it is called from the flusher thread and, for backpressure fallbacks,
+    from the request thread.
+    """
+
+    def __init__(self, write_batch, max_queue=5000, batch_size=200, flush_interval=0.25,
+                 enqueue_timeout=0.05, max_attempts=3):
+        self.write_batch = write_batch
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self.max_attempts = max_attempts
+        self.thread = None
+        self.pid = None
+        self.lock = threading.Lock()
+        self.counters = {
+            "enqueued": 0,
+            "written": 0,
+            "batches": 0,
+            "sync_writes": 0,
+            "flush_errors": 0,
+            "dropped": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+            "total_flush_ms": 0.0,
+        }
+
+    def submit(self, row):
+        """Queue a history row, writing it synchronously if the queue stays full"""
+        self.ensure_worker()
+        try:
+            self.queue.put(row, timeout=self.enqueue_timeout)
+            self.counters["enqueued"] += 1
+        except queue.Full:
+            self.counters["sync_writes"] += 1
+            self._flush([row])
+
+    def ensure_worker(self):
+        """Start the flusher thread in this process (again, after a fork)"""
+        if self.thread is not None and self.thread.is_alive() and self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive() and self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        while True:
+            batch = []
+            stop = False
+            deadline = None
+            while len(batch) < self.batch_size:
+                timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+                try:
+                    row = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if row is _STOP:
+                    stop = True
+                    break
+                batch.append(row)
+                if deadline is None:
+                    # The first row of a batch starts the flush timer
+                    deadline = time.monotonic() + self.flush_interval
+            if batch:
+                self._flush(batch)
+            if stop:
+                return
+
+    def _flush(self, rows):
+        for attempt in range(1, self.max_attempts + 1):
+            started = time.perf_counter()
+            try:
+                self.write_batch(rows)
+            except Exception as e:
+                self.counters["flush_errors"] += 1
+                logger.warning("History flush error (attempt %d): %s", attempt, e)
+                if attempt == self.max_attempts:
+                    self.counters["dropped"] += len(rows)
+                    logger.error("Dropped %d history rows after %d failed flush attempts", len(rows), attempt)
+                    return
+                time.sleep(0.1 * attempt)
+                continue
+            elapsed = (time.perf_counter() - started) * 1000
+            self.counters["written"] += len(rows)
+            self.counters["batches"] += 1
+            self.counters["last_flush_ms"] = elapsed
+            self.counters["total_flush_ms"] += elapsed
+            self.counters["max_flush_ms"] = max(self.counters["max_flush_ms"], elapsed)
+            return
+
+    def close(self, timeout=10.0):
+        """Flush everything still queued and stop the flusher"""
+        if self.thread is None or not self.thread.is_alive() or self.pid != os.getpid():
+            return
+        try:
+            self.queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            # The flusher is stuck or too slow; don't raise at interpreter exit
+            logger.error("History queue still full at shutdown; %d rows not written", self.queue.qsize())
+            return
+        self.thread.join(timeout)
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats["queue_depth"] = self.queue.qsize()
+        stats["avg_flush_ms"] = stats["total_flush_ms"] / stats["batches"] if stats["batches"] else 0.0
+        return stats
+
+
+def write_behind_enabled():
+    return os.getenv("HISTORY_WRITE_BEHIND", "0") == "1"
+
+
+def build_history_writer(write_batch):
+    """Build a HistoryWriter from environment configuration and flush it at exit"""
+    writer = HistoryWriter(
+        write_batch,
+        max_queue=int(os.getenv("HISTORY_QUEUE_SIZE", "5000")),
+        batch_size=int(os.getenv("HISTORY_BATCH_SIZE", "200")),
+        flush_interval=int(os.getenv("HISTORY_FLUSH_MS", "250")) / 1000,
+        enqueue_timeout=int(os.getenv("HISTORY_ENQUEUE_TIMEOUT_MS", "50")) / 1000,
+    )
+    atexit.register(writer.close)
+    return writer
@@ -0,0 +1,142 @@
+"""
+Per-user idempotency keys for state-changing requests.
+
+A client sends an ``Idempotency-Key`` header with a POST and reuses it when
+it retries. The first request with a key claims it and runs; a retry that
+arrives while it is still running waits for it, and one that arrives
+afterwards gets the stored response back without running again. A request
+that fails releases its claim so the client can retry it.
+
+Keys are scoped per user and stored in Redis when available, otherwise per
+process (so retries are only deduplicated within one worker).
+
+Configuration (environment variables):
+    IDEMPOTENCY_TTL          how long a stored response is replayed, seconds (default 3600)
+    IDEMPOTENCY_PENDING_TTL  how long an unfinished claim is held, seconds (default 120)
+    IDEMPOTENCY_WAIT         how long a duplicate waits for the original, seconds (default 30)
+"""
+
+import json
+import os
+import re
+import threading
+import time
+
+
+KEY_PREFIX = "monkeypaw:idempotency:"
+PENDING = "__pending__"
+KEY_RE = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+
+RUN = "run"
+REPLAY = "replay"
+BUSY = "busy"
+
+
+def valid_key(key):
+    return bool(key) and KEY_RE.match(key) is not None
+
+
+class MemoryIdempotencyStore:
+    """Per-process idempotency records with expiry"""
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.records = {}
+        self.lock = threading.Lock()
+
+    def claim(self, name, ttl):
+        """Claim a key; return (claimed, stored payload or None)"""
+        now = self.clock()
+        with self.lock:
+            if len(self.records) > 10000:
+                self.records = {k: v for k, v in self.records.items() if v[1] > now}
+            record = self.records.get(name)
+            if record is None or record[1] <= now:
+                self.records[name] = (PENDING, now + ttl)
+                return True, None
+            value = record[0]
+        return False, None if value == PENDING else value
+
+    def complete(self, name, payload, ttl):
+        with self.lock:
+            self.records[name] = (payload, self.clock() + ttl)
+
+    def release(self, name):
+        with self.lock:
+            self.records.pop(name, None)
+
+
+class RedisIdempotencyStore:
+    """Idempotency records shared by all workers"""
+
+    def __init__(self, redis_client):
+        self.redis = redis_client
+
+    def claim(self, name, ttl):
+        key = KEY_PREFIX + name
+        if self.redis.set(key, PENDING, nx=True, ex=int(ttl)):
+            return True, None
+        value = self.redis.get(key)
+        if value is None:
+            # Expired between the two calls; try once more
+            return bool(self.redis.set(key, PENDING, nx=True, ex=int(ttl))), None
+        value = value.decode("utf-8") if isinstance(value, bytes) else value
+        return False, None if value == PENDING else json.loads(value)
+
+    def complete(self, name, payload, ttl):
+        self.redis.set(KEY_PREFIX + name, json.dumps(payload), ex=int(ttl))
+
+    def release(self, name):
+        self.redis.delete(KEY_PREFIX + name)
+
+
+class IdempotencyKeys:
+    """Claim, replay and release idempotency keys on top of a store"""
+
+    def __init__(self, store, ttl=3600, pending_ttl=120, wait_timeout=30.0, poll_interval=0.1,
+                 sleep=time.sleep):
+        self.store = store
+        self.ttl = ttl
+        self.pending_ttl = pending_ttl
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self.sleep = sleep
+        self.counters = {"claims": 0, "replays": 0, "busy": 0}
+
+    def begin(self, scope, key):
+        """Return (RUN, None), (REPLAY, payload) or (BUSY, None) for a request"""
+        name = f"{scope}:{key}"
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            claimed, payload = self.store.claim(name, self.pending_ttl)
+            if claimed:
+                self.counters["claims"] += 1
+                return RUN, None
+            if payload is not None:
+                self.counters["replays"] += 1
+                return REPLAY, payload
+            if time.monotonic() >= deadline:
+                self.counters["busy"] += 1
+                return BUSY, None
+            # The original request is still running; wait for its response
+            self.sleep(self.poll_interval)
+
+    def complete(self, scope, key, payload):
+        self.store.complete(f"{scope}:{key}", payload, self.ttl)
+
+    def release(self, scope, key):
+        self.store.release(f"{scope}:{key}")
+
+    def stats(self):
+        return dict(self.counters)
+
+
+def build_idempotency_keys(redis_client=None):
+    """Use Redis when a client is given, otherwise a per-process store"""
+    store = RedisIdempotencyStore(redis_client) if redis_client is not None else MemoryIdempotencyStore()
+    return IdempotencyKeys(
+        store,
+        ttl=int(os.getenv("IDEMPOTENCY_TTL", "3600")),
+        pending_ttl=int(os.getenv("IDEMPOTENCY_PENDING_TTL", "120")),
+        wait_timeout=float(os.getenv("IDEMPOTENCY_WAIT", "30")),
+    )
@@ -5,13 +5,15 @@ Run this script once after deploying to create the database tables.
 """
 
 import os
-from app import app, db
+from app import create_app, create_tables, db
+
+app = create_app()
 
 def init_database():
     with app.app_context():
         try:
-            # Create all tables
-            db.create_all()
+            # Create all tables; a new database is recorded as fully migrated
+            create_tables()
             print("✅ Database tables created successfully!")
             
             # Verify tables exist
@@ -0,0 +1,206 @@
+"""
+Pushed leaderboard updates.
+
+Browsers subscribe once to /leaderboard/stream (Server-Sent Events)
+instead of fetching /leaderboard. Each worker keeps the top-N board it
+last sent and, when told the leaderboard changed, reloads it once and
+sends its subscribers only the rows that differ. A board that did not
+actually change sends nothing.
+
+A game over only announces a change when the player is in the top N
+afterwards. With Redis the announcement goes over pub/sub, so every
+worker refreshes its board and fans the diff out to its own connections.
+Without Redis only the announcing worker's subscribers hear about it,
+matching the per-process leaderboard store.
+
+Every message carries the digest of the board it applies to. A client
+whose board does not match reconnects and gets the whole board again. So
+does a subscriber too slow to keep up with its queue.
+
+Configuration (environment variables):
+    LEADERBOARD_PUSH            "1" enables /leaderboard/stream (default on with gevent
+                                workers, off otherwise: a sync worker thread would be
+                                held by each open stream)
+    LEADERBOARD_STREAM_SECONDS  how long one stream stays open before the client
+                                reconnects (default 300)
+    LEADERBOARD_KEEPALIVE       seconds between keepalive comments (default 25)
+"""
+
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+
+from observability import logger
+
+
+CHANNEL = "monkeypaw:leaderboard:changed"
+LEADERBOARD_SIZE = 10
+
+RESYNC = object()
+
+
+def push_enabled():
+    default = "1" if os.getenv("GUNICORN_WORKER_CLASS") == "gevent" else "0"
+    return os.getenv("LEADERBOARD_PUSH", default) != "0"
+
+
+def stream_seconds():
+    return float(os.getenv("LEADERBOARD_STREAM_SECONDS", "300"))
+
+
+def keepalive_seconds():
+    return float(os.getenv("LEADERBOARD_KEEPALIVE", "25"))
+
+
+def board_digest(rows):
+    return hashlib.sha1(json.dumps(rows, separators=(",", ":")).encode("utf-8")).hexdigest()[:12]
+
+
+def board_diff(old, new):
+    """[index, row] for every position whose row changed; rows past len(new) are dropped by the client"""
+    changes = []
+    for index, row in enumerate(new):
+        if index >= len(old) or old[index] != row:
+            changes.append([index, row])
+    return changes
+
+
+class MemoryLeaderboardFeed:
+    """Fans leaderboard diffs out to this worker's stream subscribers"""
+
+    def __init__(self, load_board, queue_size=16):
+        # load_board() returns the current top rows, or None if the store is not ready
+        self.load_board = load_board
+        self.queue_size = queue_size
+        self.board = None
+        self.digest = None
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.counters = {"refreshes": 0, "broadcasts": 0, "messages": 0, "resyncs": 0}
+
+    def announce(self):
+        """The leaderboard changed; tell every worker's subscribers"""
+        self.refresh()
+
+    def refresh(self):
+        """Reload the board and send subscribers the rows that changed"""
+        rows = self.load_board()
+        if rows is None:
+            return
+        rows = [list(row) for row in rows]
+        with self.lock:
+            self.counters["refreshes"] += 1
+            if rows == self.board:
+                return
+            message = {
+                "base": self.digest,
+                "version": board_digest(rows),
+                "changes": board_diff(self.board or [], rows),
+                "size": len(rows),
+            }
+            self.board, self.digest = rows, message["version"]
+            if message["base"] is None:
+                return
+            self.counters["broadcasts"] += 1
+            for subscriber in list(self.subscribers):
+                self._deliver(subscriber, message)
+
+    def _deliver(self, subscriber, message):
+        try:
+            subscriber.put_nowait(message)
+            self.counters["messages"] += 1
+        except queue.Full:
+            # A subscriber this far behind gets the whole board once it catches up
+            self.counters["resyncs"] += 1
+            while True:
+                try:
+                    subscriber.get_nowait()
+                except queue.Empty:
+                    break
+            subscriber.put_nowait(RESYNC)
+
+    def snapshot(self):
+        """(rows, digest) of the board new subscribers start from"""
+        with self.lock:
+            if self.board is not None:
+                return self.board, self.digest
+        self.refresh()
+        with self.lock:
+            return self.board or [], self.digest or board_digest([])
+
+    def subscribe(self):
+        subscriber = queue.Queue(maxsize=self.queue_size)
+        with self.lock:
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats["subscribers"] = len(self.subscribers)
+        return stats
+
+
+class RedisLeaderboardFeed(MemoryLeaderboardFeed):
+    """Leaderboard feed whose change announcements reach every worker through Redis pub/sub"""
+
+    def __init__(self, load_board, redis_client, queue_size=16, reconnect_delay=1.0):
+        super().__init__(load_board, queue_size)
+        self.redis = redis_client
+        self.reconnect_delay = reconnect_delay
+        self._listener = None
+        self._pid = None
+        self.counters["listener_errors"] = 0
+
+    def announce(self):
+        try:
+            self.redis.publish(CHANNEL, "1")
+        except Exception as e:
+            logger.warning("Leaderboard announce error: %s", e)
+            self.refresh()
+
+    def subscribe(self):
+        self._ensure_listener()
+        return super().subscribe()
+
+    def _ensure_listener(self):
+        # One listener per worker process, started when the first client subscribes
+        if self._pid == os.getpid() and self._listener.is_alive():
+            return
+        with self.lock:
+            if self._pid == os.getpid() and self._listener.is_alive():
+                return
+            self._pid = os.getpid()
+            self._listener = threading.Thread(target=self._listen, name="leaderboard-feed", daemon=True)
+            self._listener.start()
+
+    def _listen(self):
+        while True:
+            pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(CHANNEL)
+                # Announcements missed while disconnected are covered by refreshing on (re)connect
+                self.refresh()
+                for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self.refresh()
+            except Exception as e:
+                self.counters["listener_errors"] += 1
+                logger.warning("Leaderboard feed listener error: %s", e)
+                time.sleep(self.reconnect_delay)
+            finally:
+                pubsub.close()
+
+
+def build_leaderboard_feed(load_board, redis_client=None):
+    """Use Redis pub/sub when a client is given, otherwise notify this process only"""
+    if redis_client is not None:
+        return RedisLeaderboardFeed(load_board, redis_client)
+    return MemoryLeaderboardFeed(load_board)
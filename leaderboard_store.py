@@ -0,0 +1,198 @@
+"""
+Incrementally maintained leaderboard.
+
+High scores live in a Redis sorted set that wish() updates on game over,
+so /leaderboard never has to sort the users table. Each player's
+avoided_twists and streak are kept alongside and refreshed after every
+wish, and a version counter backs the /leaderboard ETag. Only score
+changes bump the version: a refreshed streak is served to the next
+client that fetches the board, without invalidating every cached copy
+and push subscriber once per wish.
+
+Without Redis each process keeps its own sorted copy, updated as its own
+requests change it and rebuilt from the database whenever it is older
+than LEADERBOARD_MEMORY_TTL seconds (default 300), which picks up the
+changes made through other workers.
+"""
+
+import bisect
+import json
+import os
+import secrets
+import threading
+import time
+
+
+ZSET_KEY = "monkeypaw:leaderboard"
+ROWS_KEY = "monkeypaw:leaderboard:rows"
+VERSION_KEY = "monkeypaw:leaderboard:version"
+REBUILD_BATCH = 1000
+
+
+class MemoryLeaderboardStore:
+    """Per-process leaderboard kept as a sorted list of (-high_score, username)"""
+
+    def __init__(self, max_age=300.0, clock=time.monotonic):
+        self.max_age = max_age
+        self.clock = clock
+        self.order = []
+        self.scores = {}
+        self.rows = {}
+        self.version = 0
+        # Versions are per process, so tag them to keep ETags from colliding across workers
+        self.instance = secrets.token_hex(4)
+        self.built_at = None
+        self.lock = threading.Lock()
+
+    def needs_rebuild(self):
+        return self.built_at is None or self.clock() - self.built_at > self.max_age
+
+    def update(self, username, high_score, avoided_twists, streak):
+        with self.lock:
+            self._set(username, high_score)
+            self.rows[username] = (avoided_twists, streak)
+            self.version += 1
+
+    def refresh(self, username, avoided_twists, streak):
+        """Update a player's avoided_twists and streak without changing the version"""
+        with self.lock:
+            if username in self.scores:
+                self.rows[username] = (avoided_twists, streak)
+
+    def add_player(self, username):
+        with self.lock:
+            if username not in self.scores:
+                self._set(username, 0)
+                self.rows[username] = (0, 0)
+                self.version += 1
+
+    def _set(self, username, high_score):
+        old = self.scores.get(username)
+        if old is not None:
+            index = bisect.bisect_left(self.order, (-old, username))
+            del self.order[index]
+        bisect.insort(self.order, (-high_score, username))
+        self.scores[username] = high_score
+
+    def top(self, count):
+        with self.lock:
+            return [
+                (username, -neg_score) + self.rows.get(username, (0, 0))
+                for neg_score, username in self.order[:count]
+            ]
+
+    def rank(self, username):
+        """Zero-based rank and high score, or None if the player is unknown"""
+        with self.lock:
+            score = self.scores.get(username)
+            if score is None:
+                return None
+            return bisect.bisect_left(self.order, (-score, username)), score
+
+    def get_version(self):
+        return f"m{self.instance}-{self.version}"
+
+    def rebuild(self, rows):
+        order, scores, details = [], {}, {}
+        for username, high_score, avoided_twists, streak in rows:
+            high_score = high_score or 0
+            order.append((-high_score, username))
+            scores[username] = high_score
+            details[username] = (avoided_twists or 0, streak or 0)
+        order.sort()
+        with self.lock:
+            self.order, self.scores, self.rows = order, scores, details
+            self.version += 1
+            self.built_at = self.clock()
+
+
+class RedisLeaderboardStore:
+    """Leaderboard shared by all workers through a Redis sorted set"""
+
+    def __init__(self, redis_client):
+        self.redis = redis_client
+
+    def needs_rebuild(self):
+        return not self.redis.exists(ZSET_KEY)
+
+    def update(self, username, high_score, avoided_twists, streak):
+        pipe = self.redis.pipeline()
+        pipe.zadd(ZSET_KEY, {username: high_score})
+        pipe.hset(ROWS_KEY, username, json.dumps([avoided_twists, streak]))
+        pipe.incr(VERSION_KEY)
+        pipe.execute()
+
+    def refresh(self, username, avoided_twists, streak):
+        """Update a player's avoided_twists and streak without changing the version"""
+        self.redis.hset(ROWS_KEY, username, json.dumps([avoided_twists, streak]))
+
+    def add_player(self, username):
+        # NX keeps an existing score if the player is re-registering
+        if self.redis.zadd(ZSET_KEY, {username: 0}, nx=True):
+            self.redis.incr(VERSION_KEY)
+
+    def top(self, count):
+        members = self.redis.zrevrange(ZSET_KEY, 0, count - 1, withscores=True)
+        if not members:
+            return []
+        names = [self._decode(name) for name, _ in members]
+        details = self.redis.hmget(ROWS_KEY, names)
+        board = []
+        for (_, score), username, detail in zip(members, names, details):
+            avoided_twists, streak = json.loads(detail) if detail else (0, 0)
+            board.append((username, int(score), avoided_twists, streak))
+        return board
+
+    def rank(self, username):
+        """Zero-based rank and high score, or None if the player is unknown"""
+        pipe = self.redis.pipeline()
+        pipe.zrevrank(ZSET_KEY, username)
+        pipe.zscore(ZSET_KEY, username)
+        rank, score = pipe.execute()
+        if rank is None:
+            return None
+        return rank, int(score)
+
+    def get_version(self):
+        return f"r{self._decode(self.redis.get(VERSION_KEY) or b'0')}"
+
+    def rebuild(self, rows):
+        # Build under a temporary key and swap it in so readers never see a partial board
+        tmp_zset = ZSET_KEY + ":rebuild"
+        tmp_rows = ROWS_KEY + ":rebuild"
+        self.redis.delete(tmp_zset, tmp_rows)
+        batch_scores, batch_rows = {}, {}
+        for username, high_score, avoided_twists, streak in rows:
+            batch_scores[username] = high_score or 0
+            batch_rows[username] = json.dumps([avoided_twists or 0, streak or 0])
+            if len(batch_scores) >= REBUILD_BATCH:
+                self._write_batch(tmp_zset, tmp_rows, batch_scores, batch_rows)
+                batch_scores, batch_rows = {}, {}
+        self._write_batch(tmp_zset, tmp_rows, batch_scores, batch_rows)
+        pipe = self.redis.pipeline()
+        if self.redis.exists(tmp_zset):
+            pipe.rename(tmp_zset, ZSET_KEY)
+            pipe.rename(tmp_rows, ROWS_KEY)
+        else:
+            pipe.delete(ZSET_KEY, ROWS_KEY)
+        pipe.incr(VERSION_KEY)
+        pipe.execute()
+
+    def _write_batch(self, zset_key, rows_key, scores, rows):
+        if not scores:
+            return
+        pipe = self.redis.pipeline()
+        pipe.zadd(zset_key, scores)
+        pipe.hset(rows_key, mapping=rows)
+        pipe.execute()
+
+    @staticmethod
+    def _decode(value):
+        return value.decode() if isinstance(value, bytes) else str(value)
+
+
+def build_leaderboard_store(redis_client=None):
+    """Use Redis when a client is given, otherwise a per-process store"""
+    if redis_client is not None:
+        return RedisLeaderboardStore(redis_client)
+    return MemoryLeaderboardStore(max_age=float(os.getenv("LEADERBOARD_MEMORY_TTL", "300")))
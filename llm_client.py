@@ -0,0 +1,275 @@
+"""
+Shared OpenAI client for the Monkey's Paw application.
+
+One client is built per process and reused for every call, so the HTTP
+connection pool and TLS sessions survive between requests. Calls get a
+per-call deadline, bounded retries with jittered backoff, and a circuit
+breaker that fails fast while the upstream is unhealthy. Each model has its
+own breaker, so one model failing doesn't stop calls to the others (the
+model router's fallback routes, for instance).
+
+Configuration (environment variables):
+    LLM_BACKEND              "openai" (default) or "fake" for the offline stand-in
+    OPENAI_TIMEOUT           per-call deadline in seconds (default 20)
+    OPENAI_MAX_RETRIES       retries after the first attempt (default 2)
+    OPENAI_BACKOFF_BASE      first backoff delay in seconds (default 0.5)
+    OPENAI_BACKOFF_MAX       largest backoff delay in seconds (default 4)
+    OPENAI_BREAKER_THRESHOLD consecutive failures of a model that open its breaker (default 5)
+    OPENAI_BREAKER_RESET     seconds a breaker stays open before a trial call (default 30)
+"""
+
+import os
+import random
+import threading
+import time
+
+
+_retryable_errors = None
+
+
+def retryable_errors():
+    """Upstream failures worth retrying; they also count against the breaker.
+
+    The openai SDK is the slowest import in the app, so it is only imported
+    when a real client is built or an error has to be classified. The
+    builtin types are what the offline fake raises.
+    """
+    global _retryable_errors
+    if _retryable_errors is None:
+        import openai
+        _retryable_errors = (
+            openai.APITimeoutError,
+            openai.APIConnectionError,
+            openai.RateLimitError,
+            openai.InternalServerError,
+            TimeoutError,
+            ConnectionError,
+        )
+    return _retryable_errors
+
+
+def preload_sdk():
+    """Import the openai SDK now, e.g. in the gunicorn master before workers fork"""
+    if os.getenv("LLM_BACKEND", "openai") != "fake":
+        retryable_errors()
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the upstream while the breaker is open"""
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with a single half-open trial call"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.times_opened = 0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return self.CLOSED
+        if self.clock() - self.opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow(self):
+        """Return True if a call may go upstream right now"""
+        with self._lock:
+            state = self.state
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_in_flight or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    self.times_opened += 1
+                self.opened_at = self.clock()
+            self._trial_in_flight = False
+
+    def release_trial(self):
+        """End a half-open trial that proved nothing about the upstream, so the next call can try"""
+        with self._lock:
+            self._trial_in_flight = False
+
+
+class LLMClient:
+    """Process-wide wrapper around a single pooled OpenAI client"""
+
+    def __init__(self, api_key=None, timeout=20.0, max_retries=2, backoff_base=0.5,
+                 backoff_max=4.0, breaker_factory=None, client_factory=None, sleep=time.sleep):
+        self.api_key = api_key
+        self.offline = client_factory is not None
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker_factory = breaker_factory or CircuitBreaker
+        self.breakers = {}  # model -> CircuitBreaker
+        self.client_factory = client_factory or self._default_factory
+        self.sleep = sleep
+        self._client = None
+        self._lock = threading.Lock()
+        self.counters = {
+            "clients_created": 0,
+            "calls": 0,
+            "pooled_calls": 0,
+            "attempts": 0,
+            "retries": 0,
+            "failures": 0,
+            "breaker_rejections": 0,
+        }
+
+    def _default_factory(self):
+        from openai import OpenAI
+
+        # Retries are handled here, so the SDK's own retry loop is disabled
+        return OpenAI(api_key=self.api_key, timeout=self.timeout, max_retries=0)
+
+    @property
+    def configured(self):
+        """True if calls can be made (an API key is set or an offline client is used)"""
+        return self.offline or bool(self.api_key)
+
+    @property
+    def client(self):
+        """The underlying OpenAI client, built on first use"""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self.client_factory()
+                    self.counters["clients_created"] += 1
+                    return self._client
+        self.counters["pooled_calls"] += 1
+        return self._client
+
+    def breaker_for(self, model):
+        """The circuit breaker for one model, built on first use"""
+        breaker = self.breakers.get(model)
+        if breaker is None:
+            with self._lock:
+                breaker = self.breakers.setdefault(model, self.breaker_factory())
+        return breaker
+
+    def chat(self, messages, model="gpt-4o", timeout=None, **kwargs):
+        """Run a chat completion with deadline, retries and the circuit breaker.
+
+        Extra keyword arguments (max_tokens, temperature, stream, ...) are passed
+        straight to ``chat.completions.create``. With ``stream=True`` only opening
+        the stream is retried; a stream that fails midway is not replayed.
+        """
+        self.counters["calls"] += 1
+        breaker = self.breaker_for(model)
+        if not breaker.allow():
+            self.counters["breaker_rejections"] += 1
+            raise CircuitOpenError(f"LLM circuit breaker for {model} is open")
+
+        deadline = time.monotonic() + (timeout or self.timeout)
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            self.counters["attempts"] += 1
+            try:
+                response = self.client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    timeout=max(remaining, 0.1),
+                    **kwargs
+                )
+            except retryable_errors():
+                delay = self._backoff(attempt)
+                if attempt >= self.max_retries or time.monotonic() + delay >= deadline:
+                    self.counters["failures"] += 1
+                    breaker.record_failure()
+                    raise
+                attempt += 1
+                self.counters["retries"] += 1
+                self.sleep(delay)
+                continue
+            except Exception:
+                # A rejected request (bad request, auth) says nothing about upstream health,
+                # but a half-open trial that ends this way must not keep the breaker shut
+                self.counters["failures"] += 1
+                breaker.release_trial()
+                raise
+            breaker.record_success()
+            return response
+
+    def _backoff(self, attempt):
+        # Exponential backoff with full jitter
+        cap = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return random.uniform(0, cap)
+
+    def stats(self):
+        """Counters for pool reuse and retries, and each model's breaker state (flat keys)"""
+        stats = dict(self.counters)
+        stats["breaker_times_opened"] = 0
+        for model, breaker in list(self.breakers.items()):
+            prefix = f"breaker_{model}".replace("-", "_").replace(".", "_")
+            stats[f"{prefix}_state"] = breaker.state
+            stats[f"{prefix}_failures"] = breaker.failures
+            stats[f"{prefix}_times_opened"] = breaker.times_opened
+            stats["breaker_times_opened"] += breaker.times_opened
+        return stats
+
+
+_llm_client = None
+_llm_client_lock = threading.Lock()
+
+
+def build_llm_client():
+    """Build an LLMClient from environment configuration"""
+    threshold = int(os.getenv("OPENAI_BREAKER_THRESHOLD", "5"))
+    reset_timeout = float(os.getenv("OPENAI_BREAKER_RESET", "30"))
+    client_factory = None
+    if os.getenv("LLM_BACKEND", "openai") == "fake":
+        from fake_openai import FakeOpenAI
+        client_factory = FakeOpenAI.from_env
+    return LLMClient(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        timeout=float(os.getenv("OPENAI_TIMEOUT", "20")),
+        max_retries=int(os.getenv("OPENAI_MAX_RETRIES", "2")),
+        backoff_base=float(os.getenv("OPENAI_BACKOFF_BASE", "0.5")),
+        backoff_max=float(os.getenv("OPENAI_BACKOFF_MAX", "4")),
+        breaker_factory=lambda: CircuitBreaker(failure_threshold=threshold, reset_timeout=reset_timeout),
+        client_factory=client_factory,
+    )
+
+
+def get_llm_client():
+    """Return the process-wide LLMClient, building it on first use"""
+    global _llm_client
+    if _llm_client is None:
+        with _llm_client_lock:
+            if _llm_client is None:
+                _llm_client = build_llm_client()
+    return _llm_client
+
+
+def set_llm_client(client):
+    """Replace the process-wide LLMClient (used by benchmarks and offline runs)"""
+    global _llm_client
+    with _llm_client_lock:
+        _llm_client = client
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Apply pending database migrations from migrations/.
+
+Render runs this as the pre-deploy command (render.yaml); elsewhere run it
+before starting new code. It does nothing when the database is up to
+date. Tables that don't exist yet are created first, so on a new database
+it replaces init_db.py, and a new database is recorded as having every
+migration already. See schema_migrations.py for how each kind of step
+avoids blocking the game while it runs.
+
+Usage:
+    python migrate.py                     # apply everything pending
+    python migrate.py --status            # list applied and pending migrations
+    python migrate.py --dry-run           # show pending steps and their lock impact
+    python migrate.py --target 20261018_add_wish_token_usage
+"""
+
+import argparse
+
+from app import create_app, create_tables, db
+from schema_migrations import build_migration_runner
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--dry-run", action="store_true", help="describe pending steps without running them")
+    parser.add_argument("--status", action="store_true", help="list applied and pending migrations")
+    parser.add_argument("--target", help="stop after this version")
+    args = parser.parse_args(argv)
+
+    app = create_app()
+    with app.app_context():
+        runner = build_migration_runner(db.engine)
+        try:
+            if args.status:
+                applied = runner.applied()
+                for migration in runner.migrations:
+                    when = applied.get(migration.version)
+                    state = f"applied {when:%Y-%m-%d %H:%M}" if when else "pending"
+                    print(f"{'✅' if when else '⏳'} {migration.version}  {state}")
+                return
+            if args.dry_run:
+                plan = runner.plan(args.target)
+                print("\n".join(plan) if plan else "✅ No pending migrations")
+                return
+            create_tables()
+            applied = runner.run(args.target)
+            print(f"✅ Applied {len(applied)} migration(s)" if applied else "✅ No pending migrations")
+        except Exception as e:
+            print(f"❌ Error during database migration: {e}")
+            raise
+        finally:
+            db.engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
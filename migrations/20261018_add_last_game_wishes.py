@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+"""
+Add the last_game_wishes column to users.
+
+Wishes are applied to a player's row with one UPDATE ... RETURNING that
+also resets the counters at game over, so the finished game's wish count
+is kept in this column for the game-over response.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from schema_migrations import AddColumn
+
+STEPS = [
+    AddColumn("users", "last_game_wishes", "INTEGER", default=0),
+]
+
+if __name__ == "__main__":
+    # Applies this migration and any earlier pending ones
+    from migrate import main
+    main(["--target", os.path.splitext(os.path.basename(__file__))[0]])
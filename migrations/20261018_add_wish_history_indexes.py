@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+"""
+Add indexes to wish_history.
+
+Adds a composite index on (username, session_number, outcome) for the
+per-session queries and an index on timestamp for date-range scans. On
+Postgres they are built with CREATE INDEX CONCURRENTLY so the table stays
+writable while they build.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from schema_migrations import CreateIndex
+
+STEPS = [
+    CreateIndex("ix_wish_history_user_session_outcome", "wish_history", ["username", "session_number", "outcome"]),
+    CreateIndex("ix_wish_history_timestamp", "wish_history", ["timestamp"]),
+]
+
+if __name__ == "__main__":
+    # Applies this migration and any earlier pending ones
+    from migrate import main
+    main(["--target", os.path.splitext(os.path.basename(__file__))[0]])
@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+"""
+Add the token usage columns to wish_history.
+
+Each wish stores the prompt/completion tokens and latency of the model
+call its twist came from. Rows written before this migration, and wishes
+answered from the twist cache, leave them NULL.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from schema_migrations import AddColumn
+
+STEPS = [
+    AddColumn("wish_history", "prompt_tokens", "INTEGER"),
+    AddColumn("wish_history", "completion_tokens", "INTEGER"),
+    AddColumn("wish_history", "llm_latency_ms", "INTEGER"),
+]
+
+if __name__ == "__main__":
+    # Applies this migration and any earlier pending ones
+    from migrate import main
+    main(["--target", os.path.splitext(os.path.basename(__file__))[0]])
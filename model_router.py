@@ -0,0 +1,365 @@
+"""
+Latency-aware model routing with hedged requests.
+
+Each purpose (twists, spellbook suggestions) has a list of routes: models,
+best first, each called through an LLMClient. The router keeps a rolling
+window of every route's latencies and a decaying error rate, and sends a
+call to the route with the lowest expected latency (median latency
+inflated by the error rate). Routes that are nearly as fast as the best
+keep their place in the list, so a faster model only takes over when it is
+clearly faster. A small share of calls goes to another route so every
+estimate stays current. A route whose model has an open circuit breaker
+goes to the back of the list until the breaker lets a trial call through.
+
+Once a route has enough samples, a call that has not answered by the
+route's ROUTER_HEDGE_QUANTILE latency gets a hedged backup request to the
+next best route (or the same one when it is the only route). The first
+response that passes the caller's check wins; for twists that is one with
+a "User outcome:" line. The other request finishes in the background and
+its latency still counts, and a response that is not returned (the
+loser's, or an unusable one) is passed to the router's ``on_discarded``
+callback so the tokens it used are still accounted for. Hedges are limited to ROUTER_HEDGE_BUDGET of
+calls, so an upstream that is slow for everyone is not sent twice the load.
+
+Streamed twists are not hedged: they go to the best route and only report
+failures back.
+
+Configuration (environment variables):
+    WISH_MODELS            models for twists, best first (default gpt-4o)
+    SUGGESTION_MODELS      models for spellbook suggestions (default gpt-4o-mini,gpt-4o)
+    ROUTER_HEDGE           "0" disables hedged requests (default enabled)
+    ROUTER_HEDGE_QUANTILE  latency quantile after which a call is hedged (default 0.9)
+    ROUTER_HEDGE_BUDGET    largest share of calls that may be hedged (default 0.15)
+    ROUTER_MIN_SAMPLES     latencies needed before a route's estimate is used (default 20)
+    ROUTER_WINDOW          latencies kept per route (default 200)
+    ROUTER_TOLERANCE       how much slower than the best an earlier route may be (default 0.1)
+    ROUTER_EXPLORE         share of calls sent to another route (default 0.05)
+"""
+
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODELS = {
+    "wish": "gpt-4o",
+    "suggestions": "gpt-4o-mini,gpt-4o",
+}
+
+# Hedges that can be saved up while calls are fast
+HEDGE_BURST = 10
+
+ERROR_DECAY = 0.1
+
+
+class Route:
+    """One model and the client it is called through, with its recent latencies"""
+
+    def __init__(self, model, client=None, window=200):
+        self.model = model
+        # None: the process-wide client, looked up on every call
+        self.client = client
+        self.latencies = deque(maxlen=window)
+        self.error_rate = 0.0
+        self.counters = {"calls": 0, "failures": 0, "invalid": 0, "hedges": 0, "wins": 0}
+
+    def get_client(self):
+        if self.client is not None:
+            return self.client
+        from llm_client import get_llm_client
+        return get_llm_client()
+
+    def breaker_open(self):
+        """True while this route's model is failing fast; its half-open trial still counts as available"""
+        from llm_client import CircuitBreaker
+        breaker_for = getattr(self.get_client(), "breaker_for", None)
+        return breaker_for is not None and breaker_for(self.model).state == CircuitBreaker.OPEN
+
+    def quantile(self, fraction):
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats["error_rate"] = round(self.error_rate, 4)
+        if self.latencies:
+            stats["p50_ms"] = round(self.quantile(0.5) * 1000)
+            stats["p90_ms"] = round(self.quantile(0.9) * 1000)
+        return stats
+
+
+class ModelRouter:
+    """Sends calls to the fastest healthy route and hedges the slow ones"""
+
+    def __init__(self, routes, hedge=True, hedge_quantile=0.9, hedge_budget=0.15, min_samples=20,
+                 tolerance=0.1, explore=0.05, clock=time.monotonic, rng=None, on_discarded=None):
+        if not routes:
+            raise ValueError("a router needs at least one route")
+        self.routes = list(routes)
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_budget = hedge_budget
+        self.min_samples = min_samples
+        self.tolerance = tolerance
+        self.explore = explore
+        self.clock = clock
+        self.rng = rng or random.Random()
+        # on_discarded(response, model, latency): a response that was paid for but not returned
+        self.on_discarded = on_discarded
+        self.hedge_tokens = 1.0
+        self.lock = threading.Lock()
+        self.counters = {"calls": 0, "hedged": 0, "hedge_wins": 0, "explored": 0, "invalid": 0, "discarded": 0}
+
+    # Estimates
+
+    def expected_latency(self, route):
+        """Median latency inflated by the error rate, or None without enough samples"""
+        if len(route.latencies) < self.min_samples:
+            return None
+        return route.quantile(0.5) / max(1.0 - route.error_rate, 0.05)
+
+    def ranked(self):
+        """Routes in the order calls should try them; routes with an open breaker go last"""
+        open_routes = [route for route in self.routes if route.breaker_open()]
+        if open_routes and len(open_routes) < len(self.routes):
+            closed = [route for route in self.routes if route not in open_routes]
+            return self._ranked(closed) + open_routes
+        return self._ranked(self.routes)
+
+    def _ranked(self, routes):
+        with self.lock:
+            estimates = [(route, self.expected_latency(route)) for route in routes]
+        known = [estimate for _, estimate in estimates if estimate is not None]
+        if not known:
+            return list(routes)
+        limit = min(known) * (1 + self.tolerance)
+        # Routes close to the best keep their configured order; unmeasured ones come last
+        close = [route for route, estimate in estimates if estimate is not None and estimate <= limit]
+        slower = sorted((pair for pair in estimates if pair[1] is not None and pair[1] > limit),
+                        key=lambda pair: pair[1])
+        unknown = [route for route, estimate in estimates if estimate is None]
+        return close + [route for route, _ in slower] + unknown
+
+    def pick(self):
+        """The route for the next call: the best one, or now and then another to keep estimates fresh"""
+        ranked = self.ranked()
+        if len(ranked) > 1 and self.rng.random() < self.explore:
+            with self.lock:
+                self.counters["explored"] += 1
+            return self.rng.choice(ranked[1:])
+        return ranked[0]
+
+    def hedge_delay(self, route):
+        """Seconds to wait for a route before hedging, or None to not hedge"""
+        if not self.hedge:
+            return None
+        with self.lock:
+            if len(route.latencies) < self.min_samples:
+                return None
+            return route.quantile(self.hedge_quantile)
+
+    def backup_for(self, primary):
+        ranked = self.ranked()
+        others = [route for route in ranked if route is not primary]
+        return others[0] if others else primary
+
+    def record(self, route, latency=None, ok=True):
+        """Count one finished call; ``latency`` is None when it is not comparable (a stream)"""
+        with self.lock:
+            route.counters["calls"] += 1
+            if not ok:
+                route.counters["failures"] += 1
+            route.error_rate += ERROR_DECAY * ((0.0 if ok else 1.0) - route.error_rate)
+            if latency is not None:
+                route.latencies.append(latency)
+
+    def _take_hedge(self):
+        with self.lock:
+            if self.hedge_tokens < 1:
+                return False
+            self.hedge_tokens -= 1
+            self.counters["hedged"] += 1
+            return True
+
+    # Calls
+
+    def chat(self, messages, validate=None, timeout=None, **kwargs):
+        """Run a chat completion on the best route, hedged; return (response, model).
+
+        ``validate(response)`` says whether a response is usable. A request
+        that fails or answers unusably before the hedge was sent is hedged
+        at once. An unusable response is only returned when no request
+        produced a usable one; if every request failed the last error is
+        raised. ``timeout`` bounds the whole call, hedge included. Every
+        other response goes to ``on_discarded``, including one that arrives
+        after this returns.
+        """
+        started = self.clock()
+        primary = self.pick()
+        with self.lock:
+            self.counters["calls"] += 1
+            self.hedge_tokens = min(HEDGE_BURST, self.hedge_tokens + self.hedge_budget)
+        delay = self.hedge_delay(primary)
+        results = _Results()
+        if delay is None:
+            # Nothing to race against: call in this thread
+            results.put(self._run(0, primary, messages, validate, timeout, kwargs))
+        else:
+            self._start(0, primary, messages, validate, timeout, kwargs, results)
+        pending = 1
+        hedged = False
+        unusable = []
+        error = None
+        while pending:
+            wait = None
+            if not hedged and delay is not None:
+                wait = max(0.0, delay - (self.clock() - started))
+            try:
+                index, route, response, failure, usable, latency = results.get(timeout=wait)
+            except queue.Empty:
+                hedged = True
+                pending += self._hedge(primary, messages, validate, timeout, started, kwargs, results)
+                continue
+            pending -= 1
+            if usable:
+                with self.lock:
+                    route.counters["wins"] += 1
+                    if index == 1:
+                        self.counters["hedge_wins"] += 1
+                self._discard(unusable + results.close())
+                return response, route.model
+            if failure is not None:
+                error = failure
+            else:
+                unusable.append((response, route.model, latency))
+            if not hedged:
+                hedged = True
+                pending += self._hedge(primary, messages, validate, timeout, started, kwargs, results)
+        if unusable:
+            self._discard(unusable[1:])
+            return unusable[0][:2]
+        raise error
+
+    def _discard(self, responses):
+        """Hand responses that were not returned to on_discarded"""
+        for response, model, latency in responses:
+            with self.lock:
+                self.counters["discarded"] += 1
+            if self.on_discarded is None:
+                continue
+            try:
+                self.on_discarded(response, model, latency)
+            except Exception as e:
+                logger.warning("Model router on_discarded error: %s", e)
+
+    def _hedge(self, primary, messages, validate, timeout, started, kwargs, results):
+        """Send the backup request if the budget allows; return how many requests were started"""
+        if not self.hedge or not self._take_hedge():
+            return 0
+        backup = self.backup_for(primary)
+        with self.lock:
+            backup.counters["hedges"] += 1
+        remaining = None if timeout is None else max(timeout - (self.clock() - started), 0.1)
+        self._start(1, backup, messages, validate, remaining, kwargs, results)
+        return 1
+
+    def _run(self, index, route, messages, validate, timeout, kwargs):
+        """Make one request; index 0 is the first request, 1 the hedge.
+
+        Returns (index, route, response, error, usable, latency). An
+        unusable answer counts against the route's error rate like a failure.
+        """
+        started = self.clock()
+        try:
+            response = route.get_client().chat(messages, model=route.model, timeout=timeout, **kwargs)
+        except Exception as e:
+            self.record(route, ok=False)
+            return index, route, None, e, False, None
+        latency = self.clock() - started
+        usable = validate is None or validate(response)
+        if not usable:
+            with self.lock:
+                route.counters["invalid"] += 1
+                self.counters["invalid"] += 1
+        self.record(route, latency, ok=usable)
+        return index, route, response, None, usable, latency
+
+    def _start(self, index, route, messages, validate, timeout, kwargs, results):
+        def run():
+            result = self._run(index, route, messages, validate, timeout, kwargs)
+            if not results.put(result) and result[2] is not None:
+                # The call has already returned; nobody will read this one
+                self._discard([(result[2], route.model, result[5])])
+
+        threading.Thread(target=run, name="model-router", daemon=True).start()
+
+    def stats(self):
+        """Hedging counters, plus calls, failures and latency per route (flat keys)"""
+        with self.lock:
+            stats = dict(self.counters)
+            for route in self.routes:
+                for key, value in route.stats().items():
+                    stats[f"{route.model}_{key}".replace("-", "_").replace(".", "_")] = value
+        return stats
+
+
+class _Results(queue.Queue):
+    """One call's request results; after close() late results are refused"""
+
+    def __init__(self):
+        super().__init__()
+        self.closed = False
+        self.close_lock = threading.Lock()
+
+    def put(self, item):
+        """Queue a result; return False if the call has already returned"""
+        with self.close_lock:
+            if self.closed:
+                return False
+            super().put(item)
+            return True
+
+    def close(self):
+        """Refuse further results; return the responses queued but not read, for _discard"""
+        with self.close_lock:
+            self.closed = True
+        left = []
+        while True:
+            try:
+                _, route, response, _, _, latency = self.get_nowait()
+            except queue.Empty:
+                return left
+            if response is not None:
+                left.append((response, route.model, latency))
+
+
+def route_models(purpose):
+    """The models configured for a purpose ("wish" or "suggestions"), best first"""
+    value = os.getenv(f"{'WISH' if purpose == 'wish' else 'SUGGESTION'}_MODELS", DEFAULT_MODELS[purpose])
+    return [model.strip() for model in value.split(",") if model.strip()]
+
+
+def build_model_router(purpose, client=None, on_discarded=None):
+    """Build the router for a purpose from environment configuration.
+
+    Every route uses ``client``, or the process-wide LLMClient when it is None.
+    The client keeps a circuit breaker per model, so an open breaker on one
+    route leaves the others callable.
+    """
+    window = int(os.getenv("ROUTER_WINDOW", "200"))
+    return ModelRouter(
+        [Route(model, client, window) for model in route_models(purpose)],
+        hedge=os.getenv("ROUTER_HEDGE", "1") != "0",
+        hedge_quantile=float(os.getenv("ROUTER_HEDGE_QUANTILE", "0.9")),
+        hedge_budget=float(os.getenv("ROUTER_HEDGE_BUDGET", "0.15")),
+        min_samples=int(os.getenv("ROUTER_MIN_SAMPLES", "20")),
+        tolerance=float(os.getenv("ROUTER_TOLERANCE", "0.1")),
+        explore=float(os.getenv("ROUTER_EXPLORE", "0.05")),
+        on_discarded=on_discarded,
+    )
@@ -0,0 +1,279 @@
+"""
+Structured logging, timing spans and Prometheus metrics.
+
+Spans time the steps of a request (wish validation, the LLM call, scoring,
+the DB commit, rate-limiter checks) into one histogram labelled by span
+name; whole requests go into a second histogram by endpoint and status.
+LLM token usage is counted from each response's ``usage`` block. The
+counters of the app's background components (LLM client, suggestion pool,
+twist cache, history writer) are exported as gauges at scrape time.
+
+Span and request timings are sampled per request so the overhead on the
+hot path stays negligible; token counters are always exact.
+
+Configuration (environment variables):
+    LOG_LEVEL                log level (default INFO)
+    LOG_FORMAT               "text" (default) or "json"
+    METRICS_ENABLED          "0" disables metrics (default enabled)
+    METRICS_SAMPLE_RATE      fraction of requests timed, 0-1 (default 1.0)
+    PROMETHEUS_MULTIPROC_DIR set when running several gunicorn workers so the
+                             histograms are aggregated across processes
+"""
+
+import json
+import logging
+import os
+import random
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+
+try:
+    import prometheus_client
+    from prometheus_client.core import GaugeMetricFamily
+except ImportError:
+    prometheus_client = None
+
+
+logger = logging.getLogger("monkeypaw")
+
+SPAN_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30)
+
+
+class StructuredFormatter(logging.Formatter):
+    """Render log records as key=value text or one JSON object per line.
+
+    Structured fields are passed as ``extra={"fields": {...}}``.
+    """
+
+    def __init__(self, json_output=False):
+        super().__init__()
+        self.json_output = json_output
+
+    def format(self, record):
+        fields = getattr(record, "fields", None) or {}
+        if self.json_output:
+            entry = {
+                "ts": round(record.created, 3),
+                "level": record.levelname.lower(),
+                "logger": record.name,
+                "event": record.getMessage(),
+            }
+            entry.update(fields)
+            if record.exc_info:
+                entry["exc"] = self.formatException(record.exc_info)
+            return json.dumps(entry, default=str)
+        line = f"{self.formatTime(record)} {record.levelname:<7} {record.name} {record.getMessage()}"
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+def configure_logging():
+    """Install the structured formatter on the app's loggers (idempotent)"""
+    root = logging.getLogger("monkeypaw")
+    if getattr(root, "_monkeypaw_configured", False):
+        return
+    handler = logging.StreamHandler()
+    handler.setFormatter(StructuredFormatter(json_output=os.getenv("LOG_FORMAT", "text") == "json"))
+    level = os.getenv("LOG_LEVEL", "INFO").upper()
+    for name in ("monkeypaw", "suggestion_pool", "history_writer"):
+        component = logging.getLogger(name)
+        component.addHandler(handler)
+        component.setLevel(level)
+        component.propagate = False
+    root._monkeypaw_configured = True
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class StatsCollector:
+    """Exports the stats() dicts of background components as gauges"""
+
+    def __init__(self):
+        self.sources = {}
+
+    def add(self, name, stats_fn):
+        self.sources[name] = stats_fn
+
+    def collect(self):
+        for name, stats_fn in self.sources.items():
+            try:
+                stats = stats_fn()
+            except Exception:
+                continue
+            for key, value in stats.items():
+                metric = f"monkeypaw_stats_{name}_{key}"
+                if isinstance(value, bool):
+                    value = int(value)
+                if isinstance(value, (int, float)):
+                    gauge = GaugeMetricFamily(metric, f"{name} {key}")
+                    gauge.add_metric([], value)
+                    yield gauge
+                elif isinstance(value, str):
+                    gauge = GaugeMetricFamily(metric, f"{name} {key}", labels=["value"])
+                    gauge.add_metric([value], 1)
+                    yield gauge
+
+
+class Metrics:
+    """Histograms and counters for the app, with per-request sampling"""
+
+    def __init__(self, enabled=True, sample_rate=1.0):
+        self.enabled = enabled and prometheus_client is not None
+        self.sample_rate = sample_rate
+        self.stats_collector = StatsCollector()
+        if not self.enabled:
+            return
+        self.multiprocess = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+        # Multiprocess mode requires the default registry
+        self.registry = prometheus_client.REGISTRY if self.multiprocess else prometheus_client.CollectorRegistry()
+        self.span_seconds = prometheus_client.Histogram(
+            "monkeypaw_span_seconds", "Time spent in a step of request handling",
+            ["span"], buckets=SPAN_BUCKETS, registry=self.registry,
+        )
+        self.request_seconds = prometheus_client.Histogram(
+            "monkeypaw_request_seconds", "Request latency by endpoint",
+            ["endpoint", "method", "status"], buckets=SPAN_BUCKETS, registry=self.registry,
+        )
+        self.llm_tokens = prometheus_client.Counter(
+            "monkeypaw_llm_tokens", "LLM tokens used, from response.usage",
+            ["purpose", "model", "kind"], registry=self.registry,
+        )
+        self.llm_calls = prometheus_client.Counter(
+            "monkeypaw_llm_calls", "LLM calls that returned a response",
+            ["purpose", "model"], registry=self.registry,
+        )
+
+    # Sampling
+
+    def sampled(self):
+        """Whether timings are recorded for the current request or background task"""
+        if not self.enabled:
+            return False
+        if has_request_context():
+            sampled = getattr(g, "_metrics_sampled", None)
+            if sampled is None:
+                sampled = g._metrics_sampled = random.random() < self.sample_rate
+            return sampled
+        return random.random() < self.sample_rate
+
+    # Request hooks
+
+    def start_request(self):
+        if self.sampled():
+            g._metrics_started = time.perf_counter()
+
+    def finish_request(self, response):
+        started = getattr(g, "_metrics_started", None)
+        if started is not None:
+            self.request_seconds.labels(
+                request.endpoint or "unknown", request.method, str(response.status_code)
+            ).observe(time.perf_counter() - started)
+        return response
+
+    # Spans
+
+    def span(self, name):
+        """Context manager timing a block into monkeypaw_span_seconds{span=name}"""
+        if not self.sampled():
+            return _NULL_SPAN
+        return self._timed(name)
+
+    @contextmanager
+    def _timed(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.span_seconds.labels(name).observe(time.perf_counter() - started)
+
+    def instrument_limiter(self, limiter):
+        """Time flask-limiter's storage checks as the 'limiter' span"""
+        try:
+            strategy = limiter.limiter
+        except (AssertionError, AttributeError):
+            # Rate limiting is disabled, so there is nothing to time
+            return
+        if getattr(strategy, "_monkeypaw_timed", False):
+            return
+        strategy._monkeypaw_timed = True
+        for method in ("hit", "test"):
+            original = getattr(strategy, method, None)
+            if original is None:
+                continue
+
+            def timed(*args, _original=original, **kwargs):
+                with self.span("limiter"):
+                    return _original(*args, **kwargs)
+
+            setattr(strategy, method, timed)
+
+    # LLM usage
+
+    def record_usage(self, purpose, model, usage):
+        """Count prompt/completion tokens from a response's usage block"""
+        if not self.enabled:
+            return
+        self.llm_calls.labels(purpose, model).inc()
+        if usage is None:
+            return
+        prompt = getattr(usage, "prompt_tokens", None) or 0
+        completion = getattr(usage, "completion_tokens", None) or 0
+        self.llm_tokens.labels(purpose, model, "prompt").inc(prompt)
+        self.llm_tokens.labels(purpose, model, "completion").inc(completion)
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = getattr(details, "cached_tokens", None) or 0
+        if cached:
+            # Prompt tokens served from the provider's prompt cache (already counted in "prompt")
+            self.llm_tokens.labels(purpose, model, "cached").inc(cached)
+
+    # Exposition
+
+    def register_stats(self, name, stats_fn):
+        """Export a component's stats() dict as gauges"""
+        self.stats_collector.add(name, stats_fn)
+
+    def render(self):
+        """Return (body, content_type) for the scrape endpoint"""
+        if self.multiprocess:
+            from prometheus_client import multiprocess
+
+            registry = prometheus_client.CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = self.registry
+        body = prometheus_client.generate_latest(registry)
+        # Component stats are per process; they reflect the worker that answered
+        body += prometheus_client.generate_latest(self._stats_registry())
+        return body, prometheus_client.CONTENT_TYPE_LATEST
+
+    def _stats_registry(self):
+        registry = getattr(self, "_stats_reg", None)
+        if registry is None:
+            registry = self._stats_reg = prometheus_client.CollectorRegistry()
+            registry.register(self.stats_collector)
+        return registry
+
+
+def build_metrics():
+    """Build Metrics from environment configuration"""
+    enabled = os.getenv("METRICS_ENABLED", "1") != "0"
+    if enabled and prometheus_client is None:
+        logger.warning("prometheus_client not installed; /metrics is disabled")
+    return Metrics(
+        enabled=enabled,
+        sample_rate=float(os.getenv("METRICS_SAMPLE_RATE", "1.0")),
+    )
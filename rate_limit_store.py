@@ -0,0 +1,282 @@
+"""
+Two-tier rate limit storage for flask-limiter.
+
+With plain Redis storage every rate limit check is a Redis round trip, and
+a request usually checks three limits (its route's and the two defaults).
+``TieredRedisStorage`` keeps a fixed-window counter per limit key in each
+worker and answers checks from it. Hits are added up locally and a
+background thread sends the deltas for all keys to Redis in one script
+call every RATELIMIT_SYNC_INTERVAL seconds, reading back the global counts
+(every worker's hits) at the same time.
+
+Between syncs a worker sees its own hits at once and other workers' hits
+late, so it may admit a few requests the global count would have
+refused. This is bounded per limit: a worker only answers locally while it
+has fewer than RATELIMIT_LOCAL_SHARE of the limit unsynced for a key, and
+past that the check waits for a synchronous sync. Limits too small to
+share (5 per minute at the default share) are always checked against
+Redis, as before. Over-admission is therefore at most (workers - 1) x
+share x limit per window.
+
+If Redis is unreachable, checks keep being answered locally. Each worker
+then counts its own hits RATELIMIT_WORKERS times, so together the workers
+admit about one limit's worth instead of one each. Syncing resumes, with
+the hits made in the meantime, once Redis answers again.
+
+Limits are keyed by client address. Behind Render's proxy the address is
+the one the proxy appended to X-Forwarded-For. Entries further left are
+whatever the client sent and are not trusted, so only the last
+TRUSTED_PROXY_HOPS entries are used (see create_app).
+
+Configuration (environment variables):
+    RATELIMIT_STORAGE        "tiered" (default) or "redis" for flask-limiter's own Redis storage
+    RATELIMIT_LOCAL_SHARE    fraction of a limit a worker may admit between syncs (default 0.1)
+    RATELIMIT_SYNC_INTERVAL  seconds between background syncs (default 0.25)
+    RATELIMIT_WORKERS        worker processes sharing each limit, used while Redis is
+                             unreachable (default WEB_CONCURRENCY, or 1)
+    TRUSTED_PROXY_HOPS       proxies in front of the app that append to X-Forwarded-For
+                             (default 1 in production, 0 otherwise)
+"""
+
+import os
+import threading
+import time
+from collections import Counter
+
+import redis
+from limits.storage import Storage
+
+from observability import logger
+
+
+KEY_PREFIX = "LIMITS:"
+
+# For each key: add the delta, start the window if the key is new, and
+# return the global count and the milliseconds left in the window.
+SYNC_SCRIPT = """
+local result = {}
+for i, key in ipairs(KEYS) do
+    local count = redis.call('INCRBY', key, ARGV[2 * i - 1])
+    local ttl = redis.call('PTTL', key)
+    if ttl < 0 then
+        ttl = tonumber(ARGV[2 * i])
+        redis.call('PEXPIRE', key, ttl)
+    end
+    result[2 * i - 1] = count
+    result[2 * i] = ttl
+end
+return result
+"""
+
+
+def trusted_proxy_hops():
+    default = "1" if os.getenv("FLASK_ENV") == "production" else "0"
+    return int(os.getenv("TRUSTED_PROXY_HOPS", default))
+
+
+def tiered_enabled():
+    return os.getenv("RATELIMIT_STORAGE", "tiered") == "tiered"
+
+
+def limit_amount(key):
+    """The limit's request count, from a flask-limiter key (``.../<amount>/<multiples>/<GRANULARITY>``)"""
+    try:
+        return int(key.rsplit("/", 3)[1])
+    except (IndexError, ValueError):
+        return 0
+
+
+class _Window:
+    """One worker's view of a limit key's current fixed window"""
+
+    __slots__ = ("expiry", "expires_at", "synced", "pending", "budget", "dirty")
+
+    def __init__(self, expiry, expires_at, budget):
+        self.expiry = expiry
+        self.expires_at = expires_at
+        self.synced = 0  # global count at the last sync, including our flushed hits
+        self.pending = 0  # our hits not sent to Redis yet
+        self.budget = budget  # unsynced hits this worker may admit on its own
+        self.dirty = True  # touched since the last sync
+
+
+class TieredRedisStorage(Storage):
+    """flask-limiter storage answering from per-worker counters synced to Redis in batches"""
+
+    STORAGE_SCHEME = ["tiered+redis", "tiered+rediss"]
+
+    def __init__(self, uri=None, wrap_exceptions=False, client=None, local_share=None,
+                 sync_interval=None, workers=None, clock=time.monotonic, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        self.redis_url = uri.replace("tiered+", "", 1) if uri else "redis://localhost:6379"
+        self.client = client
+        self.local_share = float(local_share if local_share is not None
+                                 else os.getenv("RATELIMIT_LOCAL_SHARE", "0.1"))
+        self.sync_interval = float(sync_interval if sync_interval is not None
+                                   else os.getenv("RATELIMIT_SYNC_INTERVAL", "0.25"))
+        self.workers = int(workers if workers is not None
+                           else os.getenv("RATELIMIT_WORKERS", os.getenv("WEB_CONCURRENCY", "1")))
+        self.clock = clock
+        self.windows = {}
+        self.lock = threading.Lock()
+        self.counters = Counter()
+        self.degraded = False
+        self._script = None
+        self._pid = None
+        self._stopped = threading.Event()
+
+    @property
+    def base_exceptions(self):
+        return redis.RedisError
+
+    # Worker setup. The storage is built in the gunicorn master when the app
+    # is preloaded, so the Redis client and sync thread are made per process.
+
+    def _ensure_worker(self):
+        if self._pid == os.getpid():
+            return
+        with self.lock:
+            if self._pid == os.getpid():
+                return
+            self.windows = {}
+            if self.client is None or self._pid is not None:
+                self.client = redis.Redis.from_url(
+                    self.redis_url, socket_timeout=0.5, socket_connect_timeout=0.5
+                )
+            self._script = self.client.register_script(SYNC_SCRIPT)
+            self._pid = os.getpid()
+            if self.sync_interval > 0:
+                threading.Thread(target=self._sync_loop, name="ratelimit-sync", daemon=True).start()
+
+    def _sync_loop(self):
+        while not self._stopped.wait(self.sync_interval):
+            self.sync()
+
+    def stop(self):
+        self._stopped.set()
+
+    # Local counting
+
+    def _window(self, key, expiry, now):
+        window = self.windows.get(key)
+        if window is None or now >= window.expires_at:
+            budget = int(limit_amount(key) * self.local_share)
+            window = self.windows[key] = _Window(expiry, now + expiry, budget)
+        return window
+
+    def _estimate(self, window):
+        # While Redis is unreachable each worker's hits stand for all workers'
+        weight = self.workers if self.degraded else 1
+        return window.synced + window.pending * weight
+
+    def incr(self, key, expiry, amount=1):
+        self._ensure_worker()
+        now = self.clock()
+        with self.lock:
+            window = self._window(key, expiry, now)
+            window.pending += amount
+            window.dirty = True
+            if self.degraded or window.pending <= window.budget:
+                self.counters["local_hits"] += 1
+                return self._estimate(window)
+        # Over this worker's share of the limit: check with Redis before admitting more
+        self.counters["synced_hits"] += 1
+        self.sync([key])
+        with self.lock:
+            return self._estimate(self._window(key, expiry, self.clock()))
+
+    def get(self, key):
+        self._ensure_worker()
+        with self.lock:
+            window = self.windows.get(key)
+            if window is None or self.clock() >= window.expires_at:
+                return 0
+            return self._estimate(window)
+
+    def get_expiry(self, key):
+        with self.lock:
+            window = self.windows.get(key)
+            remaining = max(0.0, window.expires_at - self.clock()) if window else 0.0
+        return time.time() + remaining
+
+    # Syncing
+
+    def sync(self, keys=None):
+        """Send pending hits to Redis and read back global counts; return False if Redis failed"""
+        self._ensure_worker()
+        now = self.clock()
+        with self.lock:
+            for key in [key for key, window in self.windows.items() if now >= window.expires_at]:
+                del self.windows[key]
+            if keys is None:
+                keys = [key for key, window in self.windows.items() if window.dirty]
+            batch = []
+            for key in keys:
+                window = self.windows.get(key)
+                if window is None:
+                    continue
+                batch.append((key, window, window.pending))
+                window.pending = 0
+                window.dirty = False
+        if not batch:
+            return True
+
+        args = []
+        for _, window, delta in batch:
+            args += [delta, int(window.expiry * 1000)]
+        try:
+            result = self._script(keys=[KEY_PREFIX + key for key, _, _ in batch], args=args)
+        except redis.RedisError as e:
+            with self.lock:
+                # Keep the hits for the next attempt
+                for _, window, delta in batch:
+                    window.pending += delta
+                    window.dirty = True
+            self.counters["sync_failures"] += 1
+            if not self.degraded:
+                self.degraded = True
+                logger.warning("Rate limiter cannot reach Redis, limiting per worker: %s", e)
+            return False
+
+        now = self.clock()
+        with self.lock:
+            for i, (key, window, _) in enumerate(batch):
+                window.synced = int(result[2 * i])
+                window.expires_at = now + int(result[2 * i + 1]) / 1000
+        self.counters["syncs"] += 1
+        self.counters["synced_keys"] += len(batch)
+        if self.degraded:
+            self.degraded = False
+            logger.info("Rate limiter reconnected to Redis")
+        return True
+
+    # Storage interface
+
+    def check(self):
+        try:
+            self._ensure_worker()
+            return bool(self.client.ping())
+        except redis.RedisError:
+            return False
+
+    def reset(self):
+        self._ensure_worker()
+        with self.lock:
+            self.windows = {}
+        deleted = 0
+        for key in self.client.scan_iter(match=KEY_PREFIX + "*"):
+            deleted += self.client.delete(key)
+        return deleted
+
+    def clear(self, key):
+        self._ensure_worker()
+        with self.lock:
+            self.windows.pop(key, None)
+        self.client.delete(KEY_PREFIX + key)
+
+    def stats(self):
+        """Checks answered locally vs after a Redis round trip, syncs and failures"""
+        stats = dict(self.counters)
+        stats["keys"] = len(self.windows)
+        stats["degraded"] = self.degraded
+        return stats
@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+"""
+Leaderboard rebuild script for Monkey's Paw application.
+Repopulates the leaderboard store (Redis sorted set in production) from the
+users table. Run this after a Redis flush or on a cold start.
+"""
+
+from app import create_app, get_leaderboard_store, rebuild_leaderboard
+
+app = create_app()
+
+def main():
+    with app.app_context():
+        try:
+            rebuild_leaderboard()
+            leaderboard_store = get_leaderboard_store()
+            top = leaderboard_store.top(10)
+            print(f"✅ Leaderboard rebuilt. Version: {leaderboard_store.get_version()}")
+            for rank, (username, high_score, avoided_twists, streak) in enumerate(top, start=1):
+                print(f"  {rank}. {username} - high score {high_score}, avoided twists {avoided_twists}")
+        except Exception as e:
+            print(f"❌ Error rebuilding leaderboard: {e}")
+            raise
+
+if __name__ == "__main__":
+    main()
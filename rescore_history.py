@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Offline re-scoring of wish_history for Monkey's Paw application.
+Re-runs the current scoring engine over stored wishes in id-ordered batches
+and reports how many rows would change. Pass --update to write the new
+indicator counts and quality bonus back. Outcomes are never changed.
+
+The /stats rollups add up those columns as each wish is stored, so after
+--update changes any rows they are rebuilt from wish_history, as
+backfill_stats.py does. Like the backfill, run it while the app isn't
+serving wishes (or with STATS_ENABLED=0 on the app). With --skip-stats
+the rollups are left as they are and backfill_stats.py has to be run
+afterwards.
+"""
+
+import argparse
+from sqlalchemy import update
+from app import backfill_stats, create_app, db, WishHistory, wish_scorer
+from stats_rollup import stats_enabled
+
+app = create_app()
+
+def rescore_history(batch_size=1000, write=False, rebuild_stats=True):
+    with app.app_context():
+        try:
+            last_id = 0
+            scanned = 0
+            changed = 0
+            while True:
+                rows = db.session.query(
+                    WishHistory.id,
+                    WishHistory.wish_text,
+                    WishHistory.positive_indicator_count,
+                    WishHistory.negative_indicator_count,
+                    WishHistory.wish_quality_bonus
+                ).filter(WishHistory.id > last_id).order_by(WishHistory.id).limit(batch_size).all()
+                if not rows:
+                    break
+                last_id = rows[-1].id
+                scanned += len(rows)
+                
+                updates = []
+                for row, score in zip(rows, wish_scorer.score_many(row.wish_text for row in rows)):
+                    if (row.positive_indicator_count, row.negative_indicator_count) != (score.positive_count, score.negative_count) \
+                            or row.wish_quality_bonus is None \
+                            or abs(row.wish_quality_bonus - score.wish_quality_bonus) > 1e-9:
+                        updates.append({
+                            "id": row.id,
+                            "positive_indicator_count": score.positive_count,
+                            "negative_indicator_count": score.negative_count,
+                            "wish_quality_bonus": score.wish_quality_bonus,
+                        })
+                changed += len(updates)
+                if write and updates:
+                    db.session.execute(update(WishHistory), updates)
+                    db.session.commit()
+                print(f"  scanned {scanned} rows, {changed} differ")
+            
+            verb = "Updated" if write else "Would update"
+            print(f"✅ {verb} {changed} of {scanned} wish_history rows.")
+            if write and changed and stats_enabled():
+                if rebuild_stats:
+                    rows = backfill_stats()
+                    print(f"✅ Stats rollups rebuilt from {rows} wish_history rows.")
+                else:
+                    print("⚠️ Stats rollups still hold the old scores; run python backfill_stats.py")
+            return changed
+        
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Error re-scoring wish_history: {e}")
+            raise
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--update", action="store_true", help="write the new scores back")
+    parser.add_argument("--skip-stats", action="store_true",
+                        help="don't rebuild the stats rollups after --update (run backfill_stats.py later)")
+    args = parser.parse_args()
+    rescore_history(batch_size=args.batch_size, write=args.update, rebuild_stats=not args.skip_stats)
@@ -5,7 +5,9 @@ WARNING: This will delete ALL data and recreate tables from scratch.
 """
 
 import os
-from app import app, db
+from app import create_app, db
+
+app = create_app()
 
 def reset_database():
     with app.app_context():
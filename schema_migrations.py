@@ -0,0 +1,422 @@
+"""
+Versioned schema migrations that can run while the game is being played.
+
+Each file in migrations/ named ``YYYYMMDD_description.py`` defines
+``STEPS``, a list of the operations below. ``python migrate.py`` applies
+the files not yet recorded in the ``schema_migrations`` table, in file
+name order, and records each one when all its steps are done. Steps check
+what is already in place, so a migration applied by hand before the runner
+existed is simply recorded.
+
+Operations are written so they don't stall requests:
+
+- ``AddColumn`` only adds nullable columns or columns with a constant
+  default, which Postgres does by updating the catalog, without rewriting
+  the table.
+- ``CreateIndex`` uses CREATE INDEX CONCURRENTLY on Postgres, so reads and
+  writes continue while it builds. An INVALID index left by an interrupted
+  build is dropped and rebuilt.
+- ``Backfill`` updates rows in primary key ranges, one short transaction per
+  batch, pausing between batches and shrinking them when they run slow. Its
+  progress is stored in ``schema_migration_progress``, so an interrupted
+  backfill continues where it stopped.
+- ``SQL`` runs any other statement; its author states the lock it takes.
+
+DDL waits at most MIGRATION_LOCK_TIMEOUT for its table lock and is retried
+MIGRATION_LOCK_RETRIES times. Without the timeout an ALTER TABLE queued
+behind a long transaction would block every query on the table until
+it ran. Concurrent index builds block nobody while they wait, so they wait
+as long as it takes. ``--dry-run`` lists the pending steps with the lock each takes,
+the table's estimated size and the open transactions it would wait for.
+
+Configuration (environment variables):
+    MIGRATION_LOCK_TIMEOUT  how long a statement waits for a lock, Postgres syntax (default 3s)
+    MIGRATION_LOCK_RETRIES  attempts per statement when the lock wait times out (default 5)
+"""
+
+import importlib.util
+import os
+import re
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import Boolean, Column, DateTime, Integer, MetaData, String, Table, inspect, select, text
+from sqlalchemy.exc import OperationalError
+
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+MIGRATION_FILE = re.compile(r"^(\d{8}_\w+)\.py$")
+
+# Postgres error code for a lock_timeout expiry
+LOCK_NOT_AVAILABLE = "55P03"
+
+metadata = MetaData()
+
+versions_table = Table(
+    "schema_migrations", metadata,
+    Column("version", String(120), primary_key=True),
+    Column("applied_at", DateTime, nullable=False),
+    Column("duration_ms", Integer),
+)
+
+progress_table = Table(
+    "schema_migration_progress", metadata,
+    Column("version", String(120), primary_key=True),
+    Column("step", Integer, primary_key=True),
+    Column("last_id", Integer, nullable=False, default=0),
+    Column("rows", Integer, nullable=False, default=0),
+    Column("done", Boolean, nullable=False, default=False),
+    Column("updated_at", DateTime),
+)
+
+Migration = namedtuple("Migration", ["version", "path", "summary", "steps"])
+
+
+# Operations
+
+class AddColumn:
+    """ALTER TABLE ... ADD COLUMN for a nullable column or one with a constant default"""
+
+    lock = "ACCESS EXCLUSIVE, catalog update only"
+
+    def __init__(self, table, column, type_sql, default=None):
+        self.table = table
+        self.column = column
+        self.type_sql = type_sql
+        self.default = default
+
+    def describe(self):
+        default = f" DEFAULT {self.default}" if self.default is not None else ""
+        return f"ALTER TABLE {self.table} ADD COLUMN {self.column} {self.type_sql}{default}"
+
+    def impact(self, runner):
+        return f"held for milliseconds; queries on {self.table} queue behind it only while it waits for the lock"
+
+    def apply(self, runner, version, index):
+        if self.column in runner.columns(self.table):
+            return "already there"
+        runner.execute_ddl(self.describe())
+        return "added"
+
+
+class CreateIndex:
+    """CREATE INDEX, built concurrently on Postgres"""
+
+    lock = "SHARE UPDATE EXCLUSIVE, reads and writes continue"
+
+    def __init__(self, name, table, columns, unique=False):
+        self.name = name
+        self.table = table
+        self.columns = tuple(columns)
+        self.unique = unique
+
+    def describe(self, concurrently=True):
+        unique = "UNIQUE " if self.unique else ""
+        concurrently = "CONCURRENTLY " if concurrently else ""
+        return (f"CREATE {unique}INDEX {concurrently}IF NOT EXISTS {self.name} "
+                f"ON {self.table} ({', '.join(self.columns)})")
+
+    def impact(self, runner):
+        if not runner.postgres:
+            return "locks the whole database while it builds (not Postgres)"
+        return f"scans {self.table} twice and waits for transactions already open on it"
+
+    def apply(self, runner, version, index):
+        if not runner.postgres:
+            if self.name in runner.indexes(self.table):
+                return "already there"
+            runner.execute_ddl(self.describe(concurrently=False))
+            return "built"
+        # CONCURRENTLY cannot run inside a transaction block
+        with runner.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            invalid = connection.execute(text(
+                "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                "WHERE c.relname = :name AND NOT i.indisvalid"
+            ), {"name": self.name}).fetchone()
+            if invalid:
+                # Left behind by an interrupted concurrent build
+                runner.execute_ddl(f"DROP INDEX CONCURRENTLY IF EXISTS {self.name}", connection)
+            elif self.name in runner.indexes(self.table):
+                return "already there"
+            runner.execute_ddl(self.describe(), connection)
+        return "rebuilt" if invalid else "built"
+
+
+class Backfill:
+    """UPDATE ... SET in primary key ranges, resumable and throttled"""
+
+    lock = "row locks, one batch at a time"
+
+    def __init__(self, table, assignments, where=None, key="id", batch_size=1000, pause=0.1,
+                 max_batch_seconds=0.5):
+        self.table = table
+        self.assignments = assignments
+        self.where = where
+        self.key = key
+        self.batch_size = batch_size
+        self.pause = pause
+        self.max_batch_seconds = max_batch_seconds
+
+    def describe(self):
+        where = f" AND ({self.where})" if self.where else ""
+        return f"UPDATE {self.table} SET {self.assignments} WHERE {self.key} in batches of {self.batch_size}{where}"
+
+    def impact(self, runner):
+        rows = runner.table_estimate(self.table)[0]
+        if rows is None:
+            return "table not found"
+        batches = max(1, -(-rows // self.batch_size))
+        return (f"about {batches} batches of up to {self.batch_size} rows, "
+                f"at least {batches * self.pause:.0f}s of pauses; resumable")
+
+    def apply(self, runner, version, index):
+        progress = runner.progress(version, index)
+        if progress["done"]:
+            return "already done"
+        with runner.engine.connect() as connection:
+            upper = connection.execute(text(f"SELECT MAX({self.key}) FROM {self.table}")).scalar() or 0
+        last_id, rows, batch_size = progress["last_id"], progress["rows"], self.batch_size
+        where = f" AND ({self.where})" if self.where else ""
+        statement = text(f"UPDATE {self.table} SET {self.assignments} "
+                         f"WHERE {self.key} > :low AND {self.key} <= :high{where}")
+        # Rows inserted after this point are written by the current code and need no backfill
+        while last_id < upper:
+            high = min(last_id + batch_size, upper)
+            started = time.monotonic()
+            with runner.engine.begin() as connection:
+                runner.set_lock_timeout(connection)
+                rows += connection.execute(statement, {"low": last_id, "high": high}).rowcount
+                runner.save_progress(connection, version, index, high, rows, done=high >= upper)
+            elapsed = time.monotonic() - started
+            last_id = high
+            # Keep each transaction short: slow batches get smaller, fast ones grow back
+            if elapsed > self.max_batch_seconds:
+                batch_size = max(100, batch_size // 2)
+            elif elapsed < self.max_batch_seconds / 4:
+                batch_size = min(self.batch_size, batch_size * 2)
+            runner.log(f"  {self.table}: up to {self.key} {last_id} of {upper}, {rows} rows updated")
+            if self.pause and last_id < upper:
+                time.sleep(self.pause)
+        if last_id >= upper and not runner.progress(version, index)["done"]:
+            with runner.engine.begin() as connection:
+                runner.save_progress(connection, version, index, last_id, rows, done=True)
+        return f"{rows} rows updated"
+
+
+class SQL:
+    """Any other statement; ``lock`` says what it locks and for how long"""
+
+    def __init__(self, statement, lock, transaction=True):
+        self.statement = statement
+        self.lock = lock
+        self.transaction = transaction
+
+    def describe(self):
+        return self.statement
+
+    def impact(self, runner):
+        return "as stated by the migration"
+
+    def apply(self, runner, version, index):
+        if self.transaction:
+            runner.execute_ddl(self.statement)
+        else:
+            with runner.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+                runner.execute_ddl(self.statement, connection)
+        return "done"
+
+
+# Runner
+
+def load_migrations(directory=MIGRATIONS_DIR):
+    """Every migration file in the directory, in version order"""
+    migrations = []
+    for name in sorted(os.listdir(directory)):
+        match = MIGRATION_FILE.match(name)
+        if not match:
+            continue
+        version = match.group(1)
+        path = os.path.join(directory, name)
+        spec = importlib.util.spec_from_file_location(f"migration_{version}", path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        if not hasattr(module, "STEPS"):
+            raise ValueError(f"{name} defines no STEPS")
+        summary = (module.__doc__ or "").strip().splitlines()[0] if module.__doc__ else ""
+        migrations.append(Migration(version, path, summary, list(module.STEPS)))
+    return migrations
+
+
+class MigrationRunner:
+    """Applies pending migrations to one database and records them"""
+
+    def __init__(self, engine, migrations=None, lock_timeout="3s", lock_retries=5, log=print, sleep=time.sleep):
+        self.engine = engine
+        self.migrations = load_migrations() if migrations is None else migrations
+        self.lock_timeout = lock_timeout
+        self.lock_retries = lock_retries
+        self.log = log
+        self.sleep = sleep
+
+    @property
+    def postgres(self):
+        return self.engine.dialect.name == "postgresql"
+
+    # Bookkeeping
+
+    def ensure_tables(self):
+        metadata.create_all(self.engine)
+
+    def applied(self):
+        """version -> applied_at for recorded migrations (empty before the first run)"""
+        if not inspect(self.engine).has_table("schema_migrations"):
+            return {}
+        with self.engine.connect() as connection:
+            return dict(connection.execute(select(versions_table.c.version, versions_table.c.applied_at)).all())
+
+    def pending(self, target=None):
+        applied = self.applied()
+        return [m for m in self.migrations
+                if m.version not in applied and (target is None or m.version <= target)]
+
+    def progress(self, version, step):
+        with self.engine.connect() as connection:
+            row = connection.execute(select(progress_table).where(
+                progress_table.c.version == version, progress_table.c.step == step
+            )).mappings().first()
+        return dict(row) if row else {"last_id": 0, "rows": 0, "done": False}
+
+    def save_progress(self, connection, version, step, last_id, rows, done=False):
+        values = {"last_id": last_id, "rows": rows, "done": done, "updated_at": datetime.utcnow()}
+        updated = connection.execute(progress_table.update().where(
+            progress_table.c.version == version, progress_table.c.step == step
+        ).values(**values)).rowcount
+        if not updated:
+            connection.execute(progress_table.insert().values(version=version, step=step, **values))
+
+    # Schema inspection
+
+    def columns(self, table):
+        return {column["name"] for column in inspect(self.engine).get_columns(table)}
+
+    def indexes(self, table):
+        return {index["name"] for index in inspect(self.engine).get_indexes(table)}
+
+    def table_estimate(self, table):
+        """(rows, bytes) for a table; the planner's estimate on Postgres, bytes None elsewhere"""
+        if not inspect(self.engine).has_table(table):
+            return None, None
+        with self.engine.connect() as connection:
+            if self.postgres:
+                row = connection.execute(text(
+                    "SELECT GREATEST(reltuples, 0)::bigint, pg_total_relation_size(oid) FROM pg_class "
+                    "WHERE relname = :table AND relkind = 'r'"
+                ), {"table": table}).first()
+                return (int(row[0]), int(row[1])) if row else (None, None)
+            return connection.execute(text(f"SELECT COUNT(*) FROM {table}")).scalar(), None
+
+    def open_transactions(self, table):
+        """(count, oldest seconds) of other transactions holding locks on a table (Postgres only)"""
+        if not self.postgres:
+            return 0, 0
+        with self.engine.connect() as connection:
+            row = connection.execute(text(
+                "SELECT COUNT(DISTINCT a.pid), COALESCE(EXTRACT(EPOCH FROM MAX(now() - a.xact_start)), 0) "
+                "FROM pg_locks l JOIN pg_stat_activity a ON a.pid = l.pid "
+                "WHERE l.relation = CAST(:table AS regclass) AND a.pid <> pg_backend_pid()"
+            ), {"table": table}).first()
+        return int(row[0]), float(row[1])
+
+    # Execution
+
+    def set_lock_timeout(self, connection):
+        """Limit lock waits for the rest of the connection's current transaction"""
+        if self.postgres:
+            connection.execute(text("SELECT set_config('lock_timeout', :timeout, true)"),
+                               {"timeout": self.lock_timeout})
+
+    def execute_ddl(self, statement, connection=None):
+        """Run a statement, retrying when it gives up waiting for its lock.
+
+        Without ``connection`` it runs in its own transaction with the lock
+        timeout. A given connection is in autocommit mode for statements
+        that can't run in a transaction; those wait for their locks.
+        """
+        for attempt in range(1, self.lock_retries + 1):
+            try:
+                if connection is not None:
+                    connection.execute(text(statement))
+                else:
+                    with self.engine.begin() as own:
+                        self.set_lock_timeout(own)
+                        own.execute(text(statement))
+                return
+            except OperationalError as e:
+                if getattr(e.orig, "pgcode", None) != LOCK_NOT_AVAILABLE or attempt == self.lock_retries:
+                    raise
+                self.log(f"  lock not available after {self.lock_timeout}, retrying ({attempt}/{self.lock_retries})")
+                self.sleep(min(2 ** attempt, 30))
+
+    def run(self, target=None):
+        """Apply pending migrations up to ``target``; return the versions applied"""
+        self.ensure_tables()
+        done = []
+        for migration in self.pending(target):
+            self.log(f"→ {migration.version}: {migration.summary}")
+            started = time.monotonic()
+            for index, step in enumerate(migration.steps):
+                outcome = step.apply(self, migration.version, index)
+                self.log(f"  {step.describe()}: {outcome}")
+            with self.engine.begin() as connection:
+                connection.execute(versions_table.insert().values(
+                    version=migration.version, applied_at=datetime.utcnow(),
+                    duration_ms=round((time.monotonic() - started) * 1000),
+                ))
+            done.append(migration.version)
+        return done
+
+    def stamp(self):
+        """Record every migration as applied without running it, for a database
+        db.create_all() has just built with the current schema"""
+        self.ensure_tables()
+        pending = self.pending()
+        if pending:
+            now = datetime.utcnow()
+            with self.engine.begin() as connection:
+                connection.execute(versions_table.insert(), [
+                    {"version": m.version, "applied_at": now, "duration_ms": None} for m in pending
+                ])
+        return [m.version for m in pending]
+
+    def plan(self, target=None):
+        """Describe the pending steps and what they would lock, without changing anything"""
+        lines = []
+        for migration in self.pending(target):
+            lines.append(f"{migration.version}: {migration.summary}")
+            described = set()
+            for step in migration.steps:
+                lines.append(f"  {step.describe()}")
+                lines.append(f"    lock: {step.lock}; {step.impact(self)}")
+                table = getattr(step, "table", None)
+                if table is None or table in described:
+                    continue
+                described.add(table)
+                rows, size = self.table_estimate(table)
+                if rows is not None:
+                    size_text = f", {size / 1048576:.1f} MB" if size is not None else ""
+                    lines.append(f"    {table}: ~{rows} rows{size_text}")
+                waiting, oldest = self.open_transactions(table) if rows is not None else (0, 0)
+                if waiting:
+                    lines.append(f"    would wait behind {waiting} open transaction(s), oldest {oldest:.0f}s")
+        return lines
+
+
+def build_migration_runner(engine, log=print):
+    """Build a MigrationRunner from environment configuration"""
+    return MigrationRunner(
+        engine,
+        lock_timeout=os.getenv("MIGRATION_LOCK_TIMEOUT", "3s"),
+        lock_retries=int(os.getenv("MIGRATION_LOCK_RETRIES", "5")),
+        log=log,
+    )
@@ -0,0 +1,117 @@
+"""
+Wish-quality scoring engine.
+
+Decides how likely a wish is to beat the paw. A wish is tokenized once
+and matched against precompiled indicator sets, so cost doesn't grow with
+the number of indicators and words only match whole (so "all" no longer
+hits "small" and "day" no longer hits "today"). A trailing plural "s"
+is ignored, so "days" still counts as "day".
+
+Weights and clamps can be overridden with environment variables:
+    SCORING_BASE_WIN_CHANCE   base win probability (default 0.30)
+    SCORING_POSITIVE_WEIGHT   bonus per positive indicator (default 0.05)
+    SCORING_NEGATIVE_WEIGHT   penalty per negative indicator (default 0.10)
+    SCORING_BONUS_MIN/MAX     clamp for the quality bonus (default -0.20/0.30)
+    SCORING_CHANCE_MIN/MAX    clamp for the final win chance (default 0.10/0.70)
+"""
+
+import os
+from collections import namedtuple
+
+
+# Positive indicators that increase win chance
+POSITIVE_INDICATORS = (
+    'wisdom', 'strength', 'courage', 'patience', 'gratitude', 'help', 'learn', 'grow',
+    'small', 'little', 'moment', 'today', 'week', 'day', 'hour', 'minute',
+    'genuine', 'sincere', 'humble', 'modest', 'simple', 'peaceful', 'kind', 'good'
+)
+
+# Negative indicators that decrease win chance
+NEGATIVE_INDICATORS = (
+    'infinite', 'eternal', 'forever', 'never', 'all', 'every', 'everything', 'unlimited',
+    'power', 'control', 'wealth', 'money', 'rich', 'famous', 'immortal', 'perfect',
+    'world', 'universe', 'destroy', 'kill', 'death', 'evil', 'curse', 'hate'
+)
+
+# Lower-cased text is split on everything that is not an ASCII letter
+_SEPARATORS = str.maketrans({chr(c): " " for c in range(128) if not chr(c).isalpha()})
+
+WishScore = namedtuple(
+    "WishScore",
+    ["positive_count", "negative_count", "wish_quality_bonus", "win_chance", "positive_hits", "negative_hits"]
+)
+
+
+class WishScorer:
+    """Scores wishes against compiled indicator tables"""
+
+    def __init__(self, positive=POSITIVE_INDICATORS, negative=NEGATIVE_INDICATORS,
+                 base_win_chance=0.30, positive_weight=0.05, negative_weight=0.10,
+                 bonus_min=-0.20, bonus_max=0.30, chance_min=0.10, chance_max=0.70):
+        self.base_win_chance = base_win_chance
+        self.positive_weight = positive_weight
+        self.negative_weight = negative_weight
+        self.bonus_min = bonus_min
+        self.bonus_max = bonus_max
+        self.chance_min = chance_min
+        self.chance_max = chance_max
+        # Compiled once: the indicator sets plus their plural forms, so a wish is
+        # matched with set intersections instead of one substring scan per word
+        self.positive = frozenset(positive)
+        self.negative = frozenset(negative) - self.positive
+        self.positive_plurals = frozenset(word + "s" for word in self.positive) - self.positive - self.negative
+        self.negative_plurals = frozenset(word + "s" for word in self.negative) - self.positive - self.negative
+
+    @classmethod
+    def from_env(cls):
+        def setting(name, default):
+            return float(os.getenv(name, default))
+
+        return cls(
+            base_win_chance=setting("SCORING_BASE_WIN_CHANCE", "0.30"),
+            positive_weight=setting("SCORING_POSITIVE_WEIGHT", "0.05"),
+            negative_weight=setting("SCORING_NEGATIVE_WEIGHT", "0.10"),
+            bonus_min=setting("SCORING_BONUS_MIN", "-0.20"),
+            bonus_max=setting("SCORING_BONUS_MAX", "0.30"),
+            chance_min=setting("SCORING_CHANCE_MIN", "0.10"),
+            chance_max=setting("SCORING_CHANCE_MAX", "0.70"),
+        )
+
+    def indicator_hits(self, wish):
+        """Return the sets of distinct positive and negative indicators in a wish"""
+        tokens = set(wish.lower().translate(_SEPARATORS).split())
+        positive_hits = tokens & self.positive
+        negative_hits = tokens & self.negative
+        plurals = tokens & self.positive_plurals
+        if plurals:
+            positive_hits |= {word[:-1] for word in plurals}
+        plurals = tokens & self.negative_plurals
+        if plurals:
+            negative_hits |= {word[:-1] for word in plurals}
+        return positive_hits, negative_hits
+
+    def score(self, wish):
+        """Score one wish"""
+        positive_hits, negative_hits = self.indicator_hits(wish)
+        positive_count = len(positive_hits)
+        negative_count = len(negative_hits)
+
+        # Bonus for well-crafted wishes (wishes that are specific, positive, and modest)
+        bonus = positive_count * self.positive_weight - negative_count * self.negative_weight
+        if bonus < self.bonus_min:
+            bonus = self.bonus_min
+        elif bonus > self.bonus_max:
+            bonus = self.bonus_max
+
+        # Calculate final win probability
+        win_chance = self.base_win_chance + bonus
+        if win_chance < self.chance_min:
+            win_chance = self.chance_min
+        elif win_chance > self.chance_max:
+            win_chance = self.chance_max
+        return WishScore(positive_count, negative_count, bonus, win_chance, positive_hits, negative_hits)
+
+    def score_many(self, wishes):
+        """Score an iterable of wishes, e.g. for offline re-scoring of wish_history"""
+        score = self.score
+        return [score(wish) for wish in wishes]
@@ -0,0 +1,216 @@
+"""
+Single-flight coalescing for identical in-flight LLM calls.
+
+When several requests need the same upstream call at the same time (a
+trending wish, a double-clicked button), only the first one, the leader,
+makes it; the others wait for its result instead of paying the latency and
+tokens again. Within a process the followers wait on an event. With Redis,
+the leader also takes a short-lived lock key so leaders in other workers
+wait for its result key instead of calling the model themselves. If a
+remote leader disappears without publishing a result, the waiting worker
+makes the call itself.
+
+Results are only shared with requests that overlap the call; nothing is
+kept afterwards (that is the twist cache's job).
+
+Configuration (environment variables):
+    SINGLE_FLIGHT_ENABLED   "0" disables coalescing (default enabled)
+    SINGLE_FLIGHT_WAIT      seconds a follower waits for the leader (default 30)
+    SINGLE_FLIGHT_LOCK_TTL  lifetime of the cross-worker lock in seconds (default 30)
+"""
+
+import hashlib
+import os
+import secrets
+import threading
+import time
+
+
+LOCK_PREFIX = "monkeypaw:flight:lock:"
+RESULT_PREFIX = "monkeypaw:flight:result:"
+
+# Delete the lock only if this worker still owns it
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def flight_key(*parts):
+    """Stable key for an upstream call built from its normalized inputs"""
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+
+class FlightAbandoned(Exception):
+    """The leader went away without a result; waiting callers should try again"""
+
+
+class Flight:
+    """One in-flight upstream call that duplicate requests can wait on"""
+
+    def __init__(self, key):
+        self.key = key
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+        self.lock_token = None
+
+    def wait(self, timeout):
+        if not self.event.wait(timeout):
+            raise TimeoutError(f"shared call did not finish within {timeout:.0f}s")
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one.
+
+    ``do(key, fn)`` covers the common case. Callers that produce their result
+    incrementally (streaming) use ``lead_or_wait`` and, when they lead, must
+    pass the flight to ``finish`` with the value or error, or to ``abandon``
+    if they stop before having either.
+    """
+
+    def __init__(self, redis_client=None, wait_timeout=30.0, lock_ttl=30.0, result_ttl=10.0,
+                 poll_interval=0.05, sleep=time.sleep):
+        self.redis = redis_client
+        self.wait_timeout = wait_timeout
+        self.lock_ttl = lock_ttl
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+        self.sleep = sleep
+        self.flights = {}
+        self.lock = threading.Lock()
+        self._release = redis_client.register_script(_RELEASE_SCRIPT) if redis_client is not None else None
+        self.counters = {
+            "leaders": 0,
+            "coalesced": 0,
+            "coalesced_remote": 0,
+            "remote_takeovers": 0,
+            "shared_errors": 0,
+            "abandoned": 0,
+        }
+
+    def do(self, key, fn):
+        """Return fn()'s result, sharing one call among concurrent callers with the same key"""
+        flight, value = self.lead_or_wait(key)
+        if flight is None:
+            return value
+        try:
+            value = fn()
+        except Exception as e:
+            self.finish(flight, error=e)
+            raise
+        self.finish(flight, value=value)
+        return value
+
+    def lead_or_wait(self, key):
+        """Return (flight, None) if the caller should make the call, else (None, shared result)"""
+        while True:
+            flight, leader = self.begin(key)
+            if leader:
+                return flight, None
+            try:
+                return None, flight.wait(self.wait_timeout)
+            except FlightAbandoned:
+                continue
+
+    def begin(self, key):
+        """Return (flight, leader). Followers call flight.wait(); the leader must call finish()"""
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is not None:
+                self.counters["coalesced"] += 1
+                return flight, False
+            flight = self.flights[key] = Flight(key)
+
+        if self.redis is not None:
+            token = secrets.token_hex(8)
+            try:
+                acquired = self.redis.set(LOCK_PREFIX + key, token, nx=True, px=int(self.lock_ttl * 1000))
+            except Exception:
+                acquired = True  # Redis trouble: just make the call
+                token = None
+            if acquired:
+                flight.lock_token = token
+            else:
+                value = self._wait_remote(key)
+                if value is not None:
+                    # Local followers that joined meanwhile get the remote result too
+                    self.counters["coalesced_remote"] += 1
+                    self._complete(flight, value=value)
+                    return flight, False
+                self.counters["remote_takeovers"] += 1
+
+        self.counters["leaders"] += 1
+        return flight, True
+
+    def finish(self, flight, value=None, error=None):
+        """Publish the leader's result (or error) to everyone waiting on the flight"""
+        if flight.lock_token is not None:
+            try:
+                if error is None:
+                    self.redis.set(RESULT_PREFIX + flight.key, value, px=int(self.result_ttl * 1000))
+                self._release(keys=[LOCK_PREFIX + flight.key], args=[flight.lock_token])
+            except Exception:
+                pass
+        if error is not None:
+            self.counters["shared_errors"] += 1
+        self._complete(flight, value=value, error=error)
+
+    def abandon(self, flight):
+        """Give up leading without a result; a waiting caller takes over the call"""
+        if flight.lock_token is not None:
+            try:
+                self._release(keys=[LOCK_PREFIX + flight.key], args=[flight.lock_token])
+            except Exception:
+                pass
+        self.counters["abandoned"] += 1
+        self._complete(flight, error=FlightAbandoned())
+
+    def _complete(self, flight, value=None, error=None):
+        with self.lock:
+            if self.flights.get(flight.key) is flight:
+                del self.flights[flight.key]
+        flight.value = value
+        flight.error = error
+        flight.event.set()
+
+    def _wait_remote(self, key):
+        """Poll for another worker's result; None if its lock goes away without one"""
+        deadline = time.monotonic() + self.wait_timeout
+        try:
+            while time.monotonic() < deadline:
+                pipe = self.redis.pipeline()
+                pipe.get(RESULT_PREFIX + key)
+                pipe.exists(LOCK_PREFIX + key)
+                result, locked = pipe.execute()
+                if result is not None:
+                    return result.decode("utf-8") if isinstance(result, bytes) else result
+                if not locked:
+                    return None
+                self.sleep(self.poll_interval)
+        except Exception:
+            return None
+        return None
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats["in_flight"] = len(self.flights)
+        return stats
+
+
+def single_flight_enabled():
+    return os.getenv("SINGLE_FLIGHT_ENABLED", "1") != "0"
+
+
+def build_single_flight(redis_client=None):
+    """Build a SingleFlight from environment configuration, shared across workers if Redis is given"""
+    return SingleFlight(
+        redis_client=redis_client,
+        wait_timeout=float(os.getenv("SINGLE_FLIGHT_WAIT", "30")),
+        lock_ttl=float(os.getenv("SINGLE_FLIGHT_LOCK_TTL", "30")),
+    )
@@ -10,6 +10,11 @@ function getHeaders() {
   };
 }
 
+// Fingerprinted URLs from the asset build, written into the page by the template
+function assetUrl(path) {
+  return (window.ASSET_URLS && window.ASSET_URLS[path]) || `/static/${path}`;
+}
+
 // Username/session/leaderboard logic
 window.addEventListener('DOMContentLoaded', () => {
   const usernameSection = document.getElementById('usernameSection');
@@ -25,32 +30,90 @@ window.addEventListener('DOMContentLoaded', () => {
     gameSection.style.display = '';
   }
 
-  // Fetch and display leaderboard
-  async function fetchLeaderboard() {
-    try {
-      const res = await fetch('/leaderboard');
-      const data = await res.json();
-      const leaderboardBody = document.getElementById('leaderboardBody');
-      leaderboardBody.innerHTML = '';
-      
-      data.forEach(([user, score, avoidedTwists, streak], idx) => {
-        const row = document.createElement('tr');
-        row.innerHTML = `
+  // Leaderboard: pushed over Server-Sent Events, with conditional GETs as the fallback
+  let leaderboardRows = [];
+  let leaderboardVersion = null;
+  let leaderboardPolling = null;
+
+  function renderLeaderboard() {
+    const leaderboardBody = document.getElementById('leaderboardBody');
+    if (!leaderboardBody) return;
+    leaderboardBody.innerHTML = '';
+    leaderboardRows.forEach(([user, score, avoidedTwists, streak], idx) => {
+      const row = document.createElement('tr');
+      row.innerHTML = `
           <td>${idx + 1}</td>
           <td>${user}</td>
           <td>${score}</td>
           <td>${avoidedTwists}</td>
           <td>${streak}</td>
         `;
-        leaderboardBody.appendChild(row);
-      });
+      leaderboardBody.appendChild(row);
+    });
+  }
+
+  async function fetchLeaderboard() {
+    try {
+      // The browser revalidates with the stored ETag, so an unchanged board is a 304
+      const res = await fetch('/leaderboard');
+      leaderboardRows = await res.json();
+      renderLeaderboard();
     } catch (e) {
       const leaderboardBody = document.getElementById('leaderboardBody');
       leaderboardBody.innerHTML = '<tr><td colspan="4" style="text-align: center; color: #ff6b6b;">Could not load leaderboard.</td></tr>';
     }
   }
-  fetchLeaderboard();
-  
+
+  function pollLeaderboard() {
+    window.leaderboardLive = false;
+    fetchLeaderboard();
+    if (!leaderboardPolling) {
+      leaderboardPolling = setInterval(() => {
+        if (document.visibilityState === 'visible') fetchLeaderboard();
+      }, 60000);
+    }
+  }
+
+  function subscribeLeaderboard() {
+    if (!window.EventSource) {
+      pollLeaderboard();
+      return;
+    }
+    const source = new EventSource('/leaderboard/stream');
+    let failures = 0;
+    source.addEventListener('board', (event) => {
+      const board = JSON.parse(event.data);
+      leaderboardRows = board.rows;
+      leaderboardVersion = board.version;
+      failures = 0;
+      window.leaderboardLive = true;
+      renderLeaderboard();
+    });
+    source.addEventListener('diff', (event) => {
+      const diff = JSON.parse(event.data);
+      if (diff.base !== leaderboardVersion) {
+        // Missed an update: reconnect for the whole board
+        source.close();
+        subscribeLeaderboard();
+        return;
+      }
+      diff.changes.forEach(([index, row]) => { leaderboardRows[index] = row; });
+      leaderboardRows.length = diff.size;
+      leaderboardVersion = diff.version;
+      renderLeaderboard();
+    });
+    source.onerror = () => {
+      // EventSource reconnects by itself; give up if the server refuses the stream or keeps failing
+      failures += 1;
+      if (source.readyState === EventSource.CLOSED || failures >= 3) {
+        source.close();
+        pollLeaderboard();
+      }
+    };
+  }
+
+  if (leaderboardBody) subscribeLeaderboard();
+
   // Make fetchLeaderboard globally accessible
   window.fetchLeaderboard = fetchLeaderboard;
 
@@ -222,14 +285,49 @@ function showFallbackSuggestions() {
   });
 }
 
+// Read a text/event-stream response and call onEvent(event, data) for each event
+async function readEventStream(response, onEvent) {
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const rawEvent = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      let eventName = 'message';
+      let dataLines = [];
+      rawEvent.split('\n').forEach(line => {
+        if (line.startsWith('event:')) eventName = line.slice(6).trim();
+        else if (line.startsWith('data:')) dataLines.push(line.slice(5).trim());
+      });
+      if (dataLines.length) onEvent(eventName, JSON.parse(dataLines.join('\n')));
+    }
+  }
+}
+
+// Idempotency key of the wish currently being made. Double-clicks and retries
+// of the same wish reuse it, so the server only counts the wish once.
+let pendingWish = null;
+
+function newIdempotencyKey() {
+  if (window.crypto && crypto.randomUUID) {
+    return crypto.randomUUID();
+  }
+  return Date.now().toString(36) + Math.random().toString(36).slice(2);
+}
+
 async function makeWish() {
   const wish = document.getElementById('wishInput').value;
+  if (!pendingWish || pendingWish.wish !== wish) {
+    pendingWish = { wish, key: newIdempotencyKey() };
+  }
+  const wishAttempt = pendingWish;
   const resultDiv = document.getElementById('twistResult');
-  const streakDiv = document.getElementById('streakDisplay');
-  const wishesCountSpan = document.getElementById('wishesCount');
-  const avoidedTwistsCountSpan = document.getElementById('avoidedTwistsCount');
   const winMsgDiv = document.getElementById('winMessage');
-  const pawImg = document.getElementById('pawImage');
   const gameOverDiv = document.getElementById('gameOverMsg');
   const userOutcomeBox = document.getElementById('userOutcomeBox');
   resultDiv.innerHTML = 'Summoning the cursed paw...';
@@ -239,77 +337,118 @@ async function makeWish() {
   userOutcomeBox.textContent = '';
 
   try {
+    const headers = getHeaders();
+    headers['Accept'] = 'text/event-stream';
+    headers['Idempotency-Key'] = wishAttempt.key;
     const response = await fetch('/wish', {
       method: 'POST',
-      headers: getHeaders(),
-      body: JSON.stringify({ wish }),
+      headers: headers,
+      body: JSON.stringify({ wish, stream: true }),
     });
-
-    const text = await response.text();
-    console.log('Raw response:', text);
-    let data;
-    try {
-      data = JSON.parse(text);
-    } catch (e) {
-      console.error('JSON parse error:', e);
-      resultDiv.innerHTML = "<span style='color:crimson;'>Server returned invalid JSON.</span>";
-      return;
+    // The server answered, so a new click is a new wish
+    if (pendingWish === wishAttempt) {
+      pendingWish = null;
     }
 
-    if (typeof data.streak !== 'undefined') {
-      streakDiv.childNodes[0].textContent = `🔥 Current Streak: ${data.streak} `;
-    }
-    if (typeof data.wishes_made !== 'undefined' && wishesCountSpan) {
-      wishesCountSpan.textContent = `✨ Wishes Made: ${data.wishes_made}`;
-    }
-    if (typeof data.avoided_twists !== 'undefined' && avoidedTwistsCountSpan) {
-      avoidedTwistsCountSpan.textContent = `🛡️ Avoided Twists: ${data.avoided_twists}`;
-    }
-    if (typeof data.failed_wishes !== 'undefined') {
-      let fails = Math.max(0, Math.min(5, data.failed_wishes));
-      if (pawImg) pawImg.src = `/static/images/paw_${fails}.png`;
-    }
-    if (data.game_over) {
-      gameOverDiv.innerHTML = '☠️ The paw has claimed your soul.';
-      streakDiv.childNodes[0].textContent = '🔥 Current Streak: 0 ';
-      if (wishesCountSpan) wishesCountSpan.textContent = '✨ Wishes Made: 0';
-      if (avoidedTwistsCountSpan) avoidedTwistsCountSpan.textContent = '🛡️ Avoided Twists: 0';
-      if (pawImg) pawImg.src = '/static/images/paw_0.png';
-      resultDiv.innerHTML = `<strong>💀 Twisted!</strong><br/><em>${data.twist}</em>`;
-      winMsgDiv.innerHTML = '';
-      userOutcomeBox.style.display = 'none';
-      userOutcomeBox.textContent = '';
-      // Refresh leaderboard after game over
-      if (window.fetchLeaderboard) window.fetchLeaderboard();
+    const contentType = response.headers.get('Content-Type') || '';
+    if (!contentType.startsWith('text/event-stream')) {
+      // Validation and session errors still come back as plain JSON
+      const text = await response.text();
+      let data;
+      try {
+        data = JSON.parse(text);
+      } catch (e) {
+        console.error('JSON parse error:', e);
+        resultDiv.innerHTML = "<span style='color:crimson;'>Server returned invalid JSON.</span>";
+        return;
+      }
+      renderWishResult(data);
       return;
     }
-    if (data.result === "win") {
-      resultDiv.innerHTML = `<strong>🎉 You win!</strong><br/><em>${data.twist}</em>`;
-      winMsgDiv.innerHTML = `🎉 You survived the paw! Streak: ${data.streak}`;
-    } else if (data.result === "lose") {
-      resultDiv.innerHTML = `<strong>💀 Twisted!</strong><br/><em>${data.twist}</em>`;
-      winMsgDiv.innerHTML = '';
-    } else {
-      resultDiv.innerHTML = `<span style='color:crimson;'>Error: ${data.error}</span>`;
-      winMsgDiv.innerHTML = '';
-    }
 
-    // After displaying the twist, extract and show user outcome
-    let outcomeMatch = /User outcome: (WIN|LOSE)/i.exec(data.twist);
-    if (outcomeMatch) {
-      const outcome = outcomeMatch[1].toUpperCase();
-      userOutcomeBox.style.display = '';
-      userOutcomeBox.textContent = outcome === 'WIN' ? 'You WIN!' : 'You LOSE!';
-      userOutcomeBox.style.background = outcome === 'WIN' ? '#1fa672' : '#b91c1c';
-      userOutcomeBox.style.color = '#fff';
-      userOutcomeBox.style.border = outcome === 'WIN' ? '2px solid #1fa672' : '2px solid #b91c1c';
-    } else {
-      userOutcomeBox.style.display = 'none';
-      userOutcomeBox.textContent = '';
-    }
+    // Render the twist progressively as it arrives
+    let streamedTwist = '';
+    let twistEl = null;
+    await readEventStream(response, (event, data) => {
+      if (event === 'twist') {
+        if (!twistEl) {
+          resultDiv.innerHTML = '';
+          twistEl = document.createElement('em');
+          twistEl.style.whiteSpace = 'pre-wrap';
+          resultDiv.appendChild(twistEl);
+        }
+        streamedTwist += data.delta;
+        twistEl.textContent = streamedTwist;
+      } else if (event === 'result' || event === 'error') {
+        renderWishResult(data);
+      }
+    });
   } catch (err) {
     resultDiv.innerHTML = `<span style='color:crimson;'>Failed to connect to the server.</span>`;
     winMsgDiv.innerHTML = '';
     gameOverDiv.innerHTML = '';
   }
+}
+
+function renderWishResult(data) {
+  const resultDiv = document.getElementById('twistResult');
+  const streakDiv = document.getElementById('streakDisplay');
+  const wishesCountSpan = document.getElementById('wishesCount');
+  const avoidedTwistsCountSpan = document.getElementById('avoidedTwistsCount');
+  const winMsgDiv = document.getElementById('winMessage');
+  const pawImg = document.getElementById('pawImage');
+  const gameOverDiv = document.getElementById('gameOverMsg');
+  const userOutcomeBox = document.getElementById('userOutcomeBox');
+
+  if (typeof data.streak !== 'undefined') {
+    streakDiv.childNodes[0].textContent = `🔥 Current Streak: ${data.streak} `;
+  }
+  if (typeof data.wishes_made !== 'undefined' && wishesCountSpan) {
+    wishesCountSpan.textContent = `✨ Wishes Made: ${data.wishes_made}`;
+  }
+  if (typeof data.avoided_twists !== 'undefined' && avoidedTwistsCountSpan) {
+    avoidedTwistsCountSpan.textContent = `🛡️ Avoided Twists: ${data.avoided_twists}`;
+  }
+  if (typeof data.failed_wishes !== 'undefined') {
+    let fails = Math.max(0, Math.min(5, data.failed_wishes));
+    if (pawImg) pawImg.src = assetUrl(`images/paw_${fails}.png`);
+  }
+  if (data.game_over) {
+    gameOverDiv.innerHTML = '☠️ The paw has claimed your soul.';
+    streakDiv.childNodes[0].textContent = '🔥 Current Streak: 0 ';
+    if (wishesCountSpan) wishesCountSpan.textContent = '✨ Wishes Made: 0';
+    if (avoidedTwistsCountSpan) avoidedTwistsCountSpan.textContent = '🛡️ Avoided Twists: 0';
+    if (pawImg) pawImg.src = assetUrl('images/paw_0.png');
+    resultDiv.innerHTML = `<strong>💀 Twisted!</strong><br/><em>${data.twist}</em>`;
+    winMsgDiv.innerHTML = '';
+    userOutcomeBox.style.display = 'none';
+    userOutcomeBox.textContent = '';
+    // Refresh leaderboard after game over, unless updates are being pushed
+    if (window.fetchLeaderboard && !window.leaderboardLive) window.fetchLeaderboard();
+    return;
+  }
+  if (data.result === "win") {
+    resultDiv.innerHTML = `<strong>🎉 You win!</strong><br/><em>${data.twist}</em>`;
+    winMsgDiv.innerHTML = `🎉 You survived the paw! Streak: ${data.streak}`;
+  } else if (data.result === "lose") {
+    resultDiv.innerHTML = `<strong>💀 Twisted!</strong><br/><em>${data.twist}</em>`;
+    winMsgDiv.innerHTML = '';
+  } else {
+    resultDiv.innerHTML = `<span style='color:crimson;'>Error: ${data.error}</span>`;
+    winMsgDiv.innerHTML = '';
+  }
+
+  // After displaying the twist, extract and show user outcome
+  let outcomeMatch = /User outcome: (WIN|LOSE)/i.exec(data.twist);
+  if (outcomeMatch) {
+    const outcome = outcomeMatch[1].toUpperCase();
+    userOutcomeBox.style.display = '';
+    userOutcomeBox.textContent = outcome === 'WIN' ? 'You WIN!' : 'You LOSE!';
+    userOutcomeBox.style.background = outcome === 'WIN' ? '#1fa672' : '#b91c1c';
+    userOutcomeBox.style.color = '#fff';
+    userOutcomeBox.style.border = outcome === 'WIN' ? '2px solid #1fa672' : '2px solid #b91c1c';
+  } else {
+    userOutcomeBox.style.display = 'none';
+    userOutcomeBox.textContent = '';
+  }
 } 
\ No newline at end of file
@@ -0,0 +1,244 @@
+"""
+Fingerprinted, precompressed static assets.
+
+``build_assets.py`` copies static/ into the build directory with a content
+hash in every file name (``style.css`` -> ``style.3f9a1c0b2e.css``), writes
+gzip and, with the brotli package installed, brotli variants of text
+assets, and with Pillow installed shrinks images to the size they are shown
+at and adds WebP versions. ``manifest.json`` maps each source path to its
+built name.
+
+Templates link assets through ``asset_url()``, which returns the
+fingerprinted URL when a build exists and the plain /static/ URL
+otherwise, so development works without a build. Fingerprinted files
+never change, so they are served with a one-year ``immutable`` cache
+lifetime and the browser does not ask for them again. The app serves the
+precompressed body the client accepts from disk without compressing
+anything per request. With ASSET_URL_PREFIX pointing at a CDN in front of
+the app, each file reaches a worker about once per CDN edge.
+
+Configuration (environment variables):
+    ASSET_DIR          build directory (default static/dist)
+    ASSET_URL_PREFIX   origin to load fingerprinted assets from, e.g. a CDN
+                       (default: served by the app under /assets/)
+"""
+
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
+import os
+import re
+
+from flask import abort, send_file, url_for
+
+
+MANIFEST = "manifest.json"
+MAX_AGE = 365 * 24 * 3600
+
+COMPRESSIBLE = {".css", ".js", ".svg", ".json", ".txt", ".html", ".map"}
+IMAGES = {".png", ".jpg", ".jpeg"}
+
+# Images are scaled down to twice the largest size the pages show them at
+IMAGE_WIDTHS = {
+    "images/spellbook.png": 100,
+}
+
+# Content-Encoding -> file suffix, in order of preference
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+CSS_URL = re.compile(r"url\(\s*(['\"]?)(?!data:|https?:|//)([^'\")]+)\1\s*\)")
+
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+
+
+def asset_dir():
+    return os.getenv("ASSET_DIR", os.path.join(STATIC_DIR, "dist"))
+
+
+def fingerprint(path, data):
+    """``images/paw.png`` -> ``images/paw.<hash>.png``"""
+    stem, extension = os.path.splitext(path)
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:10]}{extension}"
+
+
+def _brotli():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def _pil_image():
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    return Image
+
+
+# Build
+
+class AssetBuilder:
+    """Writes fingerprinted and compressed copies of a static directory"""
+
+    def __init__(self, source, output):
+        self.source = source
+        self.output = output
+        self.brotli = _brotli()
+        self.pil = _pil_image()
+        self.manifest = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.skipped = []
+
+    def sources(self):
+        """Relative paths of the source files: images first, so stylesheets can refer to them"""
+        output = os.path.abspath(self.output)
+        paths = []
+        for directory, dirs, files in os.walk(self.source):
+            dirs[:] = [d for d in dirs if os.path.abspath(os.path.join(directory, d)) != output]
+            for name in files:
+                if not name.startswith("."):
+                    paths.append(os.path.relpath(os.path.join(directory, name), self.source).replace(os.sep, "/"))
+        return sorted(paths, key=lambda path: (os.path.splitext(path)[1] not in IMAGES, path))
+
+    def build(self):
+        """Build every asset and write the manifest; return the manifest"""
+        if self.brotli is None:
+            self.skipped.append("brotli variants (pip install brotli)")
+        if self.pil is None:
+            self.skipped.append("image resizing and WebP (pip install Pillow)")
+        for path in self.sources():
+            with open(os.path.join(self.source, path), "rb") as f:
+                data = f.read()
+            self.bytes_in += len(data)
+            extension = os.path.splitext(path)[1].lower()
+            if extension in IMAGES and self.pil is not None:
+                self.add_image(path, data)
+            elif extension == ".css":
+                self.add(path, self.rewrite_css(path, data))
+            else:
+                self.add(path, data)
+        self._write(MANIFEST, json.dumps(self.manifest, indent=2, sort_keys=True).encode("utf-8"))
+        return self.manifest
+
+    def add(self, path, data):
+        built = fingerprint(path, data)
+        self._write(built, data)
+        self.bytes_out += len(data)
+        if os.path.splitext(path)[1].lower() in COMPRESSIBLE:
+            # mtime=0 keeps the .gz identical between builds of the same file
+            variants = [(".gz", gzip.compress(data, compresslevel=9, mtime=0))]
+            if self.brotli is not None:
+                variants.append((".br", self.brotli.compress(data, quality=11)))
+            for suffix, compressed in variants:
+                if len(compressed) < len(data):
+                    self._write(built + suffix, compressed)
+        self.manifest[path] = built
+        return built
+
+    def add_image(self, path, data):
+        image = self.pil.open(io.BytesIO(data))
+        fmt = image.format
+        width = IMAGE_WIDTHS.get(path)
+        if width and image.width > width:
+            image = image.resize((width, round(image.height * width / image.width)), self.pil.LANCZOS)
+            data = self._encode(image, fmt)
+        self.add(path, data)
+        webp = self._encode(image, "WEBP")
+        if len(webp) < len(data):
+            self.add(os.path.splitext(path)[0] + ".webp", webp)
+
+    def _encode(self, image, fmt):
+        buffer = io.BytesIO()
+        if fmt == "WEBP":
+            image.save(buffer, "WEBP", quality=80, method=6)
+        else:
+            image.save(buffer, fmt, optimize=True)
+        return buffer.getvalue()
+
+    def rewrite_css(self, path, data):
+        """Point url() references at the fingerprinted files"""
+        directory = os.path.dirname(path)
+
+        def replace(match):
+            target = os.path.normpath(os.path.join(directory, match.group(2))).replace(os.sep, "/")
+            built = self.manifest.get(target)
+            if built is None:
+                return match.group(0)
+            return f"url({os.path.relpath(built, directory or '.').replace(os.sep, '/')})"
+
+        return CSS_URL.sub(replace, data.decode("utf-8")).encode("utf-8")
+
+    def _write(self, path, data):
+        target = os.path.join(self.output, path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp_path = target + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, target)
+
+
+# Serving
+
+class AssetManifest:
+    """Built asset names and the precompressed variants that exist for them"""
+
+    def __init__(self, root, url_prefix=""):
+        self.root = root
+        self.url_prefix = url_prefix.rstrip("/")
+        self.files = {}
+        path = os.path.join(root, MANIFEST)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.files = json.load(f)
+        self.built = set(self.files.values())
+        self.variants = {
+            built: [(encoding, suffix) for encoding, suffix in ENCODINGS
+                    if os.path.exists(os.path.join(root, built + suffix))]
+            for built in self.built
+        }
+
+    def url(self, path):
+        """URL of a static file: fingerprinted if built, plain /static/ otherwise"""
+        built = self.files.get(path)
+        if built is None:
+            return url_for("static", filename=path)
+        if self.url_prefix:
+            return f"{self.url_prefix}/assets/{built}"
+        return url_for("main.asset", filename=built)
+
+    def webp_url(self, path):
+        """URL of the WebP version of an image, or None if the build made none"""
+        webp = os.path.splitext(path)[0] + ".webp"
+        return self.url(webp) if webp in self.files else None
+
+    def urls(self, prefix):
+        """Built URLs of every asset under a directory, for scripts that pick images at runtime"""
+        return {path: self.url(path) for path in self.files if path.startswith(prefix)}
+
+    def response(self, filename, accept_encodings):
+        """Serve a built file, precompressed if the client accepts it (``request.accept_encodings``)"""
+        if filename not in self.built:
+            abort(404)
+        mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        encoding, suffix = next(
+            ((encoding, suffix) for encoding, suffix in self.variants[filename] if encoding in accept_encodings),
+            (None, ""),
+        )
+        response = send_file(os.path.join(os.path.abspath(self.root), filename + suffix),
+                             mimetype=mimetype, max_age=MAX_AGE, conditional=True, etag=True)
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        if self.variants[filename]:
+            response.headers["Vary"] = "Accept-Encoding"
+        response.headers["Cache-Control"] = f"public, max-age={MAX_AGE}, immutable"
+        return response
+
+
+def load_asset_manifest(root=None):
+    return AssetManifest(root or asset_dir(), os.getenv("ASSET_URL_PREFIX", ""))
@@ -0,0 +1,181 @@
+"""
+Incremental statistics rollups for /stats.
+
+Every stored wish adds to a handful of small counter tables instead of the
+stats being computed from wish_history at request time:
+
+    user_stats       lifetime totals per player
+    session_stats    totals per player per game (for the best game)
+    daily_stats      totals per day, spread over STATS_SHARDS rows
+    indicator_stats  indicator word hits per player
+    daily_indicator_stats  indicator word hits per day, sharded like daily_stats
+
+Increments are aggregated in Python first (``RollupBatch``) and written with
+one multi-row ``INSERT ... ON CONFLICT DO UPDATE`` per table, in the same
+transaction as the history rows they come from. A single wish, a
+write-behind batch and the backfill all go through the same path. Global
+rows are sharded by player so concurrent wishes don't all queue on one
+row lock per day; readers sum the shards. Rows are written in key order
+so concurrent batches lock them in the same order.
+
+Configuration (environment variables):
+    STATS_ENABLED         "0" stops updating the rollups (default on)
+    STATS_SHARDS          rows per day for the global counters (default 8)
+    STATS_CACHE_SECONDS   how long /stats/global is cached per worker (default 30)
+"""
+
+import os
+import zlib
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import func
+from sqlalchemy.dialects import postgresql, sqlite
+
+
+COUNTERS = ("wishes", "wins", "losses", "quality_bonus_sum", "positive_hits", "negative_hits")
+
+
+def stats_enabled():
+    return os.getenv("STATS_ENABLED", "1") != "0"
+
+
+def stats_shards():
+    return max(1, int(os.getenv("STATS_SHARDS", "8")))
+
+
+def shard_for(username, shards):
+    """Stable shard of a player's global counter rows"""
+    return zlib.crc32(username.encode("utf-8")) % shards
+
+
+def _new_totals():
+    # Every counter is present, so the rows of a multi-row INSERT share their columns
+    return Counter({name: 0 for name in COUNTERS})
+
+
+def _totals(counter, won, bonus, positive, negative):
+    counter["wishes"] += 1
+    counter["wins" if won else "losses"] += 1
+    counter["quality_bonus_sum"] += bonus
+    counter["positive_hits"] += positive
+    counter["negative_hits"] += negative
+
+
+class RollupBatch:
+    """Aggregated rollup increments for a batch of history rows"""
+
+    def __init__(self, scorer, shards=8):
+        self.scorer = scorer
+        self.shards = shards
+        self.users = {}
+        self.sessions = {}
+        self.days = {}
+        self.words = Counter()
+        self.day_words = Counter()
+        self.kinds = {}
+        self.first_seen = {}
+        self.last_seen = {}
+
+    def add(self, row):
+        """Add one history row (a dict with wish_history's columns)"""
+        username = row["username"]
+        timestamp = row.get("timestamp") or datetime.utcnow()
+        won = row["outcome"] == "win"
+        bonus = row.get("wish_quality_bonus") or 0.0
+        # Word hits come from the scorer so the per-word and total counts agree
+        positive_words, negative_words = self.scorer.indicator_hits(row["wish_text"])
+
+        _totals(self.users.setdefault(username, _new_totals()), won, bonus,
+                len(positive_words), len(negative_words))
+        session_key = (username, row["session_number"])
+        _totals(self.sessions.setdefault(session_key, _new_totals()), won, bonus,
+                len(positive_words), len(negative_words))
+        day_key = (timestamp.date(), shard_for(username, self.shards))
+        _totals(self.days.setdefault(day_key, _new_totals()), won, bonus,
+                len(positive_words), len(negative_words))
+
+        for kind, words in (("positive", positive_words), ("negative", negative_words)):
+            for word in words:
+                self.kinds[word] = kind
+                self.words[(username, word)] += 1
+                self.day_words[(day_key[0], day_key[1], word)] += 1
+
+        for key in (username, session_key):
+            if key not in self.first_seen or timestamp < self.first_seen[key]:
+                self.first_seen[key] = timestamp
+            if key not in self.last_seen or timestamp > self.last_seen[key]:
+                self.last_seen[key] = timestamp
+
+    def __len__(self):
+        return sum(counter["wishes"] for counter in self.users.values())
+
+    def user_rows(self):
+        return [
+            dict(username=username, first_wish_at=self.first_seen[username],
+                 last_wish_at=self.last_seen[username], **counter)
+            for username, counter in sorted(self.users.items())
+        ]
+
+    def session_rows(self):
+        return [
+            dict(username=key[0], session_number=key[1], started_at=self.first_seen[key],
+                 ended_at=self.last_seen[key], **counter)
+            for key, counter in sorted(self.sessions.items())
+        ]
+
+    def day_rows(self):
+        return [dict(day=key[0], shard=key[1], **counter) for key, counter in sorted(self.days.items())]
+
+    def word_rows(self):
+        return [
+            dict(username=username, word=word, kind=self.kinds[word], hits=hits)
+            for (username, word), hits in sorted(self.words.items())
+        ]
+
+    def day_word_rows(self):
+        return [
+            dict(day=day, shard=shard, word=word, kind=self.kinds[word], hits=hits)
+            for (day, shard, word), hits in sorted(self.day_words.items())
+        ]
+
+
+def upsert(connection, table, rows, keys, add=(), least=(), greatest=()):
+    """Insert rows or add them onto existing ones, in one statement (Postgres or SQLite)"""
+    if not rows:
+        return
+    dialect = connection.dialect.name
+    if dialect == "postgresql":
+        statement = postgresql.insert(table).values(rows)
+        smaller, larger = func.least, func.greatest
+    elif dialect == "sqlite":
+        statement = sqlite.insert(table).values(rows)
+        smaller, larger = func.min, func.max
+    else:
+        raise NotImplementedError(f"stats rollups need Postgres or SQLite, not {dialect}")
+    excluded = statement.excluded
+    updates = {column: table.c[column] + excluded[column] for column in add}
+    updates.update({column: smaller(table.c[column], excluded[column]) for column in least})
+    updates.update({column: larger(table.c[column], excluded[column]) for column in greatest})
+    connection.execute(statement.on_conflict_do_update(index_elements=list(keys), set_=updates))
+
+
+def write_rollups(connection, batch, tables):
+    """Apply a RollupBatch to the rollup tables inside the caller's transaction"""
+    upsert(connection, tables["user_stats"], batch.user_rows(), ["username"],
+           add=COUNTERS, least=["first_wish_at"], greatest=["last_wish_at"])
+    upsert(connection, tables["session_stats"], batch.session_rows(), ["username", "session_number"],
+           add=COUNTERS, least=["started_at"], greatest=["ended_at"])
+    upsert(connection, tables["daily_stats"], batch.day_rows(), ["day", "shard"], add=COUNTERS)
+    upsert(connection, tables["indicator_stats"], batch.word_rows(), ["username", "word"], add=["hits"])
+    upsert(connection, tables["daily_indicator_stats"], batch.day_word_rows(), ["day", "shard", "word"],
+           add=["hits"])
+
+
+def rates(totals):
+    """Derived figures for a dict of counter totals"""
+    wishes = totals.get("wishes") or 0
+    return {
+        "win_rate": round(totals.get("wins", 0) / wishes, 4) if wishes else None,
+        "avg_quality_bonus": round(totals.get("quality_bonus_sum", 0.0) / wishes, 4) if wishes else None,
+    }
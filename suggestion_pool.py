@@ -0,0 +1,201 @@
+"""
+Pre-generated spellbook suggestion pool.
+
+The spellbook prompt never depends on the player, so suggestions are
+generated ahead of time by a background refill worker and served from a
+pool. Redis is used when available so every worker shares one pool;
+otherwise each process keeps its own in-memory pool.
+
+Configuration (environment variables):
+    SUGGESTION_POOL_ENABLED    "0" disables the pool (default enabled)
+    SUGGESTION_POOL_LOW_WATER  refill when fewer suggestions remain (default 30)
+    SUGGESTION_POOL_TARGET     refill up to this many suggestions (default 90)
+    SUGGESTION_POOL_BATCH      suggestions requested per LLM call (default 10)
+"""
+
+import logging
+import os
+import secrets
+import threading
+import time
+from collections import deque
+
+
+logger = logging.getLogger(__name__)
+
+POOL_KEY = "monkeypaw:suggestion_pool"
+REFILL_LOCK_KEY = "monkeypaw:suggestion_pool:refill_lock"
+
+# Delete the refill lock only if this worker still owns it
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class MemorySuggestionStore:
+    """Per-process suggestion store backed by a deque"""
+
+    def __init__(self):
+        self.items = deque()
+        self.lock = threading.Lock()
+
+    def pop(self, count):
+        with self.lock:
+            return [self.items.popleft() for _ in range(min(count, len(self.items)))]
+
+    def push(self, suggestions):
+        with self.lock:
+            self.items.extend(suggestions)
+
+    def size(self):
+        return len(self.items)
+
+    def acquire_refill_lock(self, ttl):
+        return "local"
+
+    def release_refill_lock(self, token):
+        pass
+
+
+class RedisSuggestionStore:
+    """Suggestion store shared by all workers through a Redis list"""
+
+    def __init__(self, redis_client):
+        self.redis = redis_client
+        self._release = redis_client.register_script(_RELEASE_SCRIPT)
+
+    def pop(self, count):
+        # LPOP with a count is O(count) and atomic across workers
+        items = self.redis.lpop(POOL_KEY, count) or []
+        return [item.decode() if isinstance(item, bytes) else item for item in items]
+
+    def push(self, suggestions):
+        if suggestions:
+            self.redis.rpush(POOL_KEY, *suggestions)
+
+    def size(self):
+        return self.redis.llen(POOL_KEY)
+
+    def acquire_refill_lock(self, ttl):
+        """Return a token if this worker may refill now, else None"""
+        # Only one worker refills at a time
+        token = secrets.token_hex(8)
+        return token if self.redis.set(REFILL_LOCK_KEY, token, nx=True, ex=int(ttl)) else None
+
+    def release_refill_lock(self, token):
+        # A refill that outlived the TTL must not delete the lock another worker now holds
+        self._release(keys=[REFILL_LOCK_KEY], args=[token])
+
+
+class SuggestionPool:
+    """Pool of ready-made suggestions kept topped up by a background thread.
+
+    ``generate(count)`` must return a list of validated, sanitized
+    suggestions; it is only ever called from the refill thread.
+    """
+
+    def __init__(self, store, generate, low_water=30, target=90, batch_size=10, lock_ttl=60):
+        self.store = store
+        self.generate = generate
+        self.low_water = low_water
+        self.target = target
+        self.batch_size = batch_size
+        self.lock_ttl = lock_ttl
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.pid = None
+        self.counters = {
+            "served": 0,
+            "misses": 0,
+            "refills": 0,
+            "generated": 0,
+            "refill_errors": 0,
+        }
+
+    def pop(self, count):
+        """Take up to ``count`` suggestions from the pool and wake the refiller if low"""
+        self.ensure_worker()
+        try:
+            suggestions = self.store.pop(count)
+            remaining = self.store.size()
+        except Exception as e:
+            logger.warning("Suggestion pool error: %s", e)
+            return []
+        self.counters["served"] += len(suggestions)
+        if len(suggestions) < count:
+            self.counters["misses"] += 1
+        if remaining < self.low_water:
+            self.wakeup.set()
+        return suggestions
+
+    def ensure_worker(self):
+        """Start the refill thread in this process (again, after a fork)"""
+        if self.thread is not None and self.thread.is_alive() and self.pid == os.getpid():
+            return
+        self.pid = os.getpid()
+        self.thread = threading.Thread(target=self._run, name="suggestion-pool-refill", daemon=True)
+        self.thread.start()
+        self.wakeup.set()
+
+    def _run(self):
+        while True:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            try:
+                self.refill()
+            except Exception as e:
+                self.counters["refill_errors"] += 1
+                logger.warning("Suggestion pool refill error: %s", e)
+                # Back off before the next attempt so a failing upstream is not hammered
+                time.sleep(5)
+
+    def refill(self):
+        """Top the pool up to the target size if it is below the low-water mark"""
+        if self.store.size() >= self.low_water:
+            return
+        token = self.store.acquire_refill_lock(self.lock_ttl)
+        if token is None:
+            return
+        try:
+            while self.store.size() < self.target:
+                suggestions = self.generate(self.batch_size)
+                if not suggestions:
+                    break
+                self.store.push(suggestions)
+                self.counters["refills"] += 1
+                self.counters["generated"] += len(suggestions)
+        finally:
+            self.store.release_refill_lock(token)
+
+    def stats(self):
+        stats = dict(self.counters)
+        try:
+            stats["size"] = self.store.size()
+        except Exception:
+            stats["size"] = None
+        return stats
+
+
+def build_suggestion_store(redis_client=None):
+    """Use Redis when a client is given, otherwise an in-memory store"""
+    if redis_client is not None:
+        return RedisSuggestionStore(redis_client)
+    return MemorySuggestionStore()
+
+
+def pool_enabled():
+    return os.getenv("SUGGESTION_POOL_ENABLED", "1") != "0"
+
+
+def build_suggestion_pool(generate, redis_client=None):
+    """Build a SuggestionPool from environment configuration"""
+    return SuggestionPool(
+        build_suggestion_store(redis_client),
+        generate,
+        low_water=int(os.getenv("SUGGESTION_POOL_LOW_WATER", "30")),
+        target=int(os.getenv("SUGGESTION_POOL_TARGET", "90")),
+        batch_size=int(os.getenv("SUGGESTION_POOL_BATCH", "10")),
+    )
@@ -0,0 +1,86 @@
+"""
+Token accounting and output caps for the LLM calls.
+
+Prompts are sent in a compact canonical form (``compact_prompt``): the
+indentation and blank-line padding of the triple-quoted source strings is
+not paid for on every call. System prompts are static and everything that
+varies per call (the wish, the number of suggestions) goes in the user
+message after them, so every call for a purpose starts with the same bytes
+and the provider can serve that prefix from its prompt cache. OpenAI does
+this automatically for prompts of 1024 tokens or more; ``cached_tokens``
+shows when it happens.
+
+Each call's usage is turned into an ``LLMCall`` that is counted per purpose
+in a ``TokenLedger`` (on /health and /metrics) and stored with the wish in
+wish_history. Calls cut off by the output cap are counted as truncated.
+
+Configuration (environment variables):
+    WISH_MAX_TOKENS        output cap for a twist (default 400)
+    SUGGESTION_MAX_TOKENS  output cap per requested suggestion (default 70)
+"""
+
+import os
+import threading
+import time
+from collections import Counter, namedtuple
+
+
+LLMCall = namedtuple("LLMCall", "prompt_tokens completion_tokens cached_tokens latency_ms truncated")
+
+
+def compact_prompt(text):
+    """Canonical form of a prompt: no indentation or trailing spaces, single blank lines"""
+    lines = [line.strip() for line in text.strip().splitlines()]
+    compact = []
+    for line in lines:
+        if line or (compact and compact[-1]):
+            compact.append(line)
+    return "\n".join(compact)
+
+
+def wish_max_tokens():
+    return int(os.getenv("WISH_MAX_TOKENS", "400"))
+
+
+def suggestion_max_tokens(count):
+    return int(os.getenv("SUGGESTION_MAX_TOKENS", "70")) * count
+
+
+def llm_call(usage, started, finish_reason=None):
+    """LLMCall for a response's usage block and the perf_counter() value the call started at"""
+    details = getattr(usage, "prompt_tokens_details", None)
+    return LLMCall(
+        prompt_tokens=getattr(usage, "prompt_tokens", None),
+        completion_tokens=getattr(usage, "completion_tokens", None),
+        cached_tokens=getattr(details, "cached_tokens", None) or 0,
+        latency_ms=int((time.perf_counter() - started) * 1000),
+        truncated=finish_reason == "length",
+    )
+
+
+class TokenLedger:
+    """Per-process token and latency totals per purpose ("wish", "suggestions")"""
+
+    def __init__(self):
+        self.counters = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, purpose, call):
+        with self._lock:
+            self.counters[f"{purpose}_calls"] += 1
+            self.counters[f"{purpose}_prompt_tokens"] += call.prompt_tokens or 0
+            self.counters[f"{purpose}_completion_tokens"] += call.completion_tokens or 0
+            self.counters[f"{purpose}_cached_tokens"] += call.cached_tokens or 0
+            self.counters[f"{purpose}_latency_ms"] += call.latency_ms
+            self.counters[f"{purpose}_truncated"] += int(call.truncated)
+
+    def stats(self):
+        """Totals plus per-call averages"""
+        with self._lock:
+            stats = dict(self.counters)
+        for key in [key for key in stats if key.endswith("_calls")]:
+            purpose = key[:-len("_calls")]
+            calls = stats[key]
+            for total in ("prompt_tokens", "completion_tokens", "latency_ms"):
+                stats[f"{purpose}_avg_{total}"] = round(stats[f"{purpose}_{total}"] / calls, 1)
+        return stats
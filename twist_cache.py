@@ -0,0 +1,268 @@
+"""
+Twist result cache with near-duplicate wish matching.
+
+Wishes are normalized (case, punctuation, the leading "I wish for/to")
+and looked up exactly first. If that misses, a MinHash signature over
+character shingles is matched through LSH buckets against earlier wishes,
+and a stored twist is reused when the estimated Jaccard similarity passes
+the threshold. Each entry keeps up to N twist variants so repeat wishes
+don't always get the same answer; an entry is only served once it has
+collected all of them.
+
+Only the model's twist text is cached. The win/lose roll still happens
+per request, and the outcome line is rewritten afterwards as usual.
+
+The cache is warmed from recent history in a background thread, started
+by the first lookup in each process; signing a couple of thousand wishes
+takes seconds of CPU, so no request waits for it, and the thread yields
+between batches so a gevent worker keeps serving. Every lookup is a miss
+until the warm-up has finished. A failed warm-up is retried by a later
+lookup, at most every TWIST_CACHE_WARM_RETRY seconds.
+
+Configuration (environment variables):
+    TWIST_CACHE_ENABLED     "0" disables the cache (default enabled)
+    TWIST_CACHE_MAX_ENTRIES LRU capacity (default 5000)
+    TWIST_CACHE_TTL         entry lifetime in seconds (default 86400)
+    TWIST_CACHE_VARIANTS    twists collected per wish before serving (default 3)
+    TWIST_CACHE_THRESHOLD   minimum estimated Jaccard similarity (default 0.8)
+    TWIST_CACHE_WARM_ROWS   recent wish_history rows loaded on first use (default 2000)
+    TWIST_CACHE_WARM_RETRY  seconds before a failed warm-up is tried again (default 60)
+"""
+
+import hashlib
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+
+
+logger = logging.getLogger(__name__)
+
+NUM_PERMUTATIONS = 64
+LSH_BANDS = 16
+LSH_ROWS = NUM_PERMUTATIONS // LSH_BANDS
+SHINGLE_SIZE = 4
+_MERSENNE_PRIME = (1 << 61) - 1
+
+_rng = random.Random(1337)
+_PERMUTATIONS = [
+    (_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME))
+    for _ in range(NUM_PERMUTATIONS)
+]
+
+_TAG_RE = re.compile(r"<[^>]+>")
+_NON_WORD_RE = re.compile(r"[^a-z0-9\s]+")
+_SPACE_RE = re.compile(r"\s+")
+_PREFIX_RE = re.compile(r"^(i wish|wish)\s+(for|to|that)?\s*")
+
+# Warm-up pairs signed between yields to other threads (and greenlets)
+WARM_BATCH = 50
+
+
+def normalize_wish(wish):
+    """Reduce a validated wish to the form used as the cache key"""
+    text = _TAG_RE.sub(" ", wish.lower())
+    text = _NON_WORD_RE.sub(" ", text)
+    text = _SPACE_RE.sub(" ", text).strip()
+    return _PREFIX_RE.sub("", text)
+
+
+def shingles(text):
+    """Character shingles of a normalized wish"""
+    if len(text) <= SHINGLE_SIZE:
+        return {text}
+    return {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def minhash(text):
+    """MinHash signature of a normalized wish"""
+    hashed = [
+        int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "big")
+        for s in shingles(text)
+    ]
+    return tuple(
+        min((a * h + b) % _MERSENNE_PRIME for h in hashed)
+        for a, b in _PERMUTATIONS
+    )
+
+
+def similarity(sig_a, sig_b):
+    """Estimated Jaccard similarity of two signatures"""
+    return sum(1 for a, b in zip(sig_a, sig_b) if a == b) / NUM_PERMUTATIONS
+
+
+def _bands(signature):
+    for band in range(LSH_BANDS):
+        start = band * LSH_ROWS
+        yield band, signature[start:start + LSH_ROWS]
+
+
+class TwistCache:
+    """In-process LRU/TTL cache of twist variants keyed by normalized wish"""
+
+    def __init__(self, max_entries=5000, ttl=86400, variants=3, threshold=0.8, warm_retry=60.0,
+                 clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.variants = variants
+        self.threshold = threshold
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.buckets = {}
+        self.lock = threading.Lock()
+        # Held while a warm-up runs; warmed is only set once one has succeeded
+        self.warming = threading.Lock()
+        self.warmed = False
+        self.warm_retry = warm_retry
+        self.retry_at = 0.0
+        self.counters = {
+            "hits": 0,
+            "exact_hits": 0,
+            "similar_hits": 0,
+            "misses": 0,
+            "bypasses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "warm_errors": 0,
+        }
+
+    def get(self, wish):
+        """Return a cached twist for this wish or a near-duplicate, or None"""
+        key = normalize_wish(wish)
+        with self.lock:
+            if not self.warmed:
+                self.counters["misses"] += 1
+                return None
+            entry = self._live_entry(key)
+            if entry is not None and len(entry["variants"]) >= self.variants:
+                self.entries.move_to_end(key)
+                self.counters["hits"] += 1
+                self.counters["exact_hits"] += 1
+                return random.choice(entry["variants"])
+            if entry is None:
+                match = self._find_similar(key)
+                if match is not None:
+                    self.entries.move_to_end(match)
+                    self.counters["hits"] += 1
+                    self.counters["similar_hits"] += 1
+                    return random.choice(self.entries[match]["variants"])
+            self.counters["misses"] += 1
+            return None
+
+    def put(self, wish, twist):
+        """Remember a twist for this wish, keeping at most ``variants`` per entry"""
+        key = normalize_wish(wish)
+        if not key:
+            return
+        with self.lock:
+            entry = self._live_entry(key)
+            if entry is None:
+                entry = {"signature": minhash(key), "variants": [], "expires_at": self.clock() + self.ttl}
+                self.entries[key] = entry
+                for band in _bands(entry["signature"]):
+                    self.buckets.setdefault(band, set()).add(key)
+                self._evict()
+            if len(entry["variants"]) < self.variants and twist not in entry["variants"]:
+                entry["variants"].append(twist)
+            self.entries.move_to_end(key)
+
+    def record_bypass(self):
+        with self.lock:
+            self.counters["bypasses"] += 1
+
+    def warm(self, pairs):
+        """Seed the cache from (wish_text, twist_result) pairs, e.g. past wish_history rows"""
+        for number, (wish_text, twist_result) in enumerate(pairs, 1):
+            if wish_text and twist_result:
+                self.put(wish_text, twist_result)
+            if number % WARM_BATCH == 0:
+                time.sleep(0)
+        self.warmed = True
+
+    def warm_in_background(self, load):
+        """Warm from ``load()`` in a thread, unless warmed, already warming or backing off
+        after a failure; return True if a warm-up was started"""
+        if self.warmed or time.monotonic() < self.retry_at or not self.warming.acquire(blocking=False):
+            return False
+        try:
+            threading.Thread(target=self._warm_from, args=(load,), name="twist-cache-warm", daemon=True).start()
+        except Exception:
+            self.warming.release()
+            raise
+        return True
+
+    def _warm_from(self, load):
+        try:
+            self.warm(load())
+        except Exception as e:
+            self.retry_at = time.monotonic() + self.warm_retry
+            with self.lock:
+                self.counters["warm_errors"] += 1
+            logger.warning("Twist cache warm-up error: %s", e)
+        finally:
+            self.warming.release()
+
+    def _live_entry(self, key):
+        entry = self.entries.get(key)
+        if entry is not None and entry["expires_at"] <= self.clock():
+            self._remove(key)
+            self.counters["expirations"] += 1
+            return None
+        return entry
+
+    def _find_similar(self, key):
+        signature = minhash(key)
+        candidates = set()
+        for band in _bands(signature):
+            candidates.update(self.buckets.get(band, ()))
+        best, best_score = None, self.threshold
+        for candidate in candidates:
+            entry = self._live_entry(candidate)
+            if entry is None or len(entry["variants"]) < self.variants:
+                continue
+            score = similarity(signature, entry["signature"])
+            if score >= best_score:
+                best, best_score = candidate, score
+        return best
+
+    def _evict(self):
+        while len(self.entries) > self.max_entries:
+            key = next(iter(self.entries))
+            self._remove(key)
+            self.counters["evictions"] += 1
+
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        for band in _bands(entry["signature"]):
+            bucket = self.buckets.get(band)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self.buckets[band]
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats["entries"] = len(self.entries)
+        stats["warmed"] = int(self.warmed)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        return stats
+
+
+def cache_enabled():
+    return os.getenv("TWIST_CACHE_ENABLED", "1") != "0"
+
+
+def build_twist_cache():
+    """Build a TwistCache from environment configuration"""
+    return TwistCache(
+        max_entries=int(os.getenv("TWIST_CACHE_MAX_ENTRIES", "5000")),
+        ttl=float(os.getenv("TWIST_CACHE_TTL", "86400")),
+        variants=int(os.getenv("TWIST_CACHE_VARIANTS", "3")),
+        threshold=float(os.getenv("TWIST_CACHE_THRESHOLD", "0.8")),
+        warm_retry=float(os.getenv("TWIST_CACHE_WARM_RETRY", "60")),
+    )
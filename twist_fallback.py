@@ -0,0 +1,287 @@
+"""
+Local twist generator for when the model is slow or down.
+
+A wish gives the model TWIST_DEADLINE seconds to answer, retries
+included. If it has not answered by then, or fails, or the circuit breaker
+is open, the paw twists the wish itself from a library of twists instead
+of answering "Service temporarily unavailable". Latency is then bounded
+by the deadline rather than by the upstream.
+
+The library has two kinds of entries, both indexed by keyword:
+
+- twists the model wrote for earlier wishes, seeded from wish_history.
+  One is reused when the new wish contains at least
+  TWIST_FALLBACK_MIN_OVERLAP of the earlier wish's keywords, so it still
+  reads as an answer to this wish. Only complete, paid-for answers are
+  seeded: rows with token usage recorded, not cut off at max_tokens, with
+  an outcome line and of a sensible length.
+- curated templates for common themes (wealth, power, immortality, ...),
+  matched on the wish's words and its scoring indicator hits, with the
+  wish filled in. A wish that matches no theme gets a generic template.
+
+The library is seeded in a background thread the first time a wish falls
+back, so no request waits on the query and concurrent fallbacks start it
+only once; they are answered from the templates until it finishes. A
+failed seed is retried by a later fallback, at most every
+TWIST_FALLBACK_SEED_RETRY seconds.
+
+Fallback twists go through the same sanitizing, scoring and outcome
+rewriting as model twists. They are not put in the twist cache.
+
+Configuration (environment variables):
+    TWIST_FALLBACK              "0" disables the fallback (default enabled)
+    TWIST_DEADLINE              seconds the model gets to twist a wish (default 10)
+    TWIST_FALLBACK_SEED_ROWS    recent wish_history rows the library is seeded from (default 5000)
+    TWIST_FALLBACK_SEED_RETRY   seconds before a failed seed is tried again (default 60)
+    TWIST_FALLBACK_MIN_OVERLAP  share of an earlier wish's keywords a wish must contain
+                                to reuse its twist (default 0.75)
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+
+from llm_client import CircuitOpenError
+from twist_cache import normalize_wish
+
+
+logger = logging.getLogger(__name__)
+
+OUTCOME_MARKER = "user outcome:"
+
+# Seeded twists outside these lengths are fragments or rambles
+MIN_TWIST_LENGTH = 60
+MAX_TWIST_LENGTH = 1500
+
+# Earlier twists kept per normalized wish
+SEED_VARIANTS = 3
+
+STOPWORDS = frozenset((
+    "a", "an", "and", "any", "are", "as", "at", "be", "been", "but", "by", "can", "could", "do", "for",
+    "from", "get", "have", "he", "her", "him", "his", "how", "i", "if", "in", "into", "is", "it", "its",
+    "just", "me", "more", "my", "myself", "no", "not", "of", "on", "one", "or", "our", "out", "she",
+    "so", "some", "than", "that", "the", "their", "them", "then", "there", "they", "this", "to", "up",
+    "us", "very", "was", "we", "were", "what", "when", "which", "who", "will", "wish", "with", "would",
+    "you", "your",
+))
+
+# (theme keywords, twist). {wish} is the normalized wish, e.g. "infinite pizza".
+TEMPLATES = (
+    (("money", "wealth", "rich", "gold", "dollar", "million", "billion", "cash", "fortune", "lottery"),
+     "Granted: {wish}. The money arrives at once, every coin of it, from a distant relative's estate. "
+     "You never met them, and the lawyers, the taxes and the cousins who did take it all back by spring."),
+    (("money", "wealth", "rich", "treasure", "gold", "jewel", "diamond"),
+     "Granted: {wish}. It is all yours, and it is all real. It is also all cursed, so nobody will take "
+     "it from you, not even as payment, and you are the richest person in town with nothing to spend."),
+    (("power", "control", "rule", "king", "queen", "president", "command", "strong", "strength"),
+     "Granted: {wish}. Everyone now obeys you exactly, down to the letter. Nobody will do anything you "
+     "have not spelled out, so you spend your days giving orders for every breath the kingdom takes."),
+    (("immortal", "forever", "eternal", "never", "live", "death", "die", "young", "age"),
+     "Granted: {wish}. You will go on and on, exactly as you are today. The world around you does not, "
+     "and one day you are the last one left who remembers anyone's name."),
+    (("famous", "fame", "celebrity", "popular", "known", "star", "followers"),
+     "Granted: {wish}. Your name is on everyone's lips by morning, attached to the most embarrassing "
+     "thing you have ever done, replayed forever and never once forgotten."),
+    (("love", "loved", "girlfriend", "boyfriend", "wife", "husband", "crush", "marry", "partner"),
+     "Granted: {wish}. They love you completely and without pause. They never leave your side, not for "
+     "a minute, not to sleep, and they have started finishing your sentences before you think of them."),
+    (("friend", "friends", "lonely", "people", "family"),
+     "Granted: {wish}. Your door never closes now. Everyone you have ever met is in your kitchen, all "
+     "at once, all the time, and none of them ever leaves."),
+    (("food", "pizza", "cake", "eat", "hungry", "chocolate", "burger", "candy", "dinner"),
+     "Granted: {wish}. It appears, warm and perfect, and it keeps appearing. It fills the table, then "
+     "the room, then the street, and you will never be able to stand the smell of it again."),
+    (("smart", "genius", "know", "knowledge", "wisdom", "wise", "intelligent", "learn", "understand"),
+     "Granted: {wish}. You understand everything now, including exactly how each of your plans will "
+     "fail, and there is no one left clever enough to talk to about it."),
+    (("healthy", "health", "cure", "heal", "sick", "pain", "disease"),
+     "Granted: {wish}. Your body is flawless from this moment on. It is so flawless that no doctor "
+     "believes anything is wrong with you, ever again, no matter what happens next."),
+    (("world", "universe", "everyone", "everything", "all", "peace", "humanity"),
+     "Granted: {wish}. The whole world changes overnight, exactly as you said. It did not change the "
+     "way you meant, and every person on earth knows the wish was yours."),
+    (("time", "day", "hour", "minute", "moment", "today", "week", "past", "future"),
+     "Granted: {wish}. Time bends to give it to you, and it takes its price in time as well: the hours "
+     "you gained are subtracted, quietly, from the end."),
+    (("happy", "happiness", "joy", "peaceful", "calm", "content", "gratitude"),
+     "Granted: {wish}. You are content, perfectly and permanently. Nothing can bother you, not even "
+     "the things that should, and you smile calmly as they happen."),
+    (("fly", "flying", "superpower", "invisible", "teleport", "magic", "powers"),
+     "Granted: {wish}. The gift is yours, but only when no one is watching, and only for as long as you "
+     "are not thinking about it."),
+)
+
+# For wishes that match no theme
+GENERIC_TEMPLATES = (
+    "Granted: {wish}. The paw gives it to you exactly as worded, and takes what the words left out.",
+    "Granted: {wish}. It arrives in full, a little late, and precisely when it is least useful.",
+    "Granted: {wish}. You get it, and so does everyone around you, which rather spoils the point.",
+    "Granted: {wish}. The paw's finger curls. The wish comes true somewhere else, for someone else, "
+    "and you hear all about it.",
+)
+
+OUTCOME_LINE = "\n\nUser outcome: LOSE"
+
+
+def fallback_enabled():
+    return os.getenv("TWIST_FALLBACK", "1") != "0"
+
+
+def twist_deadline():
+    return float(os.getenv("TWIST_DEADLINE", "10"))
+
+
+def keywords(wish):
+    """The words of a wish that say what it is about"""
+    return frozenset(word for word in normalize_wish(wish).split() if word not in STOPWORDS)
+
+
+def wish_phrase(wish):
+    """The wish as the paw repeats it, without a leading "I wish for"."""
+    phrase = normalize_wish(wish)
+    if phrase.startswith("for "):
+        phrase = phrase[4:]
+    return phrase or "your wish"
+
+
+def seed_worthy(twist, completion_tokens, max_tokens):
+    """True for a complete model twist worth reusing"""
+    if not twist or completion_tokens is None or completion_tokens >= max_tokens:
+        return False
+    return MIN_TWIST_LENGTH <= len(twist) <= MAX_TWIST_LENGTH and OUTCOME_MARKER in twist.lower()
+
+
+def failure_reason(error):
+    """Short label for why the model's answer was not used"""
+    if isinstance(error, CircuitOpenError):
+        return "breaker_open"
+    if isinstance(error, TimeoutError) or "Timeout" in type(error).__name__:
+        return "timeout"
+    return "error"
+
+
+class TwistLibrary:
+    """Keyword-indexed earlier twists and curated templates"""
+
+    def __init__(self, min_overlap=0.75, templates=TEMPLATES, generic=GENERIC_TEMPLATES, seed_retry=60.0):
+        self.min_overlap = min_overlap
+        self.seed_retry = seed_retry
+        self.generic = generic
+        self.templates = [(frozenset(words), text) for words, text in templates]
+        self.template_index = {}
+        for number, (words, _) in enumerate(self.templates):
+            for word in words:
+                self.template_index.setdefault(word, []).append(number)
+        self.seeded_twists = {}  # normalized wish -> (keywords, [twist, ...])
+        self.seed_index = {}  # keyword -> normalized wishes
+        self.lock = threading.Lock()
+        # Held while a seed runs; seeded is only set once one has succeeded
+        self.seeding = threading.Lock()
+        self.seeded = False
+        self.retry_at = 0.0
+        self.counters = {
+            "served": 0,
+            "seeded_twists": 0,
+            "templates": 0,
+            "generic": 0,
+            "seeded_rows": 0,
+            "seed_errors": 0,
+            # why the model's answer was not used (see failure_reason)
+            "timeout": 0,
+            "error": 0,
+            "breaker_open": 0,
+        }
+
+    def seed(self, rows):
+        """Add (wish_text, twist_result) pairs already checked with seed_worthy()"""
+        with self.lock:
+            for wish, twist in rows:
+                key = normalize_wish(wish)
+                words = keywords(wish)
+                if not words:
+                    continue
+                entry = self.seeded_twists.get(key)
+                if entry is None:
+                    entry = self.seeded_twists[key] = (words, [])
+                    for word in words:
+                        self.seed_index.setdefault(word, set()).add(key)
+                if len(entry[1]) < SEED_VARIANTS and twist not in entry[1]:
+                    entry[1].append(twist)
+                    self.counters["seeded_rows"] += 1
+
+    def seed_in_background(self, load):
+        """Seed from ``load()`` in a thread, unless seeded, already seeding or backing off
+        after a failure; return True if a seed was started"""
+        if self.seeded or time.monotonic() < self.retry_at or not self.seeding.acquire(blocking=False):
+            return False
+        try:
+            threading.Thread(target=self._seed_from, args=(load,), name="twist-library-seed", daemon=True).start()
+        except Exception:
+            self.seeding.release()
+            raise
+        return True
+
+    def _seed_from(self, load):
+        try:
+            self.seed(load())
+            self.seeded = True
+        except Exception as e:
+            self.retry_at = time.monotonic() + self.seed_retry
+            with self.lock:
+                self.counters["seed_errors"] += 1
+            logger.warning("Twist library seeding error: %s", e)
+        finally:
+            self.seeding.release()
+
+    def twist(self, wish, indicator_hits=(), reason="error"):
+        """Twist a validated wish locally; ``indicator_hits`` are the scorer's matched indicators"""
+        words = keywords(wish)
+        with self.lock:
+            self.counters["served"] += 1
+            self.counters[reason] += 1
+            earlier = self._earlier_twist(words)
+            if earlier is not None:
+                self.counters["seeded_twists"] += 1
+                return earlier
+            template = self._template(words | frozenset(indicator_hits))
+            self.counters["templates" if template is not None else "generic"] += 1
+        if template is None:
+            template = random.choice(self.generic)
+        return template.format(wish=wish_phrase(wish)) + OUTCOME_LINE
+
+    def _earlier_twist(self, words):
+        # Earlier wishes sharing a keyword, ranked by how much of them this wish covers
+        best, best_coverage = None, self.min_overlap
+        for key in set().union(*(self.seed_index.get(word, ()) for word in words)) if words else ():
+            entry_words, twists = self.seeded_twists[key]
+            coverage = len(entry_words & words) / len(entry_words)
+            if coverage > best_coverage or (coverage == best_coverage and best is None):
+                best, best_coverage = twists, coverage
+        return random.choice(best) if best else None
+
+    def _template(self, words):
+        hits = {}
+        for word in words:
+            for number in self.template_index.get(word, ()):
+                hits[number] = hits.get(number, 0) + 1
+        if not hits:
+            return None
+        most = max(hits.values())
+        return self.templates[random.choice([n for n, count in hits.items() if count == most])][1]
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats["seeded_wishes"] = len(self.seeded_twists)
+        stats["seeded"] = int(self.seeded)
+        return stats
+
+
+def build_twist_library():
+    """Build an empty TwistLibrary from environment configuration"""
+    return TwistLibrary(
+        min_overlap=float(os.getenv("TWIST_FALLBACK_MIN_OVERLAP", "0.75")),
+        seed_retry=float(os.getenv("TWIST_FALLBACK_SEED_RETRY", "60")),
+    )